@@ -1,5 +1,5 @@
 import os
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 
@@ -58,20 +58,110 @@ class Settings(BaseSettings):
     
     # PDF Processing Configuration
     max_pdf_size: int = 25 * 1024 * 1024  # 25MB max PDF size
+    max_pdf_pages: int = int(os.getenv("MAX_PDF_PAGES", "2000"))
+    upload_chunk_size: int = 1024 * 1024  # bytes read per chunk while receiving uploads
     supported_pdf_types: List[str] = ["application/pdf"]
     
     # Audio Processing Configuration
     audio_output_format: str = "mp3"
     audio_quality: str = "high"
     max_audio_duration: int = 10 * 60 * 60  # 10 hours max
+    audio_bitrate: str = "128k"
+    ffmpeg_path: str = os.getenv("FFMPEG_PATH", "ffmpeg")
+    encoder_pool_size: int = int(os.getenv("ENCODER_POOL_SIZE", "2"))  # warm ffmpeg processes kept per input format
+    audio_variants: str = os.getenv("AUDIO_VARIANTS", "")  # e.g. "opus-low,mp3-medium": encoded with the book; others on first request
+    variant_concurrency: int = int(os.getenv("VARIANT_CONCURRENCY", "2"))  # transcodes running at once
+    text_page_max_sentences: int = 200  # largest sentence range served by /pdf/text
+    max_sentence_chars: int = 400  # longer sentences are split at clause breaks
+    hls_segment_duration: float = float(os.getenv("HLS_SEGMENT_DURATION", "10"))  # seconds per playlist segment
+    chapter_concurrency: int = int(os.getenv("CHAPTER_CONCURRENCY", "4"))  # chapters synthesized in parallel per book
     
     # AI/ML Configuration
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     elevenlabs_api_key: str = os.getenv("ELEVENLABS_API_KEY", "")
+    elevenlabs_voice_id: str = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
+    elevenlabs_voices: str = os.getenv("ELEVENLABS_VOICES", "")  # voice_type preference -> voice ID, e.g. "premium=pNInz6obpgDQGcFMJ2JD,natural=EXAVITQu4vr4xnSDxMaL"
+    elevenlabs_model_id: str = os.getenv("ELEVENLABS_MODEL_ID", "eleven_multilingual_v2")
+    
+    # Text-to-speech Configuration
+    tts_provider: str = os.getenv("TTS_PROVIDER", "gtts")  # gtts, elevenlabs or synthetic
+    tts_max_retries: int = 3  # per chunk, with exponential backoff
+    tts_cache_max_bytes: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))  # LRU-evicted beyond this
     
     # Storage Configuration
     upload_path: str = os.getenv("UPLOAD_PATH", "/tmp/uploads")
     output_path: str = os.getenv("OUTPUT_PATH", "/tmp/outputs")
+    storage_max_bytes: int = int(os.getenv("STORAGE_MAX_BYTES", str(20 * 1024 * 1024 * 1024)))  # converted audio kept on disk
+    storage_eviction_policy: str = os.getenv("STORAGE_EVICTION_POLICY", "lru")  # lru (last streamed) or lfu (times streamed)
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "local")  # local, or s3 to share artifacts between hosts
+    s3_endpoint: str = os.getenv("S3_ENDPOINT", "")  # e.g. http://localhost:9000 for MinIO; empty for AWS
+    s3_bucket: str = os.getenv("S3_BUCKET", "")
+    s3_region: str = os.getenv("S3_REGION", "us-east-1")
+    s3_access_key_id: str = os.getenv("S3_ACCESS_KEY_ID", "")
+    s3_secret_access_key: str = os.getenv("S3_SECRET_ACCESS_KEY", "")
+    s3_prefix: str = os.getenv("S3_PREFIX", "")  # key prefix inside the bucket
+    
+    # Storage Reconciliation (orphaned uploads, partial outputs)
+    gc_interval: int = int(os.getenv("GC_INTERVAL", str(6 * 60 * 60)))  # seconds between passes; 0 disables
+    gc_min_age: int = int(os.getenv("GC_MIN_AGE", str(60 * 60)))  # files younger than this are never touched
+    gc_batch_size: int = 500  # directory entries per KV lookup
+    gc_deletes_per_minute: int = int(os.getenv("GC_DELETES_PER_MINUTE", "600"))
+    gc_dry_run: bool = os.getenv("GC_DRY_RUN", "false").lower() == "true"  # report only; passes are dry anyway while the KV store isn't live
+    
+    # Audio Delivery (who sends the bytes once a request is authorized)
+    audio_delivery: str = os.getenv("AUDIO_DELIVERY", "app")  # app, accel (nginx X-Accel-Redirect), sendfile (X-Sendfile) or redirect (signed URL)
+    accel_redirect_prefix: str = os.getenv("ACCEL_REDIRECT_PREFIX", "/protected/")  # internal location; <prefix>outputs/ maps to OUTPUT_PATH
+    signed_url_ttl: int = int(os.getenv("SIGNED_URL_TTL", "3600"))  # seconds a signed storage URL stays valid
+    signed_url_base: str = os.getenv("SIGNED_URL_BASE", "")  # local backend: public secure_link location serving the storage directories
+    signed_url_secret: str = os.getenv("SIGNED_URL_SECRET", "")
+    
+    # Next-book Prefetch (listeners with auto_play_next)
+    prefetch_enabled: bool = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+    prefetch_threshold: float = float(os.getenv("PREFETCH_THRESHOLD", "0.8"))  # fraction of the current book played
+    prefetch_segments: int = int(os.getenv("PREFETCH_SEGMENTS", "3"))  # first segments of a converted book warmed
+    prefetch_concurrency: int = int(os.getenv("PREFETCH_CONCURRENCY", "1"))  # speculative jobs at once
+    prefetch_max_conversions: int = int(os.getenv("PREFETCH_MAX_CONVERSIONS", "2"))  # running conversions a speculative one waits behind
+    prefetch_max_utilization: float = float(os.getenv("PREFETCH_MAX_UTILIZATION", "0.9"))  # of STORAGE_MAX_BYTES; no speculative conversions above it
+    prefetch_queue_size: int = 100
+    
+    # Resumable Uploads
+    resumable_upload_ttl: int = int(os.getenv("RESUMABLE_UPLOAD_TTL", str(24 * 60 * 60)))  # seconds of inactivity
+    upload_sweep_interval: int = 60 * 60  # seconds between expiry sweeps
+    
+    @property
+    def partial_upload_path(self) -> str:
+        """In-progress resumable uploads (with shared storage, only while a completed one is assembled)"""
+        return os.path.join(self.upload_path, "partial")
+    
+    @property
+    def text_cache_path(self) -> str:
+        """Normalized text cache, keyed by PDF content hash"""
+        return os.path.join(self.output_path, "text_cache")
+    
+    @property
+    def elevenlabs_voice_ids(self) -> Dict[str, str]:
+        """ElevenLabs voice ID per voice_type preference (lowercased)"""
+        pairs = (pair.partition("=") for pair in self.elevenlabs_voices.split(","))
+        return {name.strip().lower(): voice_id.strip() for name, _, voice_id in pairs if name.strip() and voice_id.strip()}
+    
+    @property
+    def audio_variant_names(self) -> List[str]:
+        """Variants to encode eagerly at the end of conversion"""
+        return [name.strip() for name in self.audio_variants.split(",") if name.strip()]
+    
+    @property
+    def tts_cache_path(self) -> str:
+        """Synthesized audio chunks, keyed by text and voice"""
+        return os.path.join(self.output_path, "tts_cache")
+    
+    # Progress Tracking
+    progress_flush_interval: float = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "5"))  # seconds between KV writes
+    
+    # Status Push (SSE / WebSocket)
+    event_heartbeat_interval: float = float(os.getenv("EVENT_HEARTBEAT_INTERVAL", "15"))
+    event_history_size: int = 1000  # events kept for Last-Event-ID resume
+    event_queue_size: int = 100  # per-subscriber buffer
+    status_batch_max_ids: int = 300  # book IDs per /pdf/status:batch request
     
     # Rate Limiting
     rate_limit_per_minute: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
@@ -107,5 +197,8 @@ if not settings.supabase_service_role_key:
 # Create required directories
 os.makedirs(settings.upload_path, exist_ok=True)
 os.makedirs(settings.output_path, exist_ok=True)
+os.makedirs(settings.text_cache_path, exist_ok=True)
+os.makedirs(settings.partial_upload_path, exist_ok=True)
+os.makedirs(settings.tts_cache_path, exist_ok=True)
 
 print(f"🔧 Configuration loaded for environment: {settings.environment}")
\ No newline at end of file
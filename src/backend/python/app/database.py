@@ -4,6 +4,7 @@ Provides KV store access and Supabase authentication
 """
 
 from typing import Optional, Dict, Any, List
+import asyncio
 import logging
 from datetime import datetime
 import httpx
@@ -19,18 +20,26 @@ SUPABASE_FUNCTION_URL = f"https://{settings.supabase_url.replace('https://', '')
 class KVStore:
     """Simple KV store interface using Supabase Edge Functions"""
     
+    # Whether lookups reach a real store; the placeholder reports every key
+    # missing, which anything deleting unreferenced data must not act on
+    live = False
+    
     def __init__(self):
         self.base_url = SUPABASE_FUNCTION_URL
         self.client = httpx.AsyncClient(timeout=10.0)
     
+    async def _get(self, key: str) -> Optional[Any]:
+        """One lookup; errors propagate"""
+        # Use Supabase Edge Function KV store
+        # This would integrate with your existing kv_store.tsx
+        logger.debug(f"KV GET: {key}")
+        # Placeholder - implement actual KV store access
+        return None
+    
     async def get(self, key: str) -> Optional[Any]:
         """Get value from KV store"""
         try:
-            # Use Supabase Edge Function KV store
-            # This would integrate with your existing kv_store.tsx
-            logger.debug(f"KV GET: {key}")
-            # Placeholder - implement actual KV store access
-            return None
+            return await self._get(key)
         except Exception as e:
             logger.error(f"KV GET error for {key}: {e}")
             return None
@@ -55,12 +64,24 @@ class KVStore:
             logger.error(f"KV DELETE error for {key}: {e}")
             return False
     
-    async def mget(self, keys: List[str]) -> Dict[str, Any]:
-        """Get multiple values"""
-        result = {}
-        for key in keys:
-            result[key] = await self.get(key)
-        return result
+    async def mget(self, keys: List[str], strict: bool = False) -> Dict[str, Any]:
+        """
+        Get multiple values, looked up concurrently until the edge function
+        offers a batched call. With `strict`, lookup errors are raised rather
+        than reported as missing keys (callers that delete what isn't
+        referenced must not mistake an outage for absence).
+        """
+        logger.debug(f"KV MGET: {len(keys)} keys")
+        values = await asyncio.gather(*(self._get(key) for key in keys), return_exceptions=True)
+        found = {}
+        for key, value in zip(keys, values):
+            if isinstance(value, Exception):
+                logger.error(f"KV MGET error for {key}: {value}")
+                if strict:
+                    raise value
+                value = None
+            found[key] = value
+        return found
     
     async def mset(self, items: Dict[str, Any]) -> bool:
         """Set multiple values"""
@@ -75,9 +96,9 @@ class KVStore:
 # Global KV store instance
 kv_store = KVStore()
 
-async def verify_user_auth(user_id: str, access_token: str) -> Optional[Dict[str, Any]]:
+async def get_token_user(access_token: str) -> Optional[Dict[str, Any]]:
     """
-    Verify user authentication via Supabase
+    User an access token belongs to, verified with Supabase
     Returns user info if valid, None otherwise
     """
     try:
@@ -95,23 +116,30 @@ async def verify_user_auth(user_id: str, access_token: str) -> Optional[Dict[str
             )
             
             if response.status_code == 200:
-                user_data = response.json()
-                
-                # Verify user ID matches
-                if user_data.get('id') == user_id:
-                    logger.info(f"✅ User authenticated: {user_id}")
-                    return user_data
-                else:
-                    logger.warning(f"⚠️ User ID mismatch: {user_id}")
-                    return None
-            else:
-                logger.warning(f"⚠️ Auth failed for user {user_id}: {response.status_code}")
-                return None
+                return response.json()
+            logger.warning(f"⚠️ Auth failed: {response.status_code}")
+            return None
                 
     except Exception as e:
         logger.error(f"❌ Auth verification error: {e}")
         return None
 
+async def verify_user_auth(user_id: str, access_token: str) -> Optional[Dict[str, Any]]:
+    """
+    Verify user authentication via Supabase
+    Returns user info if valid, None otherwise
+    """
+    user_data = await get_token_user(access_token)
+    if user_data is None:
+        return None
+    
+    # Verify user ID matches
+    if user_data.get('id') == user_id:
+        logger.info(f"✅ User authenticated: {user_id}")
+        return user_data
+    logger.warning(f"⚠️ User ID mismatch: {user_id}")
+    return None
+
 async def update_user_activity(
     user_id: str,
     activity_type: str,
@@ -173,6 +201,7 @@ async def update_user_profile(user_id: str, updates: Dict[str, Any]) -> bool:
 __all__ = [
     'kv_store',
     'verify_user_auth',
+    'get_token_user',
     'update_user_activity',
     'get_user_profile',
     'update_user_profile'
@@ -5,6 +5,7 @@ Handles PDF processing, audio conversion, and analytics
 
 import os
 import sys
+import asyncio
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -16,7 +17,13 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.config import settings
 from app.middleware import LoggingMiddleware, RateLimitMiddleware
-from app.routers import pdf_router, audio_router, analytics_router
+from app.routers import pdf_router, audio_router, analytics_router, upload_router
+from app.services.audio_encoder import encoder_pool
+from app.services.artifact_store import artifact_store
+from app.services.segment_cache import segment_cache
+from app.services.storage import storage
+from app.services.prefetch import prefetch_scheduler
+from app.services.reconciler import storage_reconciler, run_reconciler
 
 # Configure logging
 logging.basicConfig(
@@ -50,6 +57,7 @@ app.add_middleware(LoggingMiddleware)
 app.add_middleware(RateLimitMiddleware)
 
 # Include routers
+app.include_router(upload_router.router, prefix="/api/v1/pdf/uploads", tags=["PDF Processing"])
 app.include_router(pdf_router.router, prefix="/api/v1/pdf", tags=["PDF Processing"])
 app.include_router(audio_router.router, prefix="/api/v1/audio", tags=["Audio Conversion"])
 app.include_router(analytics_router.router, prefix="/api/v1/analytics", tags=["Analytics"])
@@ -87,6 +95,20 @@ async def health_check():
         }
     }
 
+# Storage and encoder metrics
+@app.get("/api/health/storage")
+async def storage_stats():
+    """Disk usage against the audio budget, evictions, reclaimed orphans, TTS cache, encoder pool and prefetch"""
+    return {
+        "timestamp": time.time(),
+        "backend": storage.stats(),
+        "audio": artifact_store.stats(),
+        "gc": storage_reconciler.stats(),
+        "tts_cache": segment_cache.stats(),
+        "encoders": encoder_pool.stats(),
+        "prefetch": prefetch_scheduler.stats()
+    }
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -97,11 +119,18 @@ async def startup_event():
     logger.info(f"🌐 CORS origins: {settings.cors_origins}")
     logger.info(f"📁 Upload path: {settings.upload_path}")
     logger.info(f"📁 Output path: {settings.output_path}")
+    logger.info(f"🗄️ Storage backend: {settings.storage_backend}")
     
     # Create required directories
     os.makedirs(settings.upload_path, exist_ok=True)
     os.makedirs(settings.output_path, exist_ok=True)
     
+    # Background maintenance
+    asyncio.create_task(upload_router.run_upload_sweeper())
+    asyncio.create_task(artifact_store.load())
+    if settings.gc_interval > 0:
+        asyncio.create_task(run_reconciler())
+    
     logger.info("✅ Magdee API startup complete")
 
 # Shutdown event
@@ -109,7 +138,10 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("🛑 Magdee API shutting down...")
-    # Add cleanup logic here if needed
+    await prefetch_scheduler.close()
+    await encoder_pool.close()
+    await artifact_store.flush()
+    await storage.close()
     logger.info("✅ Magdee API shutdown complete")
 
 # Global exception handler
@@ -1,18 +1,93 @@
-import os
-from typing import Optional
-from fastapi import APIRouter, HTTPException, Request, Response
-from fastapi.responses import StreamingResponse, FileResponse
+import bisect
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Request, Response, BackgroundTasks, Query
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 from app.config import get_settings
 from app.database import kv_store, update_user_activity
+from app.services.progress import progress_tracker
+from app.services.pipeline import process_pdf_to_audio, mark_pending
+from app.services.chapters import chapter_audio_name
+from app.services.file_streaming import RangedFileResponse
+from app.services.hls import PLAYLIST_NAME, resolve_playlist, segment_path
+from app.services.audio_probe import AudioInfo, AudioProbeError, PROBE_VERSION, cached_probe
+from app.services.waveform import level_path
+from app.services.text_artifact import ARTIFACT_EXTENSION, TextArtifact, artifact_path, cached_text_artifact
+from app.services.variants import (
+    SOURCE, SPEEDS, VARY, ACCEPT_CH, negotiate, snap_speed, variant_if_ready, ensure_speed_segment
+)
+from app.services.audio_encoder import EncoderError
+from app.services.artifact_store import artifact_store, remove_book_audio
+from app.services.storage import storage, output_key, object_response
+from app.services.delivery import offload_response
+from app.services.prefetch import prefetch_scheduler
 
 settings = get_settings()
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-@router.get("/stream/{book_id}")
-async def stream_audio(book_id: str, request: Request):
-    """Stream audio file for a book"""
+class AudioGenerationOptions(BaseModel):
+    voice_type: Optional[str] = None
+    language: Optional[str] = None
+    audio_speed: Optional[float] = None
+
+class PlaybackProgress(BaseModel):
+    position: float = Field(..., ge=0)  # seconds into the book
+    duration: Optional[float] = Field(None, gt=0)  # defaults to the converted book's
+
+# Seconds a client should wait before asking again for audio being restored
+RESTORE_RETRY_AFTER = 10
+# ... and for a whole file being rendered at another speed
+SPEED_RETRY_AFTER = 30
+
+async def restore_evicted_audio(book_id: str, book_data: dict) -> JSONResponse:
+    """
+    Audio evicted to stay within the storage budget is converted again on
+    first request (once, however many requests arrive); until then clients
+    get 503 with Retry-After. The HLS playlist reappears as soon as the first
+    segments are rendered.
+    """
+    background = None
+    if artifact_store.begin_restore(book_id):
+        logger.info(f"♻️ Restoring evicted audio of {book_id}")
+        await mark_pending(book_id, book_data)
+        background = BackgroundTask(process_pdf_to_audio, book_id, book_data["user_id"])
+    
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": "Audio is being restored",
+            "book_id": book_id,
+            "status": "restoring",
+            "playlist_url": f"/api/v1/audio/playlist/{book_id}"
+        },
+        headers={"Retry-After": str(RESTORE_RETRY_AFTER)},
+        background=background
+    )
+
+@router.api_route("/stream/{book_id}", methods=["GET", "HEAD"])
+async def stream_audio(
+    book_id: str,
+    request: Request,
+    chapter: Optional[int] = None,
+    audio_format: Optional[str] = Query(None, alias="format"),
+    quality: Optional[str] = None,
+    speed: Optional[float] = None
+):
+    """
+    Stream audio file for a book, or for one chapter of it. The variant
+    (MP3 or Opus, low/medium/high) comes from ?format= / ?quality=, else from
+    Accept and the Save-Data / ECT / Downlink client hints. ?speed= renders a
+    pitch-preserving time-stretched copy of the whole file on first request;
+    the HLS playlist does the same per segment, so switching is instant there.
+    With AUDIO_DELIVERY set, this only authorizes: nginx (X-Accel-Redirect),
+    the web server (X-Sendfile) or storage (signed URL redirect) sends the bytes.
+    """
     
     try:
         # Get book data
@@ -26,15 +101,30 @@ async def stream_audio(book_id: str, request: Request):
             if book_data["user_id"] != request.state.user_id:
                 raise HTTPException(status_code=403, detail="Unauthorized access")
         
+        if book_data.get("audio_evicted_at"):
+            return await restore_evicted_audio(book_id, book_data)
+        
         # Check if audio file exists
         if book_data.get("conversion_status") != "completed":
             raise HTTPException(status_code=404, detail="Audio not ready yet")
         
-        # For now, return a placeholder response
-        # TODO: Implement actual audio file streaming
-        audio_path = os.path.join(settings.output_path, f"{book_id}.mp3")
+        try:
+            variant = negotiate(request.headers, audio_format, quality)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        audio_key = output_key(f"{book_id}.mp3")
+        filename = book_data.get('title', 'audiobook')
         
-        if not os.path.exists(audio_path):
+        if chapter is not None:
+            chapters = book_data.get("chapters") or []
+            if not 0 <= chapter < len(chapters):
+                raise HTTPException(status_code=404, detail="Chapter not found")
+            audio_key = output_key(chapter_audio_name(book_id, chapter))
+            filename = f"{book_data.get('title', 'audiobook')} - {chapters[chapter]['title']}"
+        
+        stored = await storage.stat(audio_key)
+        if stored is None:
             # Return placeholder for development
             return {
                 "message": "Audio streaming endpoint ready",
@@ -43,26 +133,306 @@ async def stream_audio(book_id: str, request: Request):
                 "note": "Actual audio file streaming will be implemented with TTS integration"
             }
         
-        # Log audio access
-        if hasattr(request.state, "user_id"):
+        artifact_store.touch(book_id)
+        
+        # Log audio access once per playback, not for every seek
+        range_header = request.headers.get("Range", "")
+        if hasattr(request.state, "user_id") and (not range_header or range_header.replace(" ", "").startswith("bytes=0-")):
             await update_user_activity(
                 request.state.user_id,
                 "audio_stream",
                 {"book_id": book_id, "title": book_data.get("title")}
             )
         
-        # Stream the actual file
-        return FileResponse(
-            audio_path,
-            media_type="audio/mpeg",
-            filename=f"{book_data.get('title', 'audiobook')}.mp3"
-        )
+        # Variants are transcoded (from a local copy) in the background on first request; until
+        # one is ready the source plays (another speed: 503 pointing at the playlist), and if it
+        # can't be made, the source plays at 1x
+        speed = snap_speed(speed)
+        rendered_path = None
+        pending = False
+        if not variant.is_source or speed != 1.0:
+            try:
+                source_path = await storage.fetch(audio_key)
+                if source_path is None:
+                    raise HTTPException(status_code=404, detail="Audio not found")
+                rendered_path = await variant_if_ready(source_path, variant, speed)
+                pending = rendered_path is None
+            except EncoderError as e:
+                logger.warning(f"⚠️ Serving source audio, {variant.name} at {speed:g}x unavailable: {e}")
+            if pending and speed != 1.0:
+                # 1x audio isn't a stand-in for another speed; the playlist's segments are rendered one at a time
+                return JSONResponse(
+                    status_code=503,
+                    content={
+                        "detail": f"Audio at {speed:g}x is being rendered",
+                        "book_id": book_id,
+                        "status": "rendering",
+                        "playlist_url": f"/api/v1/audio/playlist/{book_id}?speed={speed:g}"
+                    },
+                    headers={"Retry-After": str(SPEED_RETRY_AFTER), "Vary": VARY}
+                )
+            if rendered_path is None:
+                variant, speed = SOURCE, 1.0
+        
+        headers = {
+            "Vary": VARY,
+            "Accept-CH": ACCEPT_CH,
+            "X-Audio-Variant": variant.name,
+            "X-Playback-Speed": f"{speed:g}"
+        }
+        if pending:
+            # A stand-in: caches mustn't keep serving it once the variant exists
+            headers["Cache-Control"] = "no-store"
+        filename = f"{filename}.{variant.extension}"
+        if rendered_path is not None:
+            offloaded = await offload_response(
+                storage.key_for(rendered_path), variant.media_type, filename, headers, in_storage=storage.is_local
+            )
+            return offloaded or RangedFileResponse(rendered_path, media_type=variant.media_type, filename=filename, headers=headers)
+        
+        # Stream the actual file unless the proxy or storage is to; Range requests get 206 partial content
+        offloaded = await offload_response(audio_key, variant.media_type, filename, headers)
+        return offloaded or object_response(stored, media_type=variant.media_type, filename=filename, headers=headers)
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Streaming failed: {str(e)}")
 
+@router.get("/playlist/{book_id}")
+async def get_playlist(book_id: str, request: Request, speed: Optional[float] = None):
+    """
+    HLS playlist for a book; grows while conversion is still running.
+    ?speed= lists time-stretched segments, rendered as they're requested.
+    """
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access if authenticated
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    speed = snap_speed(speed)
+    playlist = await storage.read_bytes(output_key(f"{book_id}.hls/{PLAYLIST_NAME}"))
+    if playlist is None:
+        if book_data.get("audio_evicted_at"):
+            return await restore_evicted_audio(book_id, book_data)
+        raise HTTPException(status_code=404, detail="Audio not ready yet")
+    
+    artifact_store.touch(book_id)
+    
+    text, segment_count, complete = resolve_playlist(playlist.decode(), f"/api/v1/audio/segment/{book_id}", speed)
+    return Response(
+        content=text,
+        media_type="application/vnd.apple.mpegurl",
+        headers={
+            # An in-progress playlist must be re-fetched; a finished one is stable
+            "Cache-Control": "private, max-age=3600" if complete else "no-cache",
+            "X-Segment-Count": str(segment_count),
+            "X-Playback-Speed": f"{speed:g}"
+        }
+    )
+
+@router.api_route("/segment/{book_id}/{segment}", methods=["GET", "HEAD"])
+async def get_segment(book_id: str, segment: str, request: Request, speed: Optional[float] = None):
+    """One immutable audio segment referenced by the playlist, at 1x or ?speed="""
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access if authenticated
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    path = segment_path(settings.output_path, book_id, segment)
+    stored = await storage.stat(storage.key_for(path)) if path is not None else None
+    if stored is None:
+        if path is not None and book_data.get("audio_evicted_at"):
+            return await restore_evicted_audio(book_id, book_data)
+        raise HTTPException(status_code=404, detail="Segment not found")
+    
+    artifact_store.touch(book_id)
+    
+    # Segment names change with every render, so their content never does
+    headers = {"Cache-Control": "private, max-age=31536000, immutable"}
+    speed = snap_speed(speed)
+    if speed != 1.0:
+        try:
+            await storage.fetch(stored.key)
+            path = await ensure_speed_segment(settings.output_path, book_id, segment, speed)
+        except EncoderError as e:
+            raise HTTPException(status_code=503, detail=f"Speed adjustment unavailable: {e}")
+        return RangedFileResponse(path, media_type="audio/mpeg", headers=headers)
+    
+    # A copy already on this host (written here, or warmed by prefetch) saves a storage round trip
+    cached = await storage.cached_copy(stored)
+    if cached is not None:
+        return RangedFileResponse(cached, media_type="audio/mpeg", headers=headers)
+    return object_response(stored, media_type="audio/mpeg", headers=headers)
+
+@router.get("/peaks/{book_id}")
+async def get_peaks(book_id: str, request: Request, resolution: int = 1000, v: Optional[str] = None):
+    """
+    Waveform min/max peaks (8-bit audiowaveform .dat) with at least
+    `resolution` pixels across the whole book, where available
+    """
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access if authenticated
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    peaks = book_data.get("peaks")
+    if not peaks:
+        raise HTTPException(status_code=404, detail="Waveform not ready yet")
+    if resolution < 1:
+        raise HTTPException(status_code=400, detail="resolution must be positive")
+    
+    stored = await storage.stat(storage.key_for(level_path(settings.output_path, book_id, peaks, resolution)))
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Waveform not ready yet")
+    
+    # Versioned URLs (from the metadata) never change content; bare ones may on regeneration
+    return object_response(
+        stored,
+        media_type="application/octet-stream",
+        headers={
+            "Cache-Control": "private, max-age=31536000, immutable" if v == peaks["version"] else "no-cache"
+        }
+    )
+
+async def _aligned_text(book_id: str) -> TextArtifact:
+    """The book's text artifact once its sentence times are filled in"""
+    path = await storage.fetch(storage.key_for(artifact_path(settings.output_path, book_id)))
+    artifact = cached_text_artifact(path) if path is not None else None
+    if artifact is None or not artifact.aligned:
+        raise HTTPException(status_code=409, detail="Text and audio are aligned once conversion completes")
+    return artifact
+
+def _text_position(book_id: str, book_data: dict, artifact: TextArtifact, sentence: int) -> Dict[str, Any]:
+    """Where a sentence sits in the text, the book audio and its chapter"""
+    start, end = artifact.sentence_times(sentence)
+    chapters = book_data.get("chapters") or []
+    chapter = bisect.bisect_right([chapter["sentence_start"] for chapter in chapters], sentence) - 1
+    chapter_start = chapters[chapter].get("start_time") if chapter >= 0 else None
+    return {
+        "book_id": book_id,
+        "sentence": sentence,
+        "page": artifact.page_of_sentence(sentence) + 1,
+        "start_time": round(start, 3),
+        "end_time": round(end, 3),
+        "chapter": chapters[chapter]["index"] if chapter >= 0 else None,
+        "chapter_time": round(start - chapter_start, 3) if chapter_start is not None else None
+    }
+
+@router.get("/seek/{book_id}")
+async def seek_to_text(book_id: str, request: Request, page: Optional[int] = None, sentence: Optional[int] = None):
+    """Audio time where a page (1-based) or sentence starts being read"""
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access if authenticated
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    if (page is None) == (sentence is None):
+        raise HTTPException(status_code=400, detail="Give either page or sentence")
+    
+    # Lookups are a few index reads on a cached mmap, cheap enough for the event loop
+    artifact = await _aligned_text(book_id)
+    if page is not None:
+        if not 1 <= page <= artifact.page_count:
+            raise HTTPException(status_code=400, detail=f"Page must be between 1 and {artifact.page_count}")
+        # A page with no sentence of its own seeks to the next one
+        sentence = min(artifact.page_bounds(page - 1)[0], artifact.sentence_count - 1)
+    elif not 0 <= sentence < artifact.sentence_count:
+        raise HTTPException(status_code=400, detail=f"Sentence must be between 0 and {artifact.sentence_count - 1}")
+    
+    return _text_position(book_id, book_data, artifact, sentence)
+
+@router.get("/position/{book_id}")
+async def position_at_time(book_id: str, request: Request, time: float = Query(..., ge=0)):
+    """Sentence and page being read `time` seconds into the book, for highlighting"""
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access if authenticated
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    artifact = await _aligned_text(book_id)
+    return _text_position(book_id, book_data, artifact, artifact.sentence_at(time))
+
+@router.post("/progress/{book_id}")
+async def report_progress(book_id: str, progress: PlaybackProgress, request: Request):
+    """
+    Playback position from the player. Near the end of a book, the listener's
+    next library item is prepared (auto_play_next), so it starts without waiting.
+    """
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access if authenticated
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    duration = progress.duration or book_data.get("duration")
+    next_book_id = await prefetch_scheduler.on_progress(book_data["user_id"], book_id, progress.position, duration)
+    return {
+        "success": True,
+        "book_id": book_id,
+        "prefetching": next_book_id
+    }
+
+async def load_audio_info(book_id: str, book_data: dict) -> Optional[AudioInfo]:
+    """Probed metadata of the book's MP3, re-probed (and stored) only if the file changed"""
+    audio_key = output_key(f"{book_id}.mp3")
+    audio_path = storage.local_path(audio_key)
+    if audio_path is None:
+        # Remote audio: the stored probe stands while the object's size matches
+        stored = await storage.stat(audio_key)
+        if stored is None:
+            return None
+        cached = book_data.get("audio_info")
+        if cached and cached.get("probe_version") == PROBE_VERSION and cached.get("size") == stored.size:
+            return AudioInfo.from_dict(cached)
+        audio_path = await storage.fetch(audio_key)
+        if audio_path is None:
+            return None
+    try:
+        info, reprobed = await asyncio.to_thread(cached_probe, audio_path, book_data.get("audio_info"))
+    except AudioProbeError as e:
+        logger.warning(f"⚠️ Can't probe {audio_path}: {e}")
+        return None
+    if reprobed:
+        book_data["audio_info"] = info.to_dict()
+        await kv_store.set(f"book:{book_id}", book_data)
+    return info
+
 @router.get("/metadata/{book_id}")
 async def get_audio_metadata(book_id: str, request: Request):
     """Get audio metadata for a book"""
@@ -79,19 +449,45 @@ async def get_audio_metadata(book_id: str, request: Request):
             if book_data["user_id"] != request.state.user_id:
                 raise HTTPException(status_code=403, detail="Unauthorized access")
         
+        audio_info = await load_audio_info(book_id, book_data)
+        
         # Return audio metadata
         metadata = {
             "book_id": book_id,
             "title": book_data.get("title"),
             "author": book_data.get("author"),
-            "duration": book_data.get("duration", 0),
+            "duration": audio_info.duration if audio_info else book_data.get("duration", 0),
             "status": book_data.get("conversion_status"),
             "created_at": book_data.get("created_at"),
             "converted_at": book_data.get("converted_at"),
-            "file_size": book_data.get("metadata", {}).get("file_size", 0),
-            "audio_format": "mp3",
-            "sample_rate": 44100,
-            "bitrate": 128
+            "file_size": audio_info.size if audio_info else 0,
+            "boilerplate_chars_removed": book_data.get("boilerplate_chars_removed", 0),
+            "playlist_url": book_data.get("playlist_url"),
+            "segment_count": book_data.get("segment_count", 0),
+            "speeds": list(SPEEDS),
+            "audio_evicted": bool(book_data.get("audio_evicted_at")),
+            "peaks_url": f"/api/v1/audio/peaks/{book_id}?v={book_data['peaks']['version']}" if book_data.get("peaks") else None,
+            "synthesis_stats": book_data.get("synthesis_stats"),
+            "chapter_source": book_data.get("chapter_source"),
+            "chapters": [
+                {
+                    "index": chapter["index"],
+                    "title": chapter["title"],
+                    "page": chapter["page"] + 1,
+                    "sentence_start": chapter["sentence_start"],
+                    "sentence_end": chapter["sentence_end"],
+                    "start_time": chapter.get("start_time"),
+                    "duration": chapter.get("duration"),
+                    "byte_offset": chapter.get("byte_offset"),
+                    "audio_url": f"/api/v1/audio/stream/{book_id}?chapter={chapter['index']}"
+                }
+                for chapter in book_data.get("chapters") or []
+            ],
+            "audio_format": audio_info.format if audio_info else None,
+            "sample_rate": audio_info.sample_rate if audio_info else None,
+            "channels": audio_info.channels if audio_info else None,
+            "bitrate": audio_info.bitrate if audio_info else None,
+            "vbr": audio_info.vbr if audio_info else None
         }
         
         return {
@@ -105,7 +501,12 @@ async def get_audio_metadata(book_id: str, request: Request):
         raise HTTPException(status_code=500, detail=f"Failed to get metadata: {str(e)}")
 
 @router.post("/generate/{book_id}")
-async def regenerate_audio(book_id: str, request: Request):
+async def regenerate_audio(
+    book_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    options: Optional[AudioGenerationOptions] = None
+):
     """Regenerate audio with different settings"""
     
     # Verify authentication
@@ -129,10 +530,18 @@ async def regenerate_audio(book_id: str, request: Request):
         book_data["updated_at"] = datetime.utcnow().isoformat()
         book_data["regeneration_requested"] = True
         
+        # Only voice settings change; the cached normalized text is reused, and
+        # so is cached audio for every chunk whose text and voice are unchanged
+        if options is not None:
+            voice_settings = book_data.get("voice_settings", {})
+            voice_settings.update(options.model_dump(exclude_none=True))
+            book_data["voice_settings"] = voice_settings
+        
         await kv_store.set(f"book:{book_id}", book_data)
+        await progress_tracker.update(book_id, user_id=book_data["user_id"], status="pending", progress=0)
         
-        # TODO: Queue for regeneration
-        # This would restart the PDF to audio conversion process
+        # Queue for regeneration
+        background_tasks.add_task(process_pdf_to_audio, book_id, book_data["user_id"])
         
         # Log activity
         await update_user_activity(
@@ -172,17 +581,23 @@ async def delete_audio(book_id: str, request: Request):
         if book_data["user_id"] != request.state.user_id:
             raise HTTPException(status_code=403, detail="Unauthorized access")
         
-        # Delete audio file
-        audio_path = os.path.join(settings.output_path, f"{book_id}.mp3")
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
+        # Delete audio files: whole book, chapters, segments, peaks and variants; the text stays
+        await storage.delete_prefix(output_key(f"{book_id}."), keep=lambda key: key.endswith(ARTIFACT_EXTENSION))
+        if not storage.is_local:
+            await asyncio.to_thread(remove_book_audio, settings.output_path, book_id)
+        artifact_store.changed(book_id)
         
         # Update book data
         book_data["audio_url"] = None
+        book_data.pop("audio_evicted_at", None)
+        book_data["playlist_url"] = None
+        book_data["segment_count"] = 0
+        book_data["peaks"] = None
         book_data["conversion_status"] = "pending"
         book_data["updated_at"] = datetime.utcnow().isoformat()
         
         await kv_store.set(f"book:{book_id}", book_data)
+        await progress_tracker.update(book_id, user_id=book_data["user_id"], status="pending", progress=0)
         
         # Log activity
         await update_user_activity(
@@ -1,19 +1,31 @@
-import os
+import json
 import uuid
+import hashlib
 import asyncio
-from typing import Optional, Dict, Any
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, BackgroundTasks
-from fastapi.responses import JSONResponse
+from typing import Optional, Dict, Any, List, AsyncIterator
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, BackgroundTasks, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.requests import HTTPConnection
+from pydantic import BaseModel
 from datetime import datetime
-import aiofiles
 
 from app.config import get_settings
-from app.database import kv_store, update_user_activity
+from app.database import kv_store, update_user_activity, get_token_user
 from app.middleware import get_client_ip
+from app.services.progress import progress_tracker, TERMINAL_STATES
+from app.services.events import event_broker, book_topic, user_topic, Subscription
+from app.services.pipeline import process_pdf_to_audio
+from app.services.pdf_validator import PDFSniffer, PDFValidationError, count_pages
+from app.services.text_artifact import TextArtifact, artifact_path, open_text_artifact
+from app.services.reconciler import delete_book_files
+from app.services.storage import storage, upload_key
 
 settings = get_settings()
 router = APIRouter()
 
+class BatchStatusRequest(BaseModel):
+    book_ids: List[str]
+
 @router.post("/upload/{user_id}")
 async def upload_pdf(
     user_id: str,
@@ -45,58 +57,43 @@ async def upload_pdf(
     try:
         # Generate unique book ID
         book_id = f"book_{uuid.uuid4()}"
-        timestamp = datetime.utcnow().isoformat()
-        
-        # Create file path
-        file_path = os.path.join(settings.upload_path, f"{book_id}_{file.filename}")
         
-        # Save uploaded file
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        # Storage key, and where conversion finds the file locally
+        file_key = upload_key(f"{book_id}_{file.filename}")
+        file_path = storage.path_for(file_key)
         
-        # Create book metadata
-        book_metadata = {
-            "id": book_id,
-            "user_id": user_id,
-            "title": title or file.filename.replace('.pdf', ''),
-            "author": author or "Unknown",
-            "file_path": file_path,
-            "original_filename": file.filename,
-            "file_size": len(content),
-            "conversion_status": "pending",
-            "upload_timestamp": timestamp,
-            "created_at": timestamp,
-            "updated_at": timestamp,
-            "progress": 0,
-            "metadata": {
-                "file_size": len(content),
-                "uploaded_from": get_client_ip(request),
-                "user_agent": request.headers.get("User-Agent", "unknown")
-            }
-        }
+        # Store uploaded file in chunks, validating the PDF as it streams in
+        sniffer = PDFSniffer(settings.max_pdf_pages)
+        digest = hashlib.sha256()
         
-        # Store book metadata
-        await kv_store.set(f"book:{book_id}", book_metadata)
+        async def receive() -> AsyncIterator[bytes]:
+            while True:
+                chunk = await file.read(settings.upload_chunk_size)
+                if not chunk:
+                    return
+                sniffer.feed(chunk)
+                digest.update(chunk)
+                yield chunk
         
-        # Add to user's books list
-        user_books = await kv_store.get(f"user:{user_id}:books") or []
-        user_books.append(book_id)
-        await kv_store.set(f"user:{user_id}:books", user_books)
+        await storage.put_stream(file_key, receive())
         
-        # Queue for processing in background
-        background_tasks.add_task(process_pdf_to_audio, book_id, user_id)
+        pdf_info = sniffer.finish()
+        if pdf_info.page_count is None:
+            local_path = await storage.fetch(file_key)
+            pdf_info.page_count = await asyncio.to_thread(count_pages, local_path, settings.max_pdf_pages)
         
-        # Log user activity
-        await update_user_activity(
-            user_id,
-            "pdf_upload",
-            {
-                "book_id": book_id,
-                "filename": file.filename,
-                "file_size": len(content),
-                "title": book_metadata["title"]
-            }
+        book_metadata = await register_uploaded_pdf(
+            request,
+            background_tasks,
+            user_id=user_id,
+            book_id=book_id,
+            file_path=file_path,
+            filename=file.filename,
+            file_size=sniffer.size,
+            content_hash=digest.hexdigest(),
+            title=title,
+            author=author,
+            pdf_info=pdf_info.to_dict()
         )
         
         return {
@@ -105,19 +102,91 @@ async def upload_pdf(
             "title": book_metadata["title"],
             "status": "uploaded",
             "message": "PDF uploaded successfully. Processing will begin shortly.",
-            "estimated_processing_time": "5-15 minutes"  # Rough estimate
+            "estimated_processing_time": "5-15 minutes",  # Rough estimate
+            "page_count": pdf_info.page_count
         }
         
+    except PDFValidationError as e:
+        await storage.delete(file_key)
+        raise HTTPException(status_code=422, detail=f"Invalid PDF: {str(e)}")
+        
     except Exception as e:
         # Clean up file if it was created
-        if 'file_path' in locals() and os.path.exists(file_path):
+        if 'file_key' in locals():
             try:
-                os.remove(file_path)
-            except:
+                await storage.delete(file_key)
+            except Exception:
                 pass
         
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+async def register_uploaded_pdf(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user_id: str,
+    book_id: str,
+    file_path: str,
+    filename: str,
+    file_size: int,
+    content_hash: str,
+    title: Optional[str] = None,
+    author: Optional[str] = None,
+    pdf_info: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Create the book record for a fully received PDF and queue it for conversion"""
+    timestamp = datetime.utcnow().isoformat()
+    
+    # Create book metadata
+    book_metadata = {
+        "id": book_id,
+        "user_id": user_id,
+        "title": title or filename.replace('.pdf', ''),
+        "author": author or "Unknown",
+        "file_path": file_path,
+        "file_key": storage.key_for(file_path),
+        "original_filename": filename,
+        "file_size": file_size,
+        "content_hash": content_hash,
+        "page_count": (pdf_info or {}).get("page_count"),
+        "conversion_status": "pending",
+        "upload_timestamp": timestamp,
+        "created_at": timestamp,
+        "updated_at": timestamp,
+        "progress": 0,
+        "metadata": {
+            "file_size": file_size,
+            "pdf": pdf_info or {},
+            "uploaded_from": await get_client_ip(request),
+            "user_agent": request.headers.get("User-Agent", "unknown")
+        }
+    }
+    
+    # Store book metadata
+    await kv_store.set(f"book:{book_id}", book_metadata)
+    await progress_tracker.update(book_id, user_id=user_id, status="pending", progress=0)
+    
+    # Add to user's books list
+    user_books = await kv_store.get(f"user:{user_id}:books") or []
+    user_books.append(book_id)
+    await kv_store.set(f"user:{user_id}:books", user_books)
+    
+    # Queue for processing in background
+    background_tasks.add_task(process_pdf_to_audio, book_id, user_id)
+    
+    # Log user activity
+    await update_user_activity(
+        user_id,
+        "pdf_upload",
+        {
+            "book_id": book_id,
+            "filename": filename,
+            "file_size": file_size,
+            "title": book_metadata["title"]
+        }
+    )
+    
+    return book_metadata
+
 @router.get("/status/{book_id}")
 async def get_processing_status(book_id: str, request: Request):
     """Get PDF processing status"""
@@ -133,21 +202,342 @@ async def get_processing_status(book_id: str, request: Request):
         if book_data["user_id"] != request.state.user_id:
             raise HTTPException(status_code=403, detail="Unauthorized access")
     
+    return await build_status(book_id, book_data)
+
+@router.post("/status:batch")
+async def get_processing_status_batch(
+    batch: BatchStatusRequest,
+    request: Request,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get processing status for many books in one request"""
+    
+    book_ids = list(dict.fromkeys(batch.book_ids))  # De-duplicate, keep order
+    
+    if len(book_ids) > settings.status_batch_max_ids:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many book IDs. Maximum is {settings.status_batch_max_ids} per request"
+        )
+    
+    # One batched read for the book records, one for the progress records
+    books = await kv_store.mget([f"book:{book_id}" for book_id in book_ids])
+    progress_records = await progress_tracker.get_many(book_ids)
+    
+    statuses = {}
+    not_found = []
+    for book_id in book_ids:
+        book_data = books.get(f"book:{book_id}")
+        
+        # Books the caller doesn't own are reported exactly like missing ones
+        if not book_data or (
+            hasattr(request.state, "user_id") and book_data["user_id"] != request.state.user_id
+        ):
+            not_found.append(book_id)
+            continue
+        
+        status = merge_status(book_id, book_data, progress_records.get(book_id))
+        statuses[book_id] = {
+            key: value for key, value in status.items()
+            if value is not None and key not in ("book_id", "title", "created_at")
+        }
+    
+    body = {"statuses": statuses, "not_found": not_found}
+    payload = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    etag = f'"{hashlib.sha1(payload.encode()).hexdigest()}"'
+    
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return Response(
+        content=payload,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+    )
+
+async def build_status(book_id: str, book_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine static book metadata with the live progress record"""
+    
+    # Fast-changing progress lives in its own record, not in book:{id}
+    return merge_status(book_id, book_data, await progress_tracker.get(book_id))
+
+def merge_status(
+    book_id: str,
+    book_data: Dict[str, Any],
+    progress: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Build the status payload from a book record and its progress record"""
+    progress = progress or {}
+    
     return {
         "book_id": book_id,
         "title": book_data["title"],
-        "status": book_data["conversion_status"],
-        "progress": book_data.get("progress", 0),
+        "status": progress.get("status", book_data["conversion_status"]),
+        "progress": progress.get("progress", book_data.get("progress", 0)),
+        "stage": progress.get("stage"),
         "created_at": book_data["created_at"],
-        "updated_at": book_data["updated_at"],
+        "updated_at": max(book_data["updated_at"], progress.get("updated_at", "")),
         "audio_url": book_data.get("audio_url"),
         "duration": book_data.get("duration"),
-        "error_message": book_data.get("error_message")
+        "error_message": progress.get("error_message", book_data.get("error_message"))
     }
 
+@router.get("/text/{book_id}")
+async def get_book_text(
+    book_id: str,
+    request: Request,
+    page: Optional[int] = None,
+    start: int = 0,
+    count: int = 50
+):
+    """Read a book's normalized text by page (1-based) or by sentence range"""
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access to this book
+    if hasattr(request.state, "user_id"):
+        if book_data["user_id"] != request.state.user_id:
+            raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    path = await storage.fetch(storage.key_for(artifact_path(settings.output_path, book_id)))
+    artifact = await asyncio.to_thread(open_text_artifact, path) if path is not None else None
+    if artifact is None:
+        raise HTTPException(status_code=409, detail="Text is not available until the book has been processed")
+    
+    with artifact:
+        if page is not None:
+            if not 1 <= page <= artifact.page_count:
+                raise HTTPException(status_code=400, detail=f"Page must be between 1 and {artifact.page_count}")
+            start, end = artifact.page_bounds(page - 1)
+        else:
+            count = max(1, min(count, settings.text_page_max_sentences))
+            start = max(0, min(start, artifact.sentence_count))
+            end = min(start + count, artifact.sentence_count)
+        
+        sentences = await asyncio.to_thread(_read_sentences, artifact, start, end)
+        
+        return {
+            "book_id": book_id,
+            "page": page,
+            "page_count": artifact.page_count,
+            "sentence_count": artifact.sentence_count,
+            "start": start,
+            "end": end,
+            "sentences": sentences
+        }
+
+def _read_sentences(artifact: TextArtifact, start: int, end: int) -> List[Dict[str, Any]]:
+    """Sentence texts with their page and audio times (blocking)"""
+    result = []
+    for offset, text in enumerate(artifact.sentence_range(start, end)):
+        index = start + offset
+        times = artifact.sentence_times(index)
+        result.append({
+            "index": index,
+            "page": artifact.page_of_sentence(index) + 1,
+            "text": text,
+            "start_time": times[0] if times else None,
+            "end_time": times[1] if times else None
+        })
+    return result
+
+async def authenticated_user_id(connection: HTTPConnection, access_token: Optional[str] = None) -> Optional[str]:
+    """
+    The caller's user ID for an event stream: from the auth middleware where it
+    ran (it never does for WebSocket handshakes), else from an access token
+    verified here. Browsers can't set headers on EventSource or WebSocket
+    requests, so the token may come as ?access_token=. None if unauthenticated.
+    """
+    user_id = getattr(connection.state, "user_id", None)
+    if user_id:
+        return user_id
+    if not access_token:
+        authorization = connection.headers.get("Authorization", "")
+        access_token = authorization[7:] if authorization.startswith("Bearer ") else None
+    if not access_token:
+        return None
+    user = await get_token_user(access_token)
+    return user.get("id") if user else None
+
+@router.get("/events/user/{user_id}")
+async def stream_library_events(
+    user_id: str,
+    request: Request,
+    access_token: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-Sent Events stream of status changes for all of a user's books"""
+    
+    # Verify authentication
+    caller_id = await authenticated_user_id(request, access_token)
+    if caller_id is None:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    if caller_id != user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    subscription = event_broker.subscribe(user_topic(user_id), last_event_id)
+    snapshots = progress_tracker.active_for_user(user_id)
+    
+    return _sse_response(request, subscription, snapshots, close_on_terminal=False)
+
+@router.get("/events/{book_id}")
+async def stream_book_events(
+    book_id: str,
+    request: Request,
+    access_token: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-Sent Events stream of status and progress for one book"""
+    
+    # Verify authentication
+    caller_id = await authenticated_user_id(request, access_token)
+    if caller_id is None:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    
+    # Verify user has access to this book
+    if book_data["user_id"] != caller_id:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+    
+    subscription = event_broker.subscribe(book_topic(book_id), last_event_id)
+    snapshots = [await build_status(book_id, book_data)]
+    
+    return _sse_response(request, subscription, snapshots, close_on_terminal=True)
+
+@router.websocket("/events/user/{user_id}/ws")
+async def library_events_websocket(
+    websocket: WebSocket,
+    user_id: str,
+    access_token: Optional[str] = None,
+    last_event_id: Optional[str] = None
+):
+    """WebSocket variant of the library status stream; authenticate with ?access_token="""
+    
+    # Verify authentication (HTTP middleware doesn't run for WebSockets)
+    caller_id = await authenticated_user_id(websocket, access_token)
+    if caller_id is None or caller_id != user_id:
+        await websocket.close(code=4401 if caller_id is None else 4403)
+        return
+    
+    await websocket.accept()
+    subscription = event_broker.subscribe(user_topic(user_id), last_event_id)
+    snapshots = progress_tracker.active_for_user(user_id)
+    
+    await _websocket_pump(websocket, subscription, snapshots, close_on_terminal=False)
+
+@router.websocket("/events/{book_id}/ws")
+async def book_events_websocket(
+    websocket: WebSocket,
+    book_id: str,
+    access_token: Optional[str] = None,
+    last_event_id: Optional[str] = None
+):
+    """WebSocket variant of the single book status stream; authenticate with ?access_token="""
+    
+    # Verify authentication (HTTP middleware doesn't run for WebSockets)
+    caller_id = await authenticated_user_id(websocket, access_token)
+    if caller_id is None:
+        await websocket.close(code=4401)
+        return
+    
+    book_data = await kv_store.get(f"book:{book_id}")
+    
+    if not book_data:
+        await websocket.close(code=4404)
+        return
+    
+    # Verify user has access to this book
+    if book_data["user_id"] != caller_id:
+        await websocket.close(code=4403)
+        return
+    
+    await websocket.accept()
+    subscription = event_broker.subscribe(book_topic(book_id), last_event_id)
+    snapshots = [await build_status(book_id, book_data)]
+    
+    await _websocket_pump(websocket, subscription, snapshots, close_on_terminal=True)
+
+def _sse_response(
+    request: Request,
+    subscription: Subscription,
+    snapshots: List[Dict[str, Any]],
+    close_on_terminal: bool
+) -> StreamingResponse:
+    """Wrap a subscription in an SSE response"""
+    
+    async def event_stream() -> AsyncIterator[str]:
+        async with subscription:
+            yield f"retry: {int(settings.event_heartbeat_interval * 1000)}\n\n"
+            
+            # Fresh connections start from the current state; resumed ones get the replay
+            if not subscription.replayed:
+                for snapshot in snapshots:
+                    yield f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+                    if close_on_terminal and snapshot.get("status") in TERMINAL_STATES:
+                        return
+            
+            while not await request.is_disconnected():
+                event = await subscription.next(settings.event_heartbeat_interval)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                if close_on_terminal and event["data"].get("status") in TERMINAL_STATES:
+                    return
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering
+        }
+    )
+
+async def _websocket_pump(
+    websocket: WebSocket,
+    subscription: Subscription,
+    snapshots: List[Dict[str, Any]],
+    close_on_terminal: bool
+) -> None:
+    """Forward subscription events to a WebSocket client"""
+    
+    async with subscription:
+        try:
+            if not subscription.replayed:
+                for snapshot in snapshots:
+                    await websocket.send_json({"event": "snapshot", "data": snapshot})
+                    if close_on_terminal and snapshot.get("status") in TERMINAL_STATES:
+                        await websocket.close()
+                        return
+            
+            while True:
+                event = await subscription.next(settings.event_heartbeat_interval)
+                if event is None:
+                    await websocket.send_json({"event": "heartbeat"})
+                    continue
+                
+                await websocket.send_json({"id": event["id"], "event": event["event"], "data": event["data"]})
+                if close_on_terminal and event["data"].get("status") in TERMINAL_STATES:
+                    await websocket.close()
+                    return
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
 @router.delete("/{book_id}")
-async def delete_pdf(book_id: str, request: Request):
-    """Delete a PDF and its associated data"""
+async def delete_pdf(book_id: str, request: Request, background_tasks: BackgroundTasks):
+    """
+    Delete a PDF and its associated data. The record goes at once; files are
+    removed in the background (and by the storage reconciler if that fails).
+    """
     
     # Verify user authentication
     if not hasattr(request.state, "user"):
@@ -164,15 +554,6 @@ async def delete_pdf(book_id: str, request: Request):
         raise HTTPException(status_code=403, detail="Unauthorized access")
     
     try:
-        # Remove files
-        if book_data.get("file_path") and os.path.exists(book_data["file_path"]):
-            os.remove(book_data["file_path"])
-        
-        if book_data.get("audio_url"):
-            audio_path = book_data["audio_url"].replace("/api/v1/audio/stream/", settings.output_path + "/")
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-        
         # Remove from user's books list
         user_books = await kv_store.get(f"user:{request.state.user_id}:books") or []
         if book_id in user_books:
@@ -181,6 +562,8 @@ async def delete_pdf(book_id: str, request: Request):
         
         # Remove book metadata
         await kv_store.delete(f"book:{book_id}")
+        await progress_tracker.forget(book_id)
+        background_tasks.add_task(delete_book_files, book_id, book_data.get("file_path"), book_data.get("file_key"))
         
         # Log activity
         await update_user_activity(
@@ -193,70 +576,3 @@ async def delete_pdf(book_id: str, request: Request):
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Delete failed: {str(e)}")
-
-async def process_pdf_to_audio(book_id: str, user_id: str):
-    """Background task to process PDF to audio"""
-    
-    try:
-        # Update status to processing
-        book_data = await kv_store.get(f"book:{book_id}")
-        if not book_data:
-            return
-        
-        book_data["conversion_status"] = "processing"
-        book_data["updated_at"] = datetime.utcnow().isoformat()
-        await kv_store.set(f"book:{book_id}", book_data)
-        
-        # TODO: Implement actual PDF to audio conversion
-        # This is where you would integrate with:
-        # - PDF text extraction (PyPDF2, pdfplumber, etc.)
-        # - Text-to-speech service (ElevenLabs, Azure, Google, etc.)
-        # - Audio file generation and optimization
-        
-        # Simulate processing with progress updates
-        for progress in [10, 25, 50, 75, 90]:
-            await asyncio.sleep(5)  # Simulate work
-            book_data["progress"] = progress
-            book_data["updated_at"] = datetime.utcnow().isoformat()
-            await kv_store.set(f"book:{book_id}", book_data)
-        
-        # Mark as completed
-        book_data["conversion_status"] = "completed"
-        book_data["progress"] = 100
-        book_data["converted_at"] = datetime.utcnow().isoformat()
-        book_data["audio_url"] = f"/api/v1/audio/stream/{book_id}"
-        book_data["duration"] = 3600  # Example: 1 hour
-        await kv_store.set(f"book:{book_id}", book_data)
-        
-        # TODO: Send notification to user about completion
-        # This would integrate with your notification system
-        
-        # Log completion
-        await update_user_activity(
-            user_id,
-            "pdf_processed",
-            {
-                "book_id": book_id,
-                "title": book_data["title"],
-                "processing_time": "simulated"
-            }
-        )
-        
-    except Exception as e:
-        # Mark as failed
-        book_data = await kv_store.get(f"book:{book_id}")
-        if book_data:
-            book_data["conversion_status"] = "failed"
-            book_data["error_message"] = str(e)
-            book_data["updated_at"] = datetime.utcnow().isoformat()
-            await kv_store.set(f"book:{book_id}", book_data)
-        
-        # Log error
-        await update_user_activity(
-            user_id,
-            "pdf_processing_error",
-            {
-                "book_id": book_id,
-                "error": str(e)
-            }
-        )
\ No newline at end of file
@@ -0,0 +1,489 @@
+import os
+import json
+import time
+import uuid
+import base64
+import hashlib
+import binascii
+import asyncio
+import logging
+import weakref
+from typing import AsyncIterator, Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Request, Response, BackgroundTasks, Header
+from datetime import datetime
+from email.utils import formatdate
+import aiofiles
+
+from app.config import get_settings
+from app.routers.pdf_router import register_uploaded_pdf
+from app.services.pdf_extractor import file_sha256
+from app.services.pdf_validator import PDFValidationError, check_head, sniff_file, count_pages, HEAD_SIZE
+from app.services.storage import storage, upload_key
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# Resumable upload protocol (tus 1.0 core + creation, termination, checksum, expiration)
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination,checksum,expiration"
+TUS_HEADERS = {"Tus-Resumable": TUS_VERSION}
+
+# Serializes PATCH requests per upload on this host so offsets can't interleave;
+# a lock lives only while requests for its upload hold it (expired, abandoned
+# and unknown uploads leave nothing behind). Across hosts, the offset check
+# against the shared session covers clients sending one PATCH at a time.
+_upload_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# Sessions live in storage, so with a shared backend any host can take the next
+# request. Locally, received bytes are appended to one part file; with shared
+# storage each PATCH's bytes are an object of their own, keyed by their offset,
+# downloaded into the part file once the last one has arrived.
+
+def _part_path(upload_id: str) -> str:
+    return os.path.join(settings.partial_upload_path, f"{upload_id}.part")
+
+def _session_path(upload_id: str) -> str:
+    return os.path.join(settings.partial_upload_path, f"{upload_id}.json")
+
+def _session_key(upload_id: str) -> str:
+    return upload_key(f"partial/{upload_id}.json")
+
+def _chunk_key(upload_id: str, offset: int) -> str:
+    return upload_key(f"partial/{upload_id}/{offset:015d}")
+
+async def _once(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+def _parse_upload_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Parse the tus Upload-Metadata header: comma-separated `key base64(value)` pairs"""
+    metadata = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, encoded = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(encoded).decode("utf-8") if encoded else ""
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"Invalid Upload-Metadata value for '{key}'", headers=TUS_HEADERS)
+    return metadata
+
+def _parse_upload_checksum(header: Optional[str]) -> Optional[bytes]:
+    """Expected digest from the tus Upload-Checksum header (`sha256 base64(digest)`), if sent"""
+    if header is None:
+        return None
+    algorithm, _, encoded = header.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise HTTPException(status_code=400, detail=f"Unsupported checksum algorithm '{algorithm}'", headers=TUS_HEADERS)
+    try:
+        return base64.b64decode(encoded.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid Upload-Checksum value", headers=TUS_HEADERS)
+
+def _expires_header(session: Dict[str, Any]) -> str:
+    return formatdate(session["last_activity"] + settings.resumable_upload_ttl, usegmt=True)
+
+async def _load_session(user_id: str, upload_id: str, request: Request) -> Dict[str, Any]:
+    """Load an upload session and verify the caller owns it"""
+    data = await storage.read_bytes(_session_key(upload_id)) if upload_id.startswith("upload_") else None
+    if data is None:
+        raise HTTPException(status_code=404, detail="Upload not found", headers=TUS_HEADERS)
+    session = json.loads(data)
+
+    if time.time() - session["last_activity"] > settings.resumable_upload_ttl:
+        await _remove_upload(upload_id)
+        raise HTTPException(status_code=410, detail="Upload expired", headers=TUS_HEADERS)
+
+    if session["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Upload not found", headers=TUS_HEADERS)
+
+    if hasattr(request.state, "user_id") and session["user_id"] != request.state.user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized access", headers=TUS_HEADERS)
+
+    return session
+
+async def _save_session(session: Dict[str, Any]) -> None:
+    await storage.put_stream(_session_key(session["upload_id"]), _once(json.dumps(session).encode()))
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _remove_local_upload(upload_id: str) -> None:
+    """Delete the partial file and session of an upload on this host (blocking)"""
+    _remove_file(_part_path(upload_id))
+    _remove_file(_session_path(upload_id))
+
+async def _remove_upload(upload_id: str) -> None:
+    """Delete the received bytes and session of an upload"""
+    await asyncio.to_thread(_remove_local_upload, upload_id)
+    if not storage.is_local:
+        await storage.delete_prefix(upload_key(f"partial/{upload_id}"))
+
+async def _current_offset(session: Dict[str, Any]) -> int:
+    if not storage.is_local:
+        return session.get("offset", 0)
+    stored = await storage.stat(storage.key_for(_part_path(session["upload_id"])))
+    return stored.size if stored is not None else 0
+
+async def _append_local(session: Dict[str, Any], request: Request, offset: int, expected_digest: Optional[bytes]) -> int:
+    """
+    Append the request body to the part file; returns the new offset. A dropped
+    connection keeps the bytes received so far, unless the chunk is
+    checksummed: then it's verified whole or discarded.
+    """
+    part_path = _part_path(session["upload_id"])
+    start = offset
+    digest = hashlib.sha256() if expected_digest is not None else None
+    try:
+        async with aiofiles.open(part_path, "ab") as f:
+            async for chunk in request.stream():
+                if offset + len(chunk) > session["length"]:
+                    raise HTTPException(status_code=413, detail="Chunk exceeds Upload-Length", headers=TUS_HEADERS)
+                await f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                offset += len(chunk)
+        if digest is not None and digest.digest() != expected_digest:
+            raise HTTPException(status_code=460, detail="Checksum mismatch, chunk discarded", headers=TUS_HEADERS)
+    except BaseException:
+        if digest is not None:
+            await asyncio.to_thread(os.truncate, part_path, start)
+        raise
+    return offset
+
+async def _append_shared(session: Dict[str, Any], request: Request, offset: int, expected_digest: Optional[bytes]) -> int:
+    """
+    Store the request body as the upload's chunk at `offset`; returns the new
+    offset. Only whole (and, if checksummed, matching) chunks are kept: the
+    client resumes a dropped one from its start.
+    """
+    start = offset
+    digest = hashlib.sha256() if expected_digest is not None else None
+
+    async def receive() -> AsyncIterator[bytes]:
+        nonlocal offset
+        async for chunk in request.stream():
+            if offset + len(chunk) > session["length"]:
+                raise HTTPException(status_code=413, detail="Chunk exceeds Upload-Length", headers=TUS_HEADERS)
+            if digest is not None:
+                digest.update(chunk)
+            offset += len(chunk)
+            yield chunk
+        # Raised before the last bytes are stored, so the storage write is abandoned
+        if digest is not None and digest.digest() != expected_digest:
+            raise HTTPException(status_code=460, detail="Checksum mismatch, chunk discarded", headers=TUS_HEADERS)
+
+    await storage.put_stream(_chunk_key(session["upload_id"], start), receive())
+    if offset > start:
+        session["chunks"].append(start)
+        session["offset"] = offset
+    return offset
+
+async def _read_head(session: Dict[str, Any]) -> bytes:
+    """The first HEAD_SIZE bytes received"""
+    if storage.is_local:
+        async with aiofiles.open(_part_path(session["upload_id"]), "rb") as f:
+            return await f.read(HEAD_SIZE)
+    head = bytearray()
+    for start in session["chunks"]:
+        if len(head) >= HEAD_SIZE:
+            break
+        async for data in storage.get_range(_chunk_key(session["upload_id"], start), 0, HEAD_SIZE - len(head) - 1):
+            head += data
+    return bytes(head)
+
+async def _assemble(session: Dict[str, Any]) -> None:
+    """Download the chunks of a complete upload into its part file on this host"""
+    await asyncio.to_thread(os.makedirs, settings.partial_upload_path, exist_ok=True)
+    async with aiofiles.open(_part_path(session["upload_id"]), "wb") as f:
+        for start in session["chunks"]:
+            async for data in storage.get_range(_chunk_key(session["upload_id"], start)):
+                await f.write(data)
+
+@router.options("")
+async def upload_options():
+    """Advertise resumable upload capabilities"""
+    return Response(status_code=204, headers={
+        **TUS_HEADERS,
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(settings.max_pdf_size),
+        "Tus-Checksum-Algorithm": "sha256"
+    })
+
+@router.post("/{user_id}")
+async def create_upload(
+    user_id: str,
+    request: Request,
+    upload_length: int = Header(...),
+    upload_metadata: Optional[str] = Header(None)
+):
+    """Start a resumable PDF upload"""
+
+    # Verify user authentication (handled by middleware)
+    if not hasattr(request.state, "user"):
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    if request.state.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+
+    metadata = _parse_upload_metadata(upload_metadata)
+    filename = os.path.basename(metadata.get("filename", ""))
+
+    # Validate file
+    if not filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported", headers=TUS_HEADERS)
+
+    if upload_length <= 0 or upload_length > settings.max_pdf_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {settings.max_pdf_size // (1024*1024)}MB",
+            headers=TUS_HEADERS
+        )
+
+    upload_id = f"upload_{uuid.uuid4().hex}"
+    session = {
+        "upload_id": upload_id,
+        "user_id": user_id,
+        "length": upload_length,
+        "filename": filename,
+        "title": metadata.get("title"),
+        "author": metadata.get("author"),
+        "checksum": metadata.get("sha256"),  # hex digest of the whole file, optional
+        "created_at": datetime.utcnow().isoformat(),
+        "last_activity": time.time()
+    }
+
+    if storage.is_local:
+        await asyncio.to_thread(os.makedirs, settings.partial_upload_path, exist_ok=True)
+        async with aiofiles.open(_part_path(upload_id), "wb"):
+            pass
+    else:
+        session["offset"] = 0
+        session["chunks"] = []  # offsets of the stored chunks, in order
+    await _save_session(session)
+
+    logger.info(f"📥 Resumable upload created: {upload_id} ({upload_length} bytes)")
+
+    return Response(status_code=201, headers={
+        **TUS_HEADERS,
+        "Location": f"{request.url.path}/{upload_id}",
+        "Upload-Offset": "0",
+        "Upload-Expires": _expires_header(session)
+    })
+
+@router.head("/{user_id}/{upload_id}")
+async def get_upload_offset(user_id: str, upload_id: str, request: Request):
+    """Report how many bytes of an upload have been received"""
+
+    session = await _load_session(user_id, upload_id, request)
+
+    return Response(status_code=200, headers={
+        **TUS_HEADERS,
+        "Upload-Offset": str(await _current_offset(session)),
+        "Upload-Length": str(session["length"]),
+        "Upload-Expires": _expires_header(session),
+        "Cache-Control": "no-store"
+    })
+
+@router.patch("/{user_id}/{upload_id}")
+async def append_upload_chunk(
+    user_id: str,
+    upload_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    upload_offset: int = Header(...),
+    content_type: Optional[str] = Header(None),
+    upload_checksum: Optional[str] = Header(None)
+):
+    """
+    Append a chunk at the given offset; the final chunk hands off to conversion.
+    A chunk sent with Upload-Checksum is kept only if it arrives whole and matches.
+    """
+
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream", headers=TUS_HEADERS)
+    expected_digest = _parse_upload_checksum(upload_checksum)
+
+    lock = _upload_locks.get(upload_id)
+    if lock is None:
+        lock = _upload_locks[upload_id] = asyncio.Lock()
+    async with lock:
+        session = await _load_session(user_id, upload_id, request)
+
+        offset = await _current_offset(session)
+        if upload_offset != offset:
+            raise HTTPException(status_code=409, detail=f"Offset mismatch, expected {offset}", headers=TUS_HEADERS)
+
+        append = _append_local if storage.is_local else _append_shared
+        try:
+            offset = await append(session, request, offset, expected_digest)
+        finally:
+            session["last_activity"] = time.time()
+            await _save_session(session)
+
+        # Reject non-PDFs as soon as the head has arrived, not after the last chunk
+        if not session.get("head_checked") and offset >= min(HEAD_SIZE, session["length"]):
+            head = await _read_head(session)
+            try:
+                check_head(head, settings.max_pdf_pages)
+            except PDFValidationError as e:
+                await _remove_upload(upload_id)
+                raise HTTPException(status_code=422, detail=f"Invalid PDF: {str(e)}", headers=TUS_HEADERS)
+            session["head_checked"] = True
+            await _save_session(session)
+        
+        if offset < session["length"]:
+            return Response(status_code=204, headers={
+                **TUS_HEADERS,
+                "Upload-Offset": str(offset),
+                "Upload-Expires": _expires_header(session)
+            })
+
+        book = await _complete_upload(session, request, background_tasks)
+
+    return Response(
+        status_code=200,
+        media_type="application/json",
+        headers={**TUS_HEADERS, "Upload-Offset": str(offset)},
+        content=json.dumps({
+            "success": True,
+            "book_id": book["id"],
+            "title": book["title"],
+            "status": "uploaded",
+            "message": "PDF uploaded successfully. Processing will begin shortly."
+        })
+    )
+
+@router.delete("/{user_id}/{upload_id}")
+async def terminate_upload(user_id: str, upload_id: str, request: Request):
+    """Abandon an upload and discard the received bytes"""
+
+    await _load_session(user_id, upload_id, request)
+    await _remove_upload(upload_id)
+
+    return Response(status_code=204, headers=TUS_HEADERS)
+
+async def _complete_upload(
+    session: Dict[str, Any],
+    request: Request,
+    background_tasks: BackgroundTasks
+) -> Dict[str, Any]:
+    """Verify the assembled file and hand it to the conversion queue"""
+    upload_id = session["upload_id"]
+    part_path = _part_path(upload_id)
+    if not storage.is_local:
+        await _assemble(session)
+
+    content_hash = await asyncio.to_thread(file_sha256, part_path)
+    if session.get("checksum") and session["checksum"].lower() != content_hash:
+        await _remove_upload(upload_id)
+        raise HTTPException(status_code=460, detail="Checksum mismatch, upload discarded", headers=TUS_HEADERS)
+    
+    try:
+        pdf_info = await asyncio.to_thread(sniff_file, part_path, settings.max_pdf_pages)
+        if pdf_info.page_count is None:
+            pdf_info.page_count = await asyncio.to_thread(count_pages, part_path, settings.max_pdf_pages)
+    except PDFValidationError as e:
+        await _remove_upload(upload_id)
+        raise HTTPException(status_code=422, detail=f"Invalid PDF: {str(e)}", headers=TUS_HEADERS)
+
+    book_id = f"book_{uuid.uuid4()}"
+    file_key = upload_key(f"{book_id}_{session['filename']}")
+    file_path = storage.path_for(file_key)
+    await asyncio.to_thread(os.replace, part_path, file_path)
+
+    try:
+        # Shared storage gets its copy before the book exists
+        await storage.publish(file_path)
+        book = await register_uploaded_pdf(
+            request,
+            background_tasks,
+            user_id=session["user_id"],
+            book_id=book_id,
+            file_path=file_path,
+            filename=session["filename"],
+            file_size=session["length"],
+            content_hash=content_hash,
+            title=session.get("title"),
+            author=session.get("author"),
+            pdf_info=pdf_info.to_dict()
+        )
+    except Exception as e:
+        # Neither this host's copy nor a published one outlives the failed registration
+        try:
+            await asyncio.to_thread(_remove_file, file_path)
+            await storage.delete(file_key)
+        except Exception as cleanup_error:
+            logger.warning(f"⚠️ Could not remove {file_key} after a failed upload: {cleanup_error}")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    finally:
+        await _remove_upload(upload_id)
+
+    logger.info(f"✅ Resumable upload {upload_id} completed as {book_id}")
+    return book
+
+def expire_stale_uploads() -> int:
+    """Remove partial uploads on this host with no activity within the TTL (blocking); returns the count"""
+    if not os.path.isdir(settings.partial_upload_path):
+        return 0
+
+    expired = 0
+    cutoff = time.time() - settings.resumable_upload_ttl
+    with os.scandir(settings.partial_upload_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".part"):
+                continue
+            upload_id = entry.name[:-len(".part")]
+            try:
+                with open(_session_path(upload_id)) as f:
+                    last_activity = json.load(f)["last_activity"]
+            except Exception:
+                last_activity = entry.stat().st_mtime
+            if last_activity < cutoff:
+                _remove_local_upload(upload_id)
+                expired += 1
+    return expired
+
+async def expire_shared_uploads() -> int:
+    """Remove partial uploads in shared storage with no activity within the TTL; returns the count"""
+    sessions, chunked = [], set()
+    async for key in storage.list_keys(upload_key("partial/")):
+        name = key[len(upload_key("partial/")):]
+        if name.endswith(".json") and "/" not in name:
+            sessions.append(name[:-len(".json")])
+        elif "/" in name:
+            chunked.add(name.partition("/")[0])
+
+    expired = 0
+    cutoff = time.time() - settings.resumable_upload_ttl
+    for upload_id in sessions:
+        data = await storage.read_bytes(_session_key(upload_id))
+        try:
+            last_activity = json.loads(data)["last_activity"]
+        except Exception:
+            last_activity = 0
+        if last_activity < cutoff:
+            await _remove_upload(upload_id)
+            expired += 1
+    # Chunks left behind by a removal that failed halfway
+    for upload_id in chunked.difference(sessions):
+        await storage.delete_prefix(upload_key(f"partial/{upload_id}/"))
+    return expired
+
+async def run_upload_sweeper() -> None:
+    """Periodically expire abandoned partial uploads"""
+    while True:
+        try:
+            expired = await asyncio.to_thread(expire_stale_uploads)
+            if not storage.is_local:
+                expired += await expire_shared_uploads()
+            if expired:
+                logger.info(f"🧹 Expired {expired} abandoned uploads")
+        except Exception as e:
+            logger.error(f"❌ Upload sweeper error: {e}")
+        await asyncio.sleep(settings.upload_sweep_interval)
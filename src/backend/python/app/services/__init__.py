@@ -0,0 +1,57 @@
+"""
+Magdee Backend Services
+"""
+
+from app.services import events
+from app.services import progress
+from app.services import pdf_extractor
+from app.services import pdf_validator
+from app.services import boilerplate
+from app.services import text_normalizer
+from app.services import text_artifact
+from app.services import chapters
+from app.services import alignment
+from app.services import file_streaming
+from app.services import storage
+from app.services import delivery
+from app.services import mp3_frames
+from app.services import mp3_joiner
+from app.services import audio_probe
+from app.services import waveform
+from app.services import artifact_store
+from app.services import reconciler
+from app.services import variants
+from app.services import hls
+from app.services import segment_cache
+from app.services import tts_engine
+from app.services import audio_encoder
+from app.services import pipeline
+from app.services import prefetch
+
+__all__ = [
+    'events',
+    'progress',
+    'pdf_extractor',
+    'pdf_validator',
+    'boilerplate',
+    'text_normalizer',
+    'text_artifact',
+    'chapters',
+    'alignment',
+    'file_streaming',
+    'storage',
+    'delivery',
+    'mp3_frames',
+    'mp3_joiner',
+    'audio_probe',
+    'waveform',
+    'artifact_store',
+    'reconciler',
+    'variants',
+    'hls',
+    'segment_cache',
+    'tts_engine',
+    'audio_encoder',
+    'pipeline',
+    'prefetch'
+]
@@ -0,0 +1,65 @@
+"""
+Sentence-to-audio alignment
+Synthesis reports how long each chunk (a run of whole sentences) plays, so
+chunk boundaries are exact; the sentences inside a chunk share its time in
+proportion to their length. Each chapter's chunk times are scaled to the span
+its frames occupy in the book MP3, and the result is written into the text
+artifact's time index.
+"""
+
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.services.chapters import Chapter
+from app.services.text_artifact import update_sentence_times
+
+logger = logging.getLogger(__name__)
+
+class SentenceAligner:
+    """Chunk timings per chapter; write() turns them into per-sentence times"""
+
+    def __init__(self):
+        self.chunks: Dict[int, List[Tuple[int, int, float]]] = {}
+
+    def add_chapter(self, index: int, chunks: List[Tuple[int, int, float]]) -> None:
+        """(sentence start, end, duration) of each chunk synthesized for a chapter"""
+        self.chunks[index] = sorted(chunks)
+
+    def times(self, sentences: Sequence[str], chapters: List[Chapter]) -> np.ndarray:
+        """(start, end) seconds per sentence, never decreasing"""
+        times = np.zeros((len(sentences), 2), dtype=np.float64)
+        clock = 0.0
+        for chapter in sorted(chapters, key=lambda chapter: chapter.index):
+            chunks = self.chunks.get(chapter.index, [])
+            clock = chapter.start_time if chapter.start_time is not None else clock
+            reported = sum(duration for _, _, duration in chunks)
+            scale = chapter.duration / reported if reported and chapter.duration else 1.0
+
+            position = chapter.sentence_start
+            for first, last, duration in chunks:
+                # Sentences that produced no audio take no time
+                times[position:first] = clock
+                weights = np.array([len(sentence) + 1 for sentence in sentences[first:last]], dtype=np.float64)
+                edges = clock + np.concatenate(([0.0], np.cumsum(weights))) * (duration * scale / weights.sum())
+                times[first:last, 0] = edges[:-1]
+                times[first:last, 1] = edges[1:]
+                clock = float(edges[-1])
+                position = last
+            times[position:chapter.sentence_end] = clock
+
+        # Guards against overlapping chapter spans from rounding
+        np.maximum.accumulate(times[:, 0], out=times[:, 0])
+        np.maximum(times[:, 1], times[:, 0], out=times[:, 1])
+        return times
+
+    def write(self, path: str, sentences: Sequence[str], chapters: List[Chapter]) -> None:
+        """Fill in the artifact's time index (blocking)"""
+        times = self.times(sentences, chapters)
+        update_sentence_times(path, times)
+        logger.info(f"⏱️ Aligned {len(times)} sentences over {times[-1, 1] if len(times) else 0:.0f}s of audio")
+
+__all__ = [
+    'SentenceAligner'
+]
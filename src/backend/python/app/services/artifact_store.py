@@ -0,0 +1,320 @@
+"""
+Disk budget for converted audio
+Everything rendered for a book (book and chapter MP3s, HLS segments, variants,
+waveform peaks) is one unit of eviction; the text artifact stays, being small
+and needed for reading along. When the audio outgrows STORAGE_MAX_BYTES, the
+least recently streamed books (or least often, with STORAGE_EVICTION_POLICY=lfu)
+are removed. Books being converted are pinned. An evicted book is converted
+again on its next request, mostly from the cached normalized text and the TTS
+segment cache. With shared (S3) storage the budget covers the local working
+copies only; the bucket still has the audio, so eviction doesn't touch records.
+"""
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, Optional, Set, Tuple
+
+from app.config import get_settings
+from app.database import kv_store
+from app.services.text_artifact import ARTIFACT_EXTENSION
+from app.services.storage import storage
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+STATE_FILE = ".artifact_store.json"
+
+@dataclass
+class BookUsage:
+    bytes: int = 0
+    last_access: float = 0.0
+    accesses: int = 0
+
+def disk_usage(path: str) -> int:
+    """Bytes used by a file, or by everything under a directory (blocking)"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+def _book_entries(output_path: str, book_ids: Optional[Set[str]] = None) -> Iterator[Tuple[str, os.DirEntry]]:
+    """(book ID, entry) for each audio artifact in the output directory, or only those of `book_ids`"""
+    with os.scandir(output_path) as entries:
+        for entry in entries:
+            book_id, dot, _ = entry.name.partition(".")
+            if not dot or not book_id or entry.name.endswith(ARTIFACT_EXTENSION):
+                continue
+            if book_ids is None or book_id in book_ids:
+                yield book_id, entry
+
+def scan_usage(output_path: str, book_ids: Optional[Set[str]] = None) -> Dict[str, Tuple[int, float]]:
+    """(bytes, newest mtime) of each book's audio artifacts (blocking)"""
+    usage: Dict[str, Tuple[int, float]] = {}
+    for book_id, entry in _book_entries(output_path, book_ids):
+        try:
+            size = disk_usage(entry.path)
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+        except FileNotFoundError:
+            continue
+        total, newest = usage.get(book_id, (0, 0.0))
+        usage[book_id] = (total + size, max(newest, mtime))
+    return usage
+
+def remove_book_audio(output_path: str, book_id: str) -> int:
+    """Delete everything rendered for a book except its text artifact; returns bytes freed (blocking)"""
+    freed = 0
+    for _, entry in list(_book_entries(output_path, {book_id})):
+        try:
+            freed += disk_usage(entry.path)
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    return freed
+
+class ArtifactStore:
+    """
+    Per-book usage index over the output directory, built by one scan on first
+    use and kept current as books are converted, streamed and evicted.
+    Access times and counts are saved alongside the audio so the eviction
+    order survives restarts. Event loop only; disk work runs in threads.
+    """
+
+    def __init__(self, output_path: str, max_bytes: int, policy: str = "lru", refresh_delay: float = 5.0):
+        self.output_path = output_path
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.refresh_delay = refresh_delay
+        self.total_bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.restores = 0
+        self._books: Dict[str, BookUsage] = {}
+        self._pins: Dict[str, int] = {}
+        self._restoring: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._load_lock: Optional[asyncio.Lock] = None
+        self._loaded = False
+        self._last_save = 0.0
+        self._unsaved = False
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.output_path, STATE_FILE)
+
+    def _read_state(self) -> Dict[str, Any]:
+        try:
+            with open(self._state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_state(self, state: Dict[str, Any]) -> None:
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self._state_path)
+
+    async def load(self) -> None:
+        """Build the index from disk; books never streamed count as accessed when last written"""
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self._loaded:
+                return
+            usage = await asyncio.to_thread(scan_usage, self.output_path)
+            state = await asyncio.to_thread(self._read_state)
+            for book_id, (size, mtime) in usage.items():
+                last_access, accesses = state.get(book_id, (mtime, 0))
+                self._books[book_id] = BookUsage(size, last_access, accesses)
+            self.total_bytes = sum(book.bytes for book in self._books.values())
+            self._loaded = True
+            logger.info(
+                f"🗄️ Audio storage: {len(self._books)} books, {self.total_bytes / 1024 / 1024:.1f} MB "
+                f"of {self.max_bytes / 1024 / 1024:.0f} MB"
+            )
+        await self.enforce()
+
+    async def flush(self) -> None:
+        """Save access times if any changed since the last save (shutdown)"""
+        if self._loaded and self._unsaved:
+            await self.save()
+
+    async def save(self) -> None:
+        """Persist access times and counts"""
+        state = {book_id: [book.last_access, book.accesses] for book_id, book in self._books.items()}
+        self._last_save = time.monotonic()
+        self._unsaved = False
+        try:
+            await asyncio.to_thread(self._write_state, state)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not save storage state: {e}")
+
+    def touch(self, book_id: str) -> None:
+        """Record a stream of the book's audio (cheap; call on every request)"""
+        book = self._books.setdefault(book_id, BookUsage())
+        book.last_access = time.time()
+        book.accesses += 1
+        self._unsaved = True
+        if self._loaded and time.monotonic() - self._last_save > 60:
+            self._last_save = time.monotonic()
+            asyncio.create_task(self.save())
+
+    def changed(self, book_id: str) -> None:
+        """The book's audio was written to; its size is re-measured shortly, then the budget applied"""
+        self._dirty.add(book_id)
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_later())
+
+    async def _refresh_later(self) -> None:
+        await asyncio.sleep(self.refresh_delay)
+        await self.refresh()
+
+    async def refresh(self, book_ids: Optional[Iterable[str]] = None) -> None:
+        """Re-measure books written since the last refresh (or `book_ids`), then enforce the budget"""
+        await self.load()
+        dirty = set(book_ids) if book_ids is not None else set()
+        dirty |= self._dirty
+        self._dirty.clear()
+        if dirty:
+            usage = await asyncio.to_thread(scan_usage, self.output_path, dirty)
+            for book_id in dirty:
+                size = usage.get(book_id, (0, 0.0))[0]
+                book = self._books.setdefault(book_id, BookUsage(last_access=time.time()))
+                self.total_bytes += size - book.bytes
+                book.bytes = size
+        await self.enforce()
+
+    def forget(self, book_id: str) -> None:
+        """The book was deleted"""
+        book = self._books.pop(book_id, None)
+        if book is not None:
+            self.total_bytes -= book.bytes
+        self._unsaved = True
+
+    @contextmanager
+    def pinned(self, book_id: str):
+        """Keep a book's audio from being evicted for the duration (e.g. while converting)"""
+        self._pins[book_id] = self._pins.get(book_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._pins[book_id] -= 1
+            if not self._pins[book_id]:
+                del self._pins[book_id]
+
+    def _eviction_order(self) -> list:
+        candidates = [
+            (book_id, book) for book_id, book in self._books.items()
+            if book.bytes > 0 and book_id not in self._pins
+        ]
+        if self.policy == "lfu":
+            candidates.sort(key=lambda item: (item[1].accesses, item[1].last_access))
+        else:
+            candidates.sort(key=lambda item: item[1].last_access)
+        return [book_id for book_id, _ in candidates]
+
+    async def enforce(self) -> int:
+        """Evict books until usage is within budget; returns how many were evicted"""
+        if not self._loaded or self.total_bytes <= self.max_bytes:
+            return 0
+        evicted = 0
+        order = self._eviction_order()
+        # The most recent book stays even if it alone is over budget
+        for book_id in order[:-1]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            # Pinned since the order was taken (a conversion just started)
+            if book_id in self._pins:
+                continue
+            await self.evict(book_id)
+            evicted += 1
+        if self.total_bytes > self.max_bytes:
+            logger.warning(f"⚠️ Audio storage over budget with nothing left to evict ({self.total_bytes / 1024 / 1024:.1f} MB)")
+        await self.save()
+        return evicted
+
+    async def evict(self, book_id: str) -> int:
+        """Remove a book's audio and mark its record so the next request restores it; returns bytes freed"""
+        freed = await asyncio.to_thread(remove_book_audio, self.output_path, book_id)
+        book = self._books.get(book_id)
+        if book is not None:
+            self.total_bytes -= book.bytes
+            book.bytes = 0
+        self.evictions += 1
+        self.evicted_bytes += freed
+
+        book_data = await kv_store.get(f"book:{book_id}") if storage.is_local else None
+        if book_data:
+            book_data["audio_evicted_at"] = datetime.utcnow().isoformat()
+            await kv_store.set(f"book:{book_id}", book_data)
+        logger.info(f"🧹 Evicted audio of {book_id} ({freed / 1024 / 1024:.1f} MB)")
+        return freed
+
+    def begin_restore(self, book_id: str) -> bool:
+        """Claim the restore of an evicted book; False if it's already being converted"""
+        if book_id in self._restoring or book_id in self._pins:
+            return False
+        self._restoring.add(book_id)
+        self.restores += 1
+        return True
+
+    def end_restore(self, book_id: str) -> None:
+        self._restoring.discard(book_id)
+
+    def is_pinned(self, book_id: str) -> bool:
+        return book_id in self._pins
+
+    def pinned_count(self) -> int:
+        """Books being written right now, i.e. conversions running on this host"""
+        return len(self._pins)
+
+    def usage(self, book_id: str) -> Optional[BookUsage]:
+        return self._books.get(book_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "books": sum(1 for book in self._books.values() if book.bytes > 0),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "utilization": round(self.total_bytes / self.max_bytes, 4) if self.max_bytes else None,
+            "policy": self.policy,
+            "pinned": len(self._pins),
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "restores": self.restores,
+            "restoring": len(self._restoring)
+        }
+
+artifact_store = ArtifactStore(
+    settings.output_path,
+    settings.storage_max_bytes,
+    settings.storage_eviction_policy
+)
+
+__all__ = [
+    'ArtifactStore',
+    'BookUsage',
+    'artifact_store',
+    'scan_usage',
+    'disk_usage',
+    'remove_book_audio'
+]
@@ -0,0 +1,299 @@
+"""
+Streaming MP3 encoding through ffmpeg
+PCM is piped to an ffmpeg subprocess chunk by chunk and the encoded output is
+written to disk as it arrives, so memory stays bounded by the pipe buffers no
+matter how long the book is. ffmpeg can't be handed a second stream once its
+input is closed, so reuse across jobs takes the form of a pool of warm,
+already-started processes waiting on stdin.
+"""
+
+import os
+import asyncio
+import logging
+import contextvars
+from typing import Dict, List, Optional, Tuple
+
+import aiofiles
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+class EncoderError(Exception):
+    """ffmpeg is missing or failed to encode"""
+
+# Seconds between samples of the worker's resident memory while a job is measured
+MEMORY_SAMPLE_INTERVAL = 1.0
+
+def _process_memory_kb(pid: int, field: str = "VmHWM") -> int:
+    """
+    A memory figure of a live process from /proc (VmHWM: peak resident set,
+    VmRSS: current), 0 where /proc isn't available (blocking)
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+class JobMemory:
+    """
+    Peak resident memory of one job, measured while it runs (async with).
+    The worker's own high-water mark covers its whole lifetime, so its
+    resident set is sampled on a timer instead; each encoder process serves a
+    single job, so its high-water mark is the job's.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.worker_kb = 0
+        self.encoder_kb = 0
+        self._task: Optional[asyncio.Task] = None
+        self._token = None
+
+    async def _sample(self) -> None:
+        self.worker_kb = max(self.worker_kb, await asyncio.to_thread(_process_memory_kb, os.getpid(), "VmRSS"))
+
+    async def _run(self) -> None:
+        while True:
+            await self._sample()
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> "JobMemory":
+        self._token = _job_memory.set(self)
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        _job_memory.reset(self._token)
+
+    def add_encoder(self, peak_kb: int) -> None:
+        self.encoder_kb = max(self.encoder_kb, peak_kb)
+
+    def to_dict(self) -> Dict[str, float]:
+        # /proc reports KiB
+        return {
+            "worker": round(self.worker_kb / 1024, 1),
+            "encoder": round(self.encoder_kb / 1024, 1)
+        }
+
+# The job being measured in the current task (and tasks it starts)
+_job_memory: "contextvars.ContextVar[Optional[JobMemory]]" = contextvars.ContextVar("job_memory", default=None)
+
+def peak_rss_mb() -> Dict[str, float]:
+    """High-water resident memory of the worker and of any single encoder so far in the current job"""
+    job = _job_memory.get()
+    return job.to_dict() if job is not None else {}
+
+def ffmpeg_args(sample_rate: int, channels: int) -> List[str]:
+    """Raw s16le PCM on stdin -> constant bitrate MP3 on stdout"""
+    return [
+        settings.ffmpeg_path,
+        "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        "-c:a", "libmp3lame", "-b:a", settings.audio_bitrate, "-write_xing", "0",
+        "-f", "mp3", "pipe:1"
+    ]
+
+class StreamingEncoder:
+    """One encode: write PCM in order, then finish() to publish the MP3 at `output_path`"""
+
+    def __init__(self, process: asyncio.subprocess.Process, output_path: str):
+        self.process = process
+        self.output_path = output_path
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._tmp_path = f"{output_path}.tmp"
+        self._stderr = bytearray()
+        self._reader = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        """Copy encoded output to disk as it is produced, and keep stderr from filling up"""
+        async def read_stderr():
+            while True:
+                data = await self.process.stderr.read(READ_SIZE)
+                if not data:
+                    return
+                self._stderr += data[:4096 - len(self._stderr)]
+
+        stderr_task = asyncio.create_task(read_stderr())
+        try:
+            async with aiofiles.open(self._tmp_path, "wb") as f:
+                while True:
+                    data = await self.process.stdout.read(READ_SIZE)
+                    if not data:
+                        break
+                    await f.write(data)
+                    self.bytes_out += len(data)
+        finally:
+            await stderr_task
+
+    async def write(self, pcm: bytes) -> None:
+        """Feed PCM; waits while ffmpeg's input pipe is full (backpressure)"""
+        if self._reader.done():
+            await self._reader  # surface the reader's error
+            raise EncoderError("Encoder exited early")
+        try:
+            self.process.stdin.write(pcm)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            raise EncoderError(f"Encoder exited early: {bytes(self._stderr).decode(errors='replace')}")
+        self.bytes_in += len(pcm)
+
+    async def finish(self) -> int:
+        """Close input, wait for the last frames and move the file into place; returns its size"""
+        # Read while the process is still alive; it served only this encode
+        job = _job_memory.get()
+        if job is not None:
+            job.add_encoder(await asyncio.to_thread(_process_memory_kb, self.process.pid))
+        self.process.stdin.close()
+        await self._reader
+        returncode = await self.process.wait()
+        if returncode != 0:
+            await self.abort()
+            raise EncoderError(f"ffmpeg exited with {returncode}: {bytes(self._stderr).decode(errors='replace')}")
+        os.replace(self._tmp_path, self.output_path)
+        return self.bytes_out
+
+    async def abort(self) -> None:
+        if self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        self._reader.cancel()
+        try:
+            await self._reader
+        except (asyncio.CancelledError, Exception):
+            pass
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+class EncoderPool:
+    """
+    Keeps `size` idle ffmpeg processes per input format. Taking one schedules
+    a replacement in the background, so the next job starts on a warm process.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: Dict[Tuple[int, int], List[asyncio.subprocess.Process]] = {}
+        self._spawning: Dict[Tuple[int, int], int] = {}
+        self.spawned = 0
+        self.reused = 0
+
+    async def _spawn(self, audio_format: Tuple[int, int]) -> asyncio.subprocess.Process:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ffmpeg_args(*audio_format),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise EncoderError(f"ffmpeg not found at '{settings.ffmpeg_path}'; install it or set FFMPEG_PATH")
+        self.spawned += 1
+        return process
+
+    async def _refill(self, audio_format: Tuple[int, int]) -> None:
+        idle = self._idle.setdefault(audio_format, [])
+        if len(idle) + self._spawning.get(audio_format, 0) >= self.size:
+            return
+        self._spawning[audio_format] = self._spawning.get(audio_format, 0) + 1
+        try:
+            idle.append(await self._spawn(audio_format))
+        except EncoderError as e:
+            logger.warning(f"⚠️ Could not pre-start encoder: {e}")
+        finally:
+            self._spawning[audio_format] -= 1
+
+    async def warm(self, sample_rate: int, channels: int = 1) -> None:
+        """Pre-start processes for a format (e.g. at startup)"""
+        for _ in range(self.size):
+            await self._refill((sample_rate, channels))
+
+    async def open(self, output_path: str, sample_rate: int, channels: int = 1) -> StreamingEncoder:
+        audio_format = (sample_rate, channels)
+        idle = self._idle.setdefault(audio_format, [])
+        process = None
+        while idle:
+            candidate = idle.pop()
+            if candidate.returncode is None:
+                process = candidate
+                self.reused += 1
+                break
+        if process is None:
+            process = await self._spawn(audio_format)
+
+        asyncio.create_task(self._refill(audio_format))
+        return StreamingEncoder(process, output_path)
+
+    async def close(self) -> None:
+        """Stop idle processes (shutdown)"""
+        for processes in self._idle.values():
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        self._idle.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "idle": sum(len(processes) for processes in self._idle.values()),
+            "spawned": self.spawned,
+            "reused": self.reused
+        }
+
+async def transcode(source_path: str, output_path: str, codec_args: List[str]) -> int:
+    """
+    Re-encode a file with ffmpeg (e.g. into a lower-bitrate variant), publishing
+    it atomically at `output_path`; returns its size
+    """
+    tmp_path = f"{output_path}.tmp"
+    try:
+        process = await asyncio.create_subprocess_exec(
+            settings.ffmpeg_path,
+            "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+            "-i", source_path, "-map_metadata", "-1", "-vn",
+            *codec_args, tmp_path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise EncoderError(f"ffmpeg not found at '{settings.ffmpeg_path}'; install it or set FFMPEG_PATH")
+
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    finally:
+        if process.returncode != 0 and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if process.returncode != 0:
+        raise EncoderError(f"ffmpeg exited with {process.returncode}: {stderr[:4096].decode(errors='replace')}")
+    os.replace(tmp_path, output_path)
+    return os.path.getsize(output_path)
+
+encoder_pool = EncoderPool(settings.encoder_pool_size)
+
+__all__ = [
+    'EncoderError',
+    'StreamingEncoder',
+    'EncoderPool',
+    'encoder_pool',
+    'ffmpeg_args',
+    'transcode',
+    'peak_rss_mb',
+    'JobMemory'
+]
@@ -0,0 +1,236 @@
+"""
+Audio metadata probing
+Reads duration, bitrate, sample rate and channel count from container headers
+without decoding: the Xing/Info or VBRI header of an MP3 (with the LAME/Lavc
+encoder delay and padding for an exact length), a frame scan when there is no
+such header, and the OpusHead packet plus the last page's granule position for
+Ogg Opus. Results are stored with the file's mtime and size and reused until
+the file changes.
+"""
+
+import os
+import struct
+import logging
+from dataclasses import dataclass, asdict, fields
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.services.mp3_frames import FrameHeader, parse_header, id3v2_size, side_info_size, iter_frames
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever probing changes, so stored results are recomputed
+PROBE_VERSION = 1
+
+HEAD_SIZE = 16 * 1024
+TAIL_SIZE = 64 * 1024
+SCAN_BLOCK = 1024 * 1024
+OPUS_RATE = 48000  # Opus granule positions always count 48 kHz samples
+
+class AudioProbeError(ValueError):
+    """The file isn't audio in a format we can read"""
+
+@dataclass
+class AudioInfo:
+    """What players and clients need to know about an encoded file"""
+    format: str  # "mp3" or "opus"
+    duration: float
+    sample_rate: int
+    channels: int
+    bitrate: int  # average kbit/s
+    vbr: bool
+    size: int
+    mtime: float
+    frames: Optional[int] = None  # MP3 only
+    seek_table: Optional[List[int]] = None  # Xing TOC: 1/256ths of the file at each percent
+    probe_version: int = PROBE_VERSION
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AudioInfo":
+        known = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+def _encoder_gap(data: bytes, offset: int) -> Tuple[int, int]:
+    """(delay, padding) samples from a LAME/Lavc tag at `offset`, (0, 0) without one"""
+    if data[offset:offset + 4] not in (b"LAME", b"Lavc", b"Lavf") or len(data) < offset + 24:
+        return 0, 0
+    packed = int.from_bytes(data[offset + 21:offset + 24], "big")
+    return packed >> 12, packed & 0xFFF
+
+def _xing(data: bytes, frame: FrameHeader) -> Optional[Dict[str, Any]]:
+    """Fields of a Xing/Info header in `frame`, or None"""
+    position = frame.offset + 4 + side_info_size(frame)
+    tag = data[position:position + 4]
+    if tag not in (b"Xing", b"Info") or len(data) < position + 8:
+        return None
+    flags = struct.unpack(">I", data[position + 4:position + 8])[0]
+    position += 8
+    header: Dict[str, Any] = {"vbr": tag == b"Xing", "frames": None, "bytes": None, "toc": None}
+    if flags & 0x1:
+        header["frames"] = struct.unpack(">I", data[position:position + 4])[0]
+        position += 4
+    if flags & 0x2:
+        header["bytes"] = struct.unpack(">I", data[position:position + 4])[0]
+        position += 4
+    if flags & 0x4:
+        header["toc"] = list(data[position:position + 100])
+        position += 100
+    if flags & 0x8:
+        position += 4
+    header["delay"], header["padding"] = _encoder_gap(data, position)
+    return header
+
+def _vbri(data: bytes, frame: FrameHeader) -> Optional[Dict[str, Any]]:
+    """Byte and frame counts of a VBRI header in `frame`, or None"""
+    position = frame.offset + 36
+    if data[position:position + 4] != b"VBRI" or len(data) < position + 18:
+        return None
+    size, frames = struct.unpack(">II", data[position + 10:position + 18])
+    return {"vbr": True, "frames": frames, "bytes": size, "toc": None, "delay": 0, "padding": 0}
+
+def _scan_mp3(f, start: int) -> Tuple[int, int, set]:
+    """(frames, audio bytes, bitrates) by walking every frame header from `start`"""
+    frames = audio_bytes = 0
+    bitrates = set()
+    f.seek(start)
+    pending = b""
+    while True:
+        block = f.read(SCAN_BLOCK)
+        data = pending + block
+        offset = 0
+        while offset + 4 <= len(data):
+            header = parse_header(data, offset)
+            if header is None or header.length <= 4:
+                if data[offset:offset + 3] == b"TAG":
+                    return frames, audio_bytes, bitrates
+                offset += 1
+                continue
+            if offset + header.length > len(data):
+                break
+            frames += 1
+            audio_bytes += header.length
+            bitrates.add(header.bitrate)
+            offset += header.length
+        pending = data[offset:]
+        if not block:
+            return frames, audio_bytes, bitrates
+
+def probe_mp3(path: str) -> AudioInfo:
+    """Probe an MP3 file; reads only the first frame unless it has no Xing/VBRI header"""
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        start = id3v2_size(f.read(10))
+        f.seek(start)
+        head = f.read(HEAD_SIZE)
+        first = next(iter_frames(head), None)
+        if first is None:
+            raise AudioProbeError("No MPEG audio frames")
+
+        header = _xing(head, first) or _vbri(head, first)
+        if header and header["frames"]:
+            samples = header["frames"] * first.samples - header["delay"] - header["padding"]
+            audio_bytes = header["bytes"] or (stat.st_size - start - first.offset)
+            frames, vbr, bitrates = header["frames"], header["vbr"], None
+        else:
+            frames, audio_bytes, bitrates = _scan_mp3(f, start + first.offset)
+            samples = frames * first.samples
+            vbr = len(bitrates) > 1
+
+    duration = samples / first.sample_rate
+    if vbr or header is not None:
+        bitrate = round(audio_bytes * 8 / duration / 1000) if duration else first.bitrate
+    else:
+        bitrate = next(iter(bitrates), first.bitrate)
+    return AudioInfo(
+        format="mp3",
+        duration=round(duration, 3),
+        sample_rate=first.sample_rate,
+        channels=first.channels,
+        bitrate=bitrate,
+        vbr=vbr,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        frames=frames,
+        seek_table=header["toc"] if header else None
+    )
+
+def _ogg_packet_start(data: bytes, offset: int) -> int:
+    """Offset of the first packet on the Ogg page at `offset`"""
+    return offset + 27 + data[offset + 26]
+
+def probe_opus(path: str) -> AudioInfo:
+    """Probe an Ogg Opus file from its first and last pages"""
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        head = f.read(HEAD_SIZE)
+        f.seek(max(0, stat.st_size - TAIL_SIZE))
+        tail = f.read(TAIL_SIZE)
+
+    if head[:4] != b"OggS" or len(head) < 28:
+        raise AudioProbeError("Not an Ogg stream")
+    packet = _ogg_packet_start(head, 0)
+    if head[packet:packet + 8] != b"OpusHead":
+        raise AudioProbeError("Ogg stream isn't Opus")
+    channels = head[packet + 9]
+    pre_skip, input_rate = struct.unpack("<HI", head[packet + 10:packet + 16])
+
+    # The last page with a real granule position gives the total sample count
+    granule = -1
+    position = len(tail)
+    while granule < 0:
+        position = tail.rfind(b"OggS", 0, position)
+        if position < 0:
+            raise AudioProbeError("No complete Ogg page at the end of the file")
+        if len(tail) >= position + 14 and tail[position + 4] == 0:
+            granule = struct.unpack("<q", tail[position + 6:position + 14])[0]
+
+    duration = max(0, granule - pre_skip) / OPUS_RATE
+    return AudioInfo(
+        format="opus",
+        duration=round(duration, 3),
+        sample_rate=input_rate or OPUS_RATE,
+        channels=channels,
+        bitrate=round(stat.st_size * 8 / duration / 1000) if duration else 0,
+        vbr=True,
+        size=stat.st_size,
+        mtime=stat.st_mtime
+    )
+
+def probe_audio(path: str) -> AudioInfo:
+    """Probe an MP3 or Ogg Opus file (blocking)"""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic == b"OggS":
+        return probe_opus(path)
+    return probe_mp3(path)
+
+def cached_probe(path: str, cached: Optional[Dict[str, Any]]) -> Tuple[Optional[AudioInfo], bool]:
+    """
+    The stored probe result while the file's mtime and size still match,
+    otherwise a fresh probe. Returns (info, reprobed); info is None if the
+    file is missing. Only stats the file on a hit (blocking).
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None, False
+
+    if cached and cached.get("probe_version") == PROBE_VERSION:
+        if cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime:
+            return AudioInfo.from_dict(cached), False
+
+    info = probe_audio(path)
+    logger.info(f"🔎 Probed {os.path.basename(path)}: {info.duration:.1f}s {info.format} {info.bitrate} kbps")
+    return info, True
+
+__all__ = [
+    'AudioInfo',
+    'AudioProbeError',
+    'PROBE_VERSION',
+    'probe_audio',
+    'probe_mp3',
+    'probe_opus',
+    'cached_probe'
+]
@@ -0,0 +1,217 @@
+"""
+Running header/footer and boilerplate removal
+Finds lines repeated at the top or bottom of many pages (running heads, page
+numbers, copyright footers) so they are not read aloud on every page
+"""
+
+import re
+import zlib
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever detection changes, so cached normalized text is rebuilt
+BOILERPLATE_VERSION = 2
+
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+_PAGE_NUMBER = re.compile(r"^(?:page\s*)?(\d+|[ivxlcdm]+)(?:\s*(?:of|/)\s*\d+)?$")
+_ROMAN = re.compile(r"^m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})$")
+_ROMAN_VALUES = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100, "d": 500, "m": 1000}
+
+# Pages apart two page numbers may be and still confirm each other
+SEQUENCE_WINDOW = 2
+
+def _canonical(line: str) -> str:
+    """Lowercase, digits folded to '#', whitespace collapsed"""
+    return _SPACES.sub(" ", _DIGITS.sub("#", line.lower())).strip()
+
+def _roman_value(numeral: str) -> Optional[int]:
+    """Value of a well-formed lowercase roman numeral, else None"""
+    if not numeral or not _ROMAN.match(numeral):
+        return None
+    total = 0
+    largest = 0
+    for char in reversed(numeral):
+        value = _ROMAN_VALUES[char]
+        if value < largest:
+            total -= value
+        else:
+            total += value
+            largest = value
+    return total
+
+def _page_number(line: str) -> Optional[Tuple[bool, int]]:
+    """(is roman, value) of a line shaped like a page number ("12", "Page 12 of 300", "xiv"), else None"""
+    match = _PAGE_NUMBER.match(_SPACES.sub(" ", line.lower()).strip())
+    if not match:
+        return None
+    token = match.group(1)
+    if token.isdigit():
+        return False, int(token)
+    value = _roman_value(token)
+    return (True, value) if value is not None else None
+
+def _numbered_in_sequence(numbers: List[Tuple[int, int, bool, bool, int]]) -> List[int]:
+    """
+    Indexes of (index, page, at top, is roman, value) candidates confirmed by
+    another at the same edge of a nearby page whose number differs by as much
+    as the pages do. A lone "I", "mix" or "IV" heading has no such neighbour.
+    """
+    # Numbers of one sequence share their edge and their offset from the page index
+    runs: Dict[Tuple[bool, bool, int], Set[int]] = {}
+    for _, page, top, roman, value in numbers:
+        runs.setdefault((top, roman, value - page), set()).add(page)
+    confirmed = []
+    for index, page, top, roman, value in numbers:
+        pages = runs[(top, roman, value - page)]
+        if any(page + offset in pages or page - offset in pages for offset in range(1, SEQUENCE_WINDOW + 1)):
+            confirmed.append(index)
+    return confirmed
+
+def _distinct_pages(rows: np.ndarray, pages: np.ndarray, page_count: int, row_count: int) -> np.ndarray:
+    """Number of distinct pages per row, given (row, page) pairs"""
+    pairs = np.unique(rows.astype(np.int64) * page_count + pages)
+    return np.bincount(pairs // page_count, minlength=row_count)
+
+def _trigram_matrix(texts: List[str], dimensions: int) -> np.ndarray:
+    """L2-normalized hashed character-trigram vectors, one row per text"""
+    rows = []
+    cols = []
+    # Trigrams repeat across lines far more than they vary; hash each once
+    hashed: Dict[str, int] = {}
+    for row, text in enumerate(texts):
+        padded = f"  {text}  "
+        for i in range(len(padded) - 2):
+            trigram = padded[i:i + 3]
+            col = hashed.get(trigram)
+            if col is None:
+                col = hashed[trigram] = zlib.crc32(trigram.encode()) % dimensions
+            rows.append(row)
+            cols.append(col)
+
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), 1.0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-9)
+
+def find_boilerplate(
+    pages: List[List[str]],
+    edge_lines: int = 3,
+    similarity: float = 0.85,
+    min_page_ratio: float = 0.3,
+    min_pages: int = 3,
+    block_size: int = 1024,
+    dimensions: int = 512
+) -> List[Tuple[int, int]]:
+    """
+    Return (page, line) indexes of boilerplate lines.
+
+    Candidates are the first and last `edge_lines` of each page. A candidate
+    is boilerplate if a similar line (cosine similarity of hashed trigrams)
+    sits in the same band on enough other pages, or if it is a page number
+    (arabic or roman) continuing a sequence on neighbouring pages.
+    Identical lines are grouped first; similarities of the rest are computed
+    as blocked matrix products, not pairwise loops.
+    """
+    page_count = len(pages)
+    if page_count < min_pages:
+        return []
+
+    positions = []  # (page, line index)
+    texts = []
+    raw = []
+    bands = []  # signed distance from the page edge: 0, 1, 2 at the top; -1, -2, -3 at the bottom
+    for page_number, lines in enumerate(pages):
+        nonblank = [index for index, line in enumerate(lines) if line]
+        # Short pages (chapter ends, title pages) only contribute their outermost lines
+        edge = min(edge_lines, max(1, len(nonblank) // 4))
+        top = nonblank[:edge]
+        bottom = nonblank[max(len(top), len(nonblank) - edge):]
+        for rank, index in enumerate(top):
+            positions.append((page_number, index))
+            texts.append(_canonical(lines[index]))
+            raw.append(lines[index])
+            bands.append(rank)
+        for rank, index in enumerate(bottom):
+            positions.append((page_number, index))
+            texts.append(_canonical(lines[index]))
+            raw.append(lines[index])
+            bands.append(rank - len(bottom))
+
+    if not texts:
+        return []
+
+    page_of = np.fromiter((page for page, _ in positions), dtype=np.int64, count=len(positions))
+    threshold = max(min_pages, int(np.ceil(min_page_ratio * page_count)))
+
+    # Identical lines in the same band are one row: running heads collapse to a
+    # handful, and those on enough pages by themselves need no similarity search
+    keys: Dict[Tuple[str, int], int] = {}
+    inverse = np.fromiter(
+        (keys.setdefault(key, len(keys)) for key in zip(texts, bands)), dtype=np.int64, count=len(texts)
+    )
+    unique_count = len(keys)
+    band = np.fromiter((key_band for _, key_band in keys), dtype=np.int32, count=unique_count)
+    top_side = band >= 0
+    # Pages of each unique line, contiguous: occurrence_pages[starts[u]:starts[u] + counts[u]]
+    order = np.argsort(inverse, kind="stable")
+    occurrence_pages = page_of[order]
+    counts = np.bincount(inverse, minlength=unique_count)
+    starts = np.cumsum(counts) - counts
+    repeated = _distinct_pages(inverse, page_of, page_count, unique_count) >= threshold
+
+    vectors = _trigram_matrix([text for text, _ in keys], dimensions)
+    undecided = np.nonzero(~repeated)[0]
+    for start in range(0, len(undecided), block_size):
+        rows = undecided[start:start + block_size]
+        similar = (vectors[rows] @ vectors.T) >= similarity
+        similar &= top_side[rows, None] == top_side[None, :]
+        similar &= np.abs(band[rows, None] - band[None, :]) <= 1
+        # Each (row, similar line) pair stands for every page that line is on
+        row_of, similar_to = np.nonzero(similar)
+        lengths = counts[similar_to]
+        total = int(lengths.sum())
+        flat = np.arange(total) + np.repeat(starts[similar_to] - (np.cumsum(lengths) - lengths), lengths)
+        matched = _distinct_pages(np.repeat(row_of, lengths), occurrence_pages[flat], page_count, len(rows))
+        repeated[rows] = matched >= threshold
+    repeated = repeated[inverse]
+
+    numbers = []
+    for index, line in enumerate(raw):
+        number = _page_number(line)
+        if number is not None:
+            numbers.append((index, positions[index][0], bands[index] >= 0, *number))
+    page_numbers = np.zeros(len(texts), dtype=bool)
+    page_numbers[_numbered_in_sequence(numbers)] = True
+    flagged = np.nonzero(repeated | page_numbers)[0]
+    return [positions[i] for i in flagged]
+
+def strip_boilerplate(pages: List[str]) -> Tuple[List[str], int]:
+    """Remove running heads, footers and page numbers; returns (pages, characters removed)"""
+    page_lines = [page.splitlines() for page in pages]
+    flagged = set(find_boilerplate([[line.strip() for line in lines] for lines in page_lines]))
+
+    removed = 0
+    cleaned = []
+    for page_number, lines in enumerate(page_lines):
+        kept = []
+        for index, line in enumerate(lines):
+            if (page_number, index) in flagged:
+                removed += len(line)
+            else:
+                kept.append(line)
+        cleaned.append("\n".join(kept))
+
+    if removed:
+        logger.info(f"✂️ Removed {len(flagged)} boilerplate lines ({removed} chars) across {len(pages)} pages")
+    return cleaned, removed
+
+__all__ = [
+    'BOILERPLATE_VERSION',
+    'find_boilerplate',
+    'strip_boilerplate'
+]
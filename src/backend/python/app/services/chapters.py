@@ -0,0 +1,199 @@
+"""
+Chapter detection
+Chapter starts come from the PDF outline (bookmarks) when it has one, and
+otherwise from typography: lines set noticeably larger than the body text, or
+"Chapter N"-style headings, near the top of a page
+"""
+
+import re
+import logging
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import List, Tuple, Dict, Any, Optional
+
+from app.services.text_normalizer import NormalizedText
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever detection changes, so stored chapter lists are rebuilt
+CHAPTERS_VERSION = 1
+
+_HEADING_WORDS = re.compile(
+    r"^(chapter|part|book|section|prologue|epilogue|introduction|preface|foreword|afterword|appendix)\b"
+    r"|^([ivxlcdm]+|\d{1,3})\.?(\s|$)",
+    re.I
+)
+
+@dataclass
+class Chapter:
+    """A run of sentences synthesized, cached and streamed as one unit"""
+    index: int
+    title: str
+    page: int  # 0-based page the chapter starts on
+    sentence_start: int
+    sentence_end: int  # exclusive
+    start_time: Optional[float] = None
+    duration: Optional[float] = None
+    byte_offset: Optional[int] = None  # where the chapter starts in the book MP3
+
+    @property
+    def sentence_count(self) -> int:
+        return self.sentence_end - self.sentence_start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Chapter":
+        return cls(**data)
+
+def outline_starts(file_path: str) -> List[Tuple[str, int]]:
+    """(title, page) for each top-level outline entry (blocking)"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    try:
+        outline = reader.outline
+    except Exception as e:
+        logger.warning(f"⚠️ Unreadable outline in {file_path}: {e}")
+        return []
+
+    # Nested lists hold children; when the whole book sits under a single
+    # top-level entry (the title), its children are the chapters
+    top_level = [item for item in outline if not isinstance(item, list)]
+    if len(top_level) == 1:
+        children = next((item for item in outline if isinstance(item, list)), [])
+        if len(children) > 1:
+            top_level = [item for item in children if not isinstance(item, list)]
+
+    starts = []
+    for item in top_level:
+        try:
+            page = reader.get_destination_page_number(item)
+        except Exception:
+            continue
+        if page is not None and page >= 0:
+            starts.append(((item.title or "").strip(), page))
+    return starts
+
+def _page_lines(page) -> List[Tuple[str, float, float, bool]]:
+    """(text, font size, top, bold) of each line from pdfplumber character data"""
+    lines: Dict[int, List[dict]] = {}
+    for char in page.chars:
+        lines.setdefault(round(char["top"]), []).append(char)
+
+    result = []
+    for top in sorted(lines):
+        chars = sorted(lines[top], key=lambda c: c["x0"])
+        text = "".join(c["text"] for c in chars).strip()
+        if not text:
+            continue
+        size = max(c["size"] for c in chars)
+        bold = all("bold" in c.get("fontname", "").lower() for c in chars if c["text"].strip())
+        result.append((text, size, float(top), bold))
+    return result
+
+def heading_starts(
+    file_path: str,
+    size_ratio: float = 1.25,
+    top_fraction: float = 0.4,
+    max_title_chars: int = 80
+) -> List[Tuple[str, int]]:
+    """(title, page) of pages opening with a heading, judged by font size (blocking)"""
+    import pdfplumber
+
+    candidates = []
+    sizes: Counter = Counter()
+    with pdfplumber.open(file_path) as pdf:
+        for number, page in enumerate(pdf.pages):
+            lines = _page_lines(page)
+            for text, size, _, _ in lines:
+                sizes[round(size, 1)] += len(text)
+            limit = float(page.height) * top_fraction
+            candidates.append([line for line in lines if line[2] <= limit])
+
+    if not sizes:
+        return []
+    body_size = sizes.most_common(1)[0][0]
+
+    starts = []
+    for number, lines in enumerate(candidates):
+        best = None
+        for text, size, _, bold in lines:
+            if len(text) > max_title_chars:
+                continue
+            larger = size >= body_size * size_ratio
+            named = bool(_HEADING_WORDS.match(text)) and (bold or size > body_size)
+            if (larger or named) and (best is None or size > best[1]):
+                best = (text, size)
+        if best:
+            starts.append((best[0], number))
+
+    # A heading on (nearly) every page is a running head, not a chapter
+    if len(starts) > max(3, len(candidates) // 2):
+        return []
+    return starts
+
+def detect_chapter_starts(file_path: str) -> Tuple[List[Tuple[str, int]], str]:
+    """Chapter starts and where they came from ("outline", "headings" or "none") (blocking)"""
+    try:
+        starts = outline_starts(file_path)
+        if len(starts) > 1:
+            return starts, "outline"
+    except Exception as e:
+        logger.warning(f"⚠️ Outline detection failed for {file_path}: {e}")
+
+    try:
+        starts = heading_starts(file_path)
+        if len(starts) > 1:
+            return starts, "headings"
+    except Exception as e:
+        logger.warning(f"⚠️ Heading detection failed for {file_path}: {e}")
+
+    return [], "none"
+
+def build_chapters(starts: List[Tuple[str, int]], normalized: NormalizedText) -> List[Chapter]:
+    """Map (title, page) starts onto sentence ranges; always covers the whole book"""
+    sentence_count = len(normalized.sentences)
+    page_count = normalized.page_count
+
+    boundaries: List[Tuple[int, str, int]] = []  # (sentence, title, page)
+    for title, page in sorted(starts, key=lambda start: start[1]):
+        if not 0 <= page < page_count:
+            continue
+        sentence = normalized.page_offsets[page]
+        if boundaries and boundaries[-1][0] == sentence:
+            continue  # several entries on one page: keep the first
+        boundaries.append((sentence, title, page))
+
+    # Anything before the first detected chapter becomes its own unit
+    if not boundaries or boundaries[0][0] > 0:
+        boundaries.insert(0, (0, "Front matter" if boundaries else "Full book", 0))
+
+    chapters = []
+    for position, (sentence, title, page) in enumerate(boundaries):
+        end = boundaries[position + 1][0] if position + 1 < len(boundaries) else sentence_count
+        if end <= sentence and chapters:
+            continue
+        chapters.append(Chapter(
+            index=len(chapters),
+            title=title or f"Chapter {len(chapters) + 1}",
+            page=page,
+            sentence_start=sentence,
+            sentence_end=end
+        ))
+    return chapters
+
+def chapter_audio_name(book_id: str, index: int) -> str:
+    """File name of one chapter's audio in output_path"""
+    return f"{book_id}.ch{index:03d}.mp3"
+
+__all__ = [
+    'CHAPTERS_VERSION',
+    'Chapter',
+    'outline_starts',
+    'heading_starts',
+    'detect_chapter_starts',
+    'build_chapters',
+    'chapter_audio_name'
+]
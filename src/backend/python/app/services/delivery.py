@@ -0,0 +1,97 @@
+"""
+Audio delivery offload
+Once a request is authorized, the bytes of a long audio file needn't tie up a
+Python worker for the whole listening session. AUDIO_DELIVERY selects who
+sends them:
+
+- app: the worker streams the file (Range requests, sendfile where possible)
+- accel: an empty response with X-Accel-Redirect; nginx serves the file from
+  an internal location, e.g.
+  `location /protected/ { internal; alias /var/magdee/; }` with
+  /var/magdee/outputs/ being OUTPUT_PATH
+- sendfile: the same with X-Sendfile (Apache mod_xsendfile, lighttpd)
+- redirect: 307 to a signed, expiring storage URL (S3 presigned, or nginx
+  secure_link for local files, see LocalStorage)
+
+Files a proxy can't reach fall back to the next option, down to app.
+"""
+
+import logging
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from starlette.responses import RedirectResponse, Response
+
+from app.config import get_settings
+from app.services.file_streaming import content_disposition
+from app.services.storage import storage
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ("app", "accel", "sendfile", "redirect")
+
+if settings.audio_delivery not in DELIVERY_MODES:
+    logger.warning(f"⚠️ Unknown AUDIO_DELIVERY '{settings.audio_delivery}', streaming from the app")
+
+def internal_redirect(
+    key: str,
+    media_type: str,
+    filename: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    mode: Optional[str] = None,
+    in_storage: bool = True
+) -> Optional[Response]:
+    """Empty response telling the proxy to send a file on this host itself; None if it isn't local"""
+    mode = mode or settings.audio_delivery
+    path = storage.local_path(key) if in_storage else storage.path_for(key)
+    if mode not in ("accel", "sendfile") or path is None:
+        return None
+
+    response_headers = dict(headers or {})
+    if filename is not None:
+        response_headers["Content-Disposition"] = content_disposition(filename)
+    if mode == "accel":
+        response_headers["X-Accel-Redirect"] = quote(settings.accel_redirect_prefix.rstrip("/") + "/" + key)
+    else:
+        response_headers["X-Sendfile"] = path
+    return Response(media_type=media_type, headers=response_headers)
+
+async def signed_redirect(key: str, headers: Optional[Dict[str, str]] = None) -> Optional[Response]:
+    """307 to a signed storage URL for the object; None if the backend can't sign one"""
+    url = await storage.presigned_url(key, settings.signed_url_ttl)
+    if url is None:
+        return None
+    # The URL expires, so the redirect itself mustn't be cached
+    return RedirectResponse(url, status_code=307, headers={**(headers or {}), "Cache-Control": "private, no-store"})
+
+async def offload_response(
+    key: str,
+    media_type: str,
+    filename: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    in_storage: bool = True
+) -> Optional[Response]:
+    """
+    The configured offloaded response for an authorized request, or None to
+    stream from the app. `in_storage` is False for files that exist only on
+    this host (variants rendered on request), which signed URLs can't reach.
+    """
+    mode = settings.audio_delivery
+    if mode == "app" or mode not in DELIVERY_MODES:
+        return None
+    if mode in ("accel", "sendfile"):
+        response = internal_redirect(key, media_type, filename, headers, mode, in_storage)
+        if response is not None:
+            return response
+    # Shared storage has no local path for the proxy; it can still send the bytes itself
+    if in_storage:
+        return await signed_redirect(key, headers)
+    return None
+
+__all__ = [
+    'DELIVERY_MODES',
+    'internal_redirect',
+    'signed_redirect',
+    'offload_response'
+]
@@ -0,0 +1,139 @@
+"""
+In-process pub/sub for conversion status events
+Feeds the SSE and WebSocket push endpoints
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Set, Deque
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+def book_topic(book_id: str) -> str:
+    """Topic carrying events for a single book"""
+    return f"book:{book_id}"
+
+def user_topic(user_id: str) -> str:
+    """Topic carrying events for every book in a user's library"""
+    return f"user:{user_id}"
+
+class Subscription:
+    """A bounded event queue for one connected client"""
+
+    def __init__(self, broker: "EventBroker", topic: str, queue_size: int):
+        self.broker = broker
+        self.topic = topic
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.replayed = False
+        self.dropped = 0
+
+    def push(self, event: Dict[str, Any]) -> None:
+        """Enqueue an event, dropping the oldest one if the client is lagging"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the next event, returning None when the heartbeat interval elapses"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self) -> "Subscription":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.broker.unsubscribe(self)
+
+class EventBroker:
+    """
+    Fan-out of status events to subscribers by topic.
+    Event IDs are `<epoch>-<sequence>` so clients can resume with Last-Event-ID
+    as long as the event is still in the replay history of this process.
+    """
+
+    def __init__(self, history_size: int, queue_size: int):
+        self.epoch = str(int(time.time()))
+        self._sequence = itertools.count(1)
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.queue_size = queue_size
+
+    def publish(self, topics: List[str], event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Publish an event to one or more topics"""
+        sequence = next(self._sequence)
+        event = {
+            "id": f"{self.epoch}-{sequence}",
+            "sequence": sequence,
+            "event": event_type,
+            "topics": topics,
+            "data": data
+        }
+        self._history.append(event)
+
+        for topic in topics:
+            for subscription in self._subscribers.get(topic, ()):
+                subscription.push(event)
+
+        return event
+
+    def subscribe(self, topic: str, last_event_id: Optional[str] = None) -> Subscription:
+        """Subscribe to a topic, replaying missed events after `last_event_id` when possible"""
+        subscription = Subscription(self, topic, self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+
+        after = self._parse_event_id(last_event_id)
+        if after is not None and self._history and self._history[0]["sequence"] <= after + 1:
+            for event in self._history:
+                if event["sequence"] > after and topic in event["topics"]:
+                    subscription.push(event)
+            subscription.replayed = True
+
+        logger.debug(f"📡 Subscribed to {topic} (replayed={subscription.replayed})")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription"""
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.topic]
+
+    def subscriber_count(self, topic: Optional[str] = None) -> int:
+        """Number of connected subscribers, optionally for a single topic"""
+        if topic is not None:
+            return len(self._subscribers.get(topic, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def _parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Extract the sequence from an event ID issued by this process"""
+        if not event_id:
+            return None
+        epoch, _, sequence = event_id.partition("-")
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+# Global event broker instance
+event_broker = EventBroker(settings.event_history_size, settings.event_queue_size)
+
+__all__ = [
+    'event_broker',
+    'book_topic',
+    'user_topic',
+    'EventBroker',
+    'Subscription'
+]
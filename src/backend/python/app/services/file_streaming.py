@@ -0,0 +1,274 @@
+"""
+Byte-range file responses for audio streaming
+Serves 206 partial content (single and multi-range, If-Range) so seeking only
+costs the bytes requested. Bodies go through the server's zero-copy sendfile
+extension when it offers one, otherwise through aligned reads with kernel
+read-ahead hints.
+"""
+
+import os
+import re
+import stat
+import hashlib
+import logging
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the file"""
+
+def parse_range_header(header: str, size: int, max_ranges: int = 16) -> Optional[List[Tuple[int, int]]]:
+    """
+    Inclusive (start, end) byte ranges from a Range header, sorted and merged.
+    None means the header should be ignored and the whole file sent.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs.strip():
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        match = _RANGE_SPEC.match(spec)
+        if not match:
+            return None  # malformed: RFC 9110 says ignore the header
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Merge overlapping and adjacent ranges so a client can't multiply the work
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > max_ranges:
+        return None
+    return merged
+
+def content_disposition(filename: str, disposition_type: str = "attachment") -> str:
+    """Content-Disposition value, RFC 5987-encoded when the name isn't plain ASCII"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition_type}; filename*=utf-8''{quoted}"
+    return f'{disposition_type}; filename="{filename}"'
+
+class RangedFileResponse(Response):
+    """FileResponse with Range/If-Range support and zero-copy bodies"""
+
+    chunk_size = 256 * 1024
+    read_ahead = 1024 * 1024
+    alignment = 64 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        media_type: str = "application/octet-stream",
+        filename: Optional[str] = None,
+        headers: Optional[dict] = None,
+        content_disposition_type: str = "attachment"
+    ):
+        self.path = path
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+        self.headers.setdefault("accept-ranges", "bytes")
+        if filename is not None:
+            self.headers.setdefault("content-disposition", content_disposition(filename, content_disposition_type))
+
+    def _set_stat_headers(self, stat_result: os.stat_result) -> Tuple[str, str]:
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        etag = '"' + hashlib.md5(f"{stat_result.st_mtime}-{stat_result.st_size}".encode()).hexdigest() + '"'
+        self.headers.setdefault("last-modified", last_modified)
+        self.headers.setdefault("etag", etag)
+        return etag, last_modified
+
+    @staticmethod
+    def _if_range_matches(if_range: str, etag: str, stat_result: os.stat_result) -> bool:
+        """If-Range holds a strong ETag or an HTTP date; a mismatch means send the whole file"""
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag
+        try:
+            return int(parsedate_to_datetime(if_range).timestamp()) >= int(stat_result.st_mtime)
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            raise RuntimeError(f"File at path {self.path} does not exist.")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+
+        size = stat_result.st_size
+        etag, _ = self._set_stat_headers(stat_result)
+        request_headers = Headers(scope=scope)
+        header_only = scope["method"].upper() == "HEAD"
+        zerocopy = ZEROCOPY_EXTENSION in scope.get("extensions", {})
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or self._if_range_matches(if_range, etag, stat_result)):
+            try:
+                ranges = parse_range_header(range_header, size)
+            except RangeNotSatisfiable:
+                response = Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+                return await response(scope, receive, send)
+
+        fd = os.open(self.path, os.O_RDONLY)
+
+        async def send_body() -> None:
+            if not ranges:
+                self.headers["content-length"] = str(size)
+                await self._start(send, 200)
+                if not header_only:
+                    await self._send_range(send, fd, 0, size, zerocopy, more_body=False)
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+                self.headers["content-length"] = str(end - start + 1)
+                await self._start(send, 206)
+                if not header_only:
+                    await self._send_range(send, fd, start, end - start + 1, zerocopy, more_body=False)
+            else:
+                await self._send_multipart(send, fd, ranges, size, header_only, zerocopy)
+            if header_only:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        # Stop reading the file as soon as the client goes away (e.g. the player seeks again)
+        try:
+            async with anyio.create_task_group() as task_group:
+                async def wrap(func) -> None:
+                    await func()
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(wrap, send_body)
+                await wrap(lambda: self._listen_for_disconnect(receive))
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    async def _listen_for_disconnect(receive: Receive) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+
+    async def _start(self, send: Send, status_code: int) -> None:
+        self.status_code = status_code
+        await send({"type": "http.response.start", "status": status_code, "headers": self.raw_headers})
+
+    async def _send_multipart(
+        self,
+        send: Send,
+        fd: int,
+        ranges: List[Tuple[int, int]],
+        size: int,
+        header_only: bool,
+        zerocopy: bool
+    ) -> None:
+        boundary = secrets.token_hex(12)
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        length = sum(len(header) for header in part_headers) + 2 * (len(ranges) - 1) + len(closing)
+        length += sum(end - start + 1 for start, end in ranges)
+
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(length)
+        await self._start(send, 206)
+        if header_only:
+            return
+
+        for position, ((start, end), header) in enumerate(zip(ranges, part_headers)):
+            prefix = (b"\r\n" if position else b"") + header
+            await send({"type": "http.response.body", "body": prefix, "more_body": True})
+            await self._send_range(send, fd, start, end - start + 1, zerocopy, more_body=True)
+        await send({"type": "http.response.body", "body": closing, "more_body": False})
+
+    async def _send_range(self, send: Send, fd: int, offset: int, count: int, zerocopy: bool, more_body: bool) -> None:
+        """Send `count` bytes from `offset`, zero-copy when the server supports it"""
+        if zerocopy:
+            # The server sendfile()s straight from the page cache to the socket
+            await send({
+                "type": ZEROCOPY_EXTENSION,
+                "file": fd,
+                "offset": offset,
+                "count": count,
+                "more_body": more_body
+            })
+            return
+
+        end = offset + count
+        position = offset
+        hinted = offset
+        if count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": more_body})
+            return
+
+        while position < end:
+            # Keep the kernel one window ahead of the reader
+            if hasattr(os, "posix_fadvise") and hinted < min(end, position + self.read_ahead):
+                window = min(end, position + self.read_ahead) - hinted
+                os.posix_fadvise(fd, hinted, window, os.POSIX_FADV_WILLNEED)
+                hinted += window
+
+            # Reads after the first land on alignment boundaries (whole pages / disk blocks)
+            boundary = (position // self.alignment + 1) * self.alignment
+            stop = min(end, max(boundary, (position + self.chunk_size) // self.alignment * self.alignment))
+            chunk = await anyio.to_thread.run_sync(os.pread, fd, stop - position, position)
+            if not chunk:
+                raise RuntimeError(f"File at path {self.path} shrank while streaming.")
+            position += len(chunk)
+            await send({
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": more_body or position < end
+            })
+
+__all__ = [
+    'RangedFileResponse',
+    'RangeNotSatisfiable',
+    'parse_range_header',
+    'content_disposition',
+    'ZEROCOPY_EXTENSION'
+]
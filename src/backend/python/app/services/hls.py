@@ -0,0 +1,210 @@
+"""
+HLS packaging
+Cuts encoded MP3 audio into fixed-duration segments on frame boundaries and
+maintains an m3u8 playlist that grows while conversion is still running
+(EVENT playlist) and is closed with #EXT-X-ENDLIST when it finishes.
+Segment names carry a render id, so a segment URL never changes content.
+"""
+
+import os
+import re
+import math
+import uuid
+import shutil
+import struct
+import logging
+from typing import List, Optional, Tuple
+
+from app.services.mp3_frames import audio_frames
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_NAME = "index.m3u8"
+SEGMENT_NAME = re.compile(r"^[0-9a-f]{8}-\d{5}\.mp3$")
+
+def hls_dir(output_path: str, book_id: str) -> str:
+    """Directory holding a book's segments and playlist"""
+    return os.path.join(output_path, f"{book_id}.hls")
+
+def playlist_path(output_path: str, book_id: str) -> str:
+    return os.path.join(hls_dir(output_path, book_id), PLAYLIST_NAME)
+
+def remove_hls(output_path: str, book_id: str) -> None:
+    """Delete a book's segments and playlist (blocking)"""
+    shutil.rmtree(hls_dir(output_path, book_id), ignore_errors=True)
+
+def _timestamp_tag(seconds: float) -> bytes:
+    """
+    ID3 PRIV frame with the segment's start time at 90 kHz, which HLS requires
+    at the head of each packed-audio segment
+    """
+    owner = b"com.apple.streaming.transportStreamTimestamp\x00"
+    payload = owner + struct.pack(">Q", int(round(seconds * 90000)) & 0x1FFFFFFFF)
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+def _syncsafe(value: int) -> bytes:
+    return bytes(((value >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+
+def read_segment_start(path: str) -> float:
+    """Start time (seconds) from a segment's timestamp tag; 0 if it has none (blocking)"""
+    with open(path, "rb") as f:
+        head = f.read(128)
+    owner = b"com.apple.streaming.transportStreamTimestamp\x00"
+    position = head.find(owner)
+    if position < 0:
+        return 0.0
+    return struct.unpack(">Q", head[position + len(owner):position + len(owner) + 8])[0] / 90000
+
+def retime_segment(encoded_path: str, path: str, start: float) -> None:
+    """
+    Write encoded MP3 audio as a segment starting at `start`: its own tags and
+    Xing frame dropped, our timestamp tag in front (blocking)
+    """
+    with open(encoded_path, "rb") as f:
+        data = f.read()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_timestamp_tag(start))
+        for frame in audio_frames(data):
+            f.write(data[frame.offset:frame.offset + frame.length])
+    os.replace(tmp_path, path)
+
+class HLSSegmenter:
+    """
+    Accepts MP3 data in playback order and writes segments of about
+    `target_duration` seconds, rewriting the playlist after each one.
+    Blocking; call from a worker thread.
+    """
+
+    def __init__(self, output_path: str, book_id: str, target_duration: float = 10.0):
+        self.directory = hls_dir(output_path, book_id)
+        self.target_duration = target_duration
+        self.render_id = uuid.uuid4().hex[:8]
+        self.segments: List[Tuple[str, float]] = []  # (file name, duration)
+        self.finished = False
+        self._pending = bytearray()
+        self._pending_duration = 0.0
+        self._elapsed = 0.0
+
+        # A new render replaces the previous one; its segment names never collide
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_playlist()
+
+    @property
+    def duration(self) -> float:
+        return self._elapsed + self._pending_duration
+
+    def append(self, data: bytes) -> int:
+        """Add encoded audio; returns the number of segments written"""
+        written = 0
+        for frame in audio_frames(data):
+            self._pending += data[frame.offset:frame.offset + frame.length]
+            self._pending_duration += frame.duration
+            if self._pending_duration >= self.target_duration:
+                self._cut()
+                written += 1
+        if written:
+            self._write_playlist()
+        return written
+
+    def append_file(self, path: str) -> int:
+        with open(path, "rb") as f:
+            return self.append(f.read())
+
+    def finish(self) -> None:
+        """Flush the last partial segment and close the playlist"""
+        if self._pending:
+            self._cut()
+        self.finished = True
+        self._write_playlist()
+
+    def _cut(self) -> None:
+        name = f"{self.render_id}-{len(self.segments):05d}.mp3"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_timestamp_tag(self._elapsed))
+            f.write(self._pending)
+        os.replace(tmp_path, path)
+
+        self.segments.append((name, self._pending_duration))
+        self._elapsed += self._pending_duration
+        self._pending = bytearray()
+        self._pending_duration = 0.0
+
+    def _write_playlist(self) -> None:
+        # Players may not exceed TARGETDURATION, so it tracks the longest segment
+        longest = max((duration for _, duration in self.segments), default=self.target_duration)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max(longest, self.target_duration))}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            f"#EXT-X-PLAYLIST-TYPE:{'VOD' if self.finished else 'EVENT'}",
+        ]
+        for name, duration in self.segments:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(name)
+        if self.finished:
+            lines.append("#EXT-X-ENDLIST")
+
+        path = os.path.join(self.directory, PLAYLIST_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+def read_playlist(output_path: str, book_id: str, segment_base_url: str, speed: float = 1.0) -> Optional[Tuple[str, int, bool]]:
+    """The book's playlist resolved as by resolve_playlist(); None if not started (blocking)"""
+    path = playlist_path(output_path, book_id)
+    try:
+        with open(path) as f:
+            return resolve_playlist(f.read(), segment_base_url, speed)
+    except FileNotFoundError:
+        return None
+
+def resolve_playlist(text: str, segment_base_url: str, speed: float = 1.0) -> Tuple[str, int, bool]:
+    """
+    Playlist text with segment names resolved against `segment_base_url`,
+    the number of segments, and whether it is complete.
+    At another `speed`, durations are scaled and segment URLs ask for that speed.
+    """
+    lines = text.splitlines()
+    segments = 0
+    resolved = []
+    for line in lines:
+        if line and not line.startswith("#"):
+            segments += 1
+            line = f"{segment_base_url}/{line}" + (f"?speed={speed:g}" if speed != 1.0 else "")
+        elif speed != 1.0 and line.startswith("#EXTINF:"):
+            line = f"#EXTINF:{float(line[8:].rstrip(',')) / speed:.3f},"
+        elif speed != 1.0 and line.startswith("#EXT-X-TARGETDURATION:"):
+            line = f"#EXT-X-TARGETDURATION:{math.ceil(int(line[22:]) / speed)}"
+        resolved.append(line)
+    return "\n".join(resolved) + "\n", segments, "#EXT-X-ENDLIST" in lines
+
+def playlist_segments(text: str) -> List[str]:
+    """Segment names listed by a playlist, in playback order"""
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+def segment_path(output_path: str, book_id: str, name: str) -> Optional[str]:
+    """Path of a segment file, or None if the name isn't a segment name"""
+    if not SEGMENT_NAME.match(name):
+        return None
+    return os.path.join(hls_dir(output_path, book_id), name)
+
+__all__ = [
+    'HLSSegmenter',
+    'hls_dir',
+    'playlist_path',
+    'remove_hls',
+    'PLAYLIST_NAME',
+    'read_playlist',
+    'resolve_playlist',
+    'playlist_segments',
+    'read_segment_start',
+    'retime_segment',
+    'segment_path'
+]
@@ -0,0 +1,189 @@
+"""
+MPEG audio frame parsing
+Walks MP3 data frame by frame (sync word, bitrate and sample-rate tables) so
+audio can be cut and joined on frame boundaries without decoding.
+Recognizes Xing/Info and VBRI header frames, which carry no audio.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Iterator, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bitrates in kbit/s, indexed by [version is MPEG-1][layer][bitrate index]
+_BITRATES = {
+    True: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+_VERSIONS = {3: "1", 2: "2", 0: "2.5"}
+
+@dataclass(frozen=True)
+class FrameHeader:
+    """One MPEG audio frame header"""
+    offset: int
+    length: int
+    version: str  # "1", "2" or "2.5"
+    layer: int
+    bitrate: int  # kbit/s
+    sample_rate: int
+    samples: int
+    channels: int
+    padding: bool
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+def parse_header(data: bytes, offset: int) -> Optional[FrameHeader]:
+    """Decode the 4-byte frame header at `offset`, or None if it isn't one"""
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    rate_index = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None  # reserved values, or free-format which can't be framed
+
+    mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[mpeg1][layer][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version_bits][rate_index]
+    padding = bool((b2 >> 1) & 0x01)
+    channels = 1 if (b3 >> 6) == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or mpeg1) else 576
+        length = (samples // 8) * bitrate * 1000 // sample_rate + padding
+
+    return FrameHeader(
+        offset=offset,
+        length=length,
+        version=_VERSIONS[version_bits],
+        layer=layer,
+        bitrate=bitrate,
+        sample_rate=sample_rate,
+        samples=samples,
+        channels=channels,
+        padding=padding
+    )
+
+def id3v2_size(data: bytes) -> int:
+    """Length of a leading ID3v2 tag (0 when there is none)"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def frame_boundary(data: bytes, offset: int) -> bool:
+    """True when another frame, or a trailing ID3v1/APE tag, starts at `offset`"""
+    if parse_header(data, offset) is not None:
+        return True
+    return data[offset:offset + 3] == b"TAG" or data[offset:offset + 8] == b"APETAGEX"
+
+def iter_frames(data: bytes, start: int = 0) -> Iterator[FrameHeader]:
+    """
+    Yield every frame in `data`. A candidate header only counts when the next
+    frame also parses (or the data or a trailing tag follows), so stray 0xFF
+    bytes are skipped.
+    """
+    offset = start or id3v2_size(data)
+    size = len(data)
+    while offset + 4 <= size:
+        header = parse_header(data, offset)
+        if header is not None and header.length > 4:
+            following = offset + header.length
+            if following == size or following + 4 > size or frame_boundary(data, following):
+                if following > size:
+                    return  # truncated last frame
+                yield header
+                offset = following
+                continue
+        offset = data.find(b"\xff", offset + 1)
+        if offset < 0:
+            return
+
+def side_info_size(header: FrameHeader) -> int:
+    """Bytes of layer III side information following the frame header"""
+    if header.version == "1":
+        return 17 if header.channels == 1 else 32
+    return 9 if header.channels == 1 else 17
+
+def is_info_frame(data: bytes, header: FrameHeader) -> bool:
+    """True for a Xing/Info or VBRI header frame (encoder metadata, silent)"""
+    if header.layer != 3:
+        return False
+    xing = header.offset + 4 + side_info_size(header)
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        return True
+    return data[header.offset + 36:header.offset + 40] == b"VBRI"
+
+def granule_gains(data: bytes, header: FrameHeader) -> List[Tuple[int, int]]:
+    """
+    (part2_3_length, global_gain) for each granule and channel of a layer III
+    frame, read from its side information: a loudness estimate without decoding
+    """
+    start = header.offset + 4 + (0 if data[header.offset + 1] & 0x01 else 2)  # skip the CRC if present
+    size = side_info_size(header)
+    bits = int.from_bytes(data[start:start + size], "big")
+    mpeg1 = header.version == "1"
+    if mpeg1:
+        position = 9 + (5 if header.channels == 1 else 3) + 4 * header.channels
+    else:
+        position = 8 + (1 if header.channels == 1 else 2)
+    per_channel = 59 if mpeg1 else 63
+
+    gains = []
+    for _ in range(2 if mpeg1 else 1):
+        for _ in range(header.channels):
+            shift = size * 8 - position
+            gains.append(((bits >> (shift - 12)) & 0xFFF, (bits >> (shift - 29)) & 0xFF))
+            position += per_channel
+    return gains
+
+def audio_frames(data: bytes) -> Iterator[FrameHeader]:
+    """Like iter_frames, but skips a leading Xing/Info/VBRI header frame"""
+    frames = iter_frames(data)
+    first = next(frames, None)
+    if first is None:
+        return
+    if not is_info_frame(data, first):
+        yield first
+    yield from frames
+
+def first_frame(data: bytes) -> Optional[FrameHeader]:
+    """The first real audio frame, or None if the data has none"""
+    return next(audio_frames(data), None)
+
+__all__ = [
+    'FrameHeader',
+    'parse_header',
+    'id3v2_size',
+    'frame_boundary',
+    'iter_frames',
+    'side_info_size',
+    'is_info_frame',
+    'granule_gains',
+    'audio_frames',
+    'first_frame'
+]
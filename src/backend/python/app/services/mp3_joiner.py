@@ -0,0 +1,233 @@
+"""
+Frame-level MP3 concatenation
+Joins MP3 streams of the same format by copying their frames, so assembling a
+book costs file I/O rather than a decode and re-encode. Per-input ID3 tags and
+Xing/Info/VBRI header frames are dropped, and the output starts with a single
+Xing header (frame count, byte count and a 100-point seek table) describing
+the whole file, which players use for duration and seeking.
+"""
+
+import os
+import struct
+import logging
+from array import array
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from app.services.mp3_frames import FrameHeader, parse_header, frame_boundary, id3v2_size, side_info_size, is_info_frame
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+TOC_STRIDE = 16  # remember the offset of every 16th frame for the seek table
+
+XING_FRAMES = 0x1
+XING_BYTES = 0x2
+XING_TOC = 0x4
+
+class MP3JoinError(ValueError):
+    """Inputs can't be joined (different sample rate, channels or MPEG version)"""
+
+def _info_header(template: FrameHeader, header_bytes: bytes) -> Tuple[bytes, int]:
+    """
+    Header bytes and length of the smallest frame of this format that fits a
+    Xing tag with a seek table (low-bitrate speech frames are often too small)
+    """
+    needed = 4 + side_info_size(template) + 4 + 12 + 100
+    for index in range(1, 15):
+        # No CRC, no padding; keep version, layer, sample rate and channel mode
+        candidate = bytes((
+            0xFF,
+            header_bytes[1] | 0x01,
+            (index << 4) | (header_bytes[2] & 0x0C),
+            header_bytes[3]
+        ))
+        header = parse_header(candidate, 0)
+        if header is not None and header.length >= needed:
+            return candidate, header.length
+    raise MP3JoinError(f"No {template.sample_rate} Hz frame is large enough for a Xing header")
+
+def _xing_frame(template: FrameHeader, header_bytes: bytes, length: int, frames: int, size: int, toc: bytes, vbr: bool) -> bytes:
+    """A silent frame in the audio's format carrying the Xing/Info tag"""
+    payload = (
+        (b"Xing" if vbr else b"Info")
+        + struct.pack(">III", XING_FRAMES | XING_BYTES | XING_TOC, frames, min(size, 0xFFFFFFFF))
+        + toc
+    )
+    frame = bytearray(length)
+    frame[:4] = header_bytes
+    start = 4 + side_info_size(template)
+    frame[start:start + len(payload)] = payload
+    return bytes(frame)
+
+@lru_cache(maxsize=256)
+def _header(header_bytes: bytes) -> Optional[FrameHeader]:
+    """Frame headers repeat, so parse each distinct one once"""
+    return parse_header(header_bytes, 0)
+
+class MP3Joiner:
+    """
+    Writes MP3 streams appended in order to `path` (via a .tmp file until
+    finish()). Blocking; call from a worker thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.frames = 0
+        self.audio_bytes = 0
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._format: Optional[Tuple[str, int, int, int]] = None
+        self._template: Optional[FrameHeader] = None
+        self._header_bytes = b""
+        self._header_length = 0
+        self._input_start = False
+        self._bitrates = set()
+        self._offsets = array("Q")
+
+    def __enter__(self) -> "MP3Joiner":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.finish()
+        else:
+            self.abort()
+
+    def append(self, data: bytes) -> int:
+        """Add one complete MP3 stream (e.g. a TTS response); returns frames added"""
+        before = self.frames
+        self._input_start = True
+        self._consume(data, id3v2_size(data), final=True)
+        return self.frames - before
+
+    def append_file(self, path: str) -> int:
+        """Add an MP3 file, reading it in blocks; returns frames added"""
+        before = self.frames
+        self._input_start = True
+        with open(path, "rb") as f:
+            f.seek(id3v2_size(f.read(10)))
+            pending = b""
+            while True:
+                block = f.read(READ_SIZE)
+                data = pending + block
+                consumed = self._consume(data, 0, final=not block)
+                pending = data[consumed:]
+                if not block:
+                    break
+        return self.frames - before
+
+    def _consume(self, data: bytes, offset: int, final: bool) -> int:
+        """
+        Copy every valid frame from `data` starting at `offset`; returns how many
+        bytes were used up. Unless `final`, a frame is only taken once the next
+        header is in view to validate it, and the rest is left for the next block.
+        """
+        size = len(data)
+        out = bytearray()
+        run_start = run_end = offset  # frames are copied in contiguous runs
+        while offset + 4 <= size:
+            header = _header(data[offset:offset + 4])
+            if header is not None and header.length > 4:
+                following = offset + header.length
+                if not final and following + 4 > size:
+                    break  # wait for the next block
+                if following > size:
+                    offset = size  # truncated last frame
+                    break
+                if following + 4 > size or _header(data[following:following + 4]) is not None or frame_boundary(data, following):
+                    # Each input's own Xing/VBRI frame describes only that input
+                    skip = self._input_start and is_info_frame(data, parse_header(data, offset))
+                    self._input_start = False
+                    if not skip:
+                        if offset != run_end:
+                            out += data[run_start:run_end]
+                            run_start = offset
+                        self._take(data, offset, header)
+                        run_end = following
+                    offset = following
+                    continue
+            resync = data.find(b"\xff", offset + 1)
+            if resync < 0:
+                offset = size
+                break
+            offset = resync
+
+        out += data[run_start:run_end]
+        if final:
+            offset = size
+        if out:
+            self._file.write(out)
+        return offset
+
+    def _take(self, data: bytes, offset: int, header: FrameHeader) -> None:
+        """Account for one frame (`header` is parsed at offset 0 and shared between frames)"""
+        if self._format is None:
+            self._format = (header.version, header.layer, header.sample_rate, header.channels)
+            self._template = header
+            if header.layer == 3:
+                # Reserve room for the Xing frame; it is filled in by finish()
+                self._header_bytes, self._header_length = _info_header(header, data[offset:offset + 4])
+                self._file.write(bytes(self._header_length))
+        elif (header.version, header.layer, header.sample_rate, header.channels) != self._format:
+            raise MP3JoinError(
+                f"Can't join MPEG-{header.version} {header.sample_rate} Hz x{header.channels} audio onto "
+                f"MPEG-{self._format[0]} {self._format[2]} Hz x{self._format[3]}"
+            )
+
+        if self.frames % TOC_STRIDE == 0:
+            self._offsets.append(self._header_length + self.audio_bytes)
+        self.frames += 1
+        self.audio_bytes += header.length
+        self._bitrates.add(header.bitrate)
+
+    @property
+    def header_length(self) -> int:
+        """Size of the Xing frame in front of the audio (0 until the first frame arrives)"""
+        return self._header_length
+
+    @property
+    def duration(self) -> float:
+        if self._template is None:
+            return 0.0
+        return self.frames * self._template.duration
+
+    def _toc(self, total_bytes: int) -> bytes:
+        """Byte position (as 1/256ths of the file) at each percent of playback"""
+        toc = bytearray(100)
+        for percent in range(100):
+            frame = self.frames * percent / 100
+            sample = min(int(frame // TOC_STRIDE), len(self._offsets) - 1)
+            # Interpolate between the remembered offsets on either side
+            after = self._offsets[sample + 1] if sample + 1 < len(self._offsets) else total_bytes
+            position = self._offsets[sample] + (after - self._offsets[sample]) * (frame - sample * TOC_STRIDE) / TOC_STRIDE
+            toc[percent] = min(255, int(position * 256 // total_bytes))
+        return bytes(toc)
+
+    def finish(self) -> int:
+        """Write the Xing header and move the file into place; returns its size"""
+        total_bytes = self._header_length + self.audio_bytes
+        if self._header_length:
+            self._file.seek(0)
+            self._file.write(_xing_frame(
+                self._template,
+                self._header_bytes,
+                self._header_length,
+                self.frames,
+                total_bytes,
+                self._toc(total_bytes),
+                vbr=len(self._bitrates) > 1
+            ))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return total_bytes
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+__all__ = [
+    'MP3Joiner',
+    'MP3JoinError'
+]
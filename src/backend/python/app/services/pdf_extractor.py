@@ -0,0 +1,36 @@
+"""
+PDF text extraction
+"""
+
+import hashlib
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+def extract_pages(file_path: str) -> List[str]:
+    """Extract the text of every page (blocking; run in a worker thread)"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    pages = []
+    for number, page in enumerate(reader.pages):
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception as e:
+            logger.warning(f"⚠️ Text extraction failed on page {number + 1} of {file_path}: {e}")
+            pages.append("")
+    return pages
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in blocks (blocking; run in a worker thread)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+__all__ = [
+    'extract_pages',
+    'file_sha256'
+]
@@ -0,0 +1,197 @@
+"""
+Fast-path PDF validation
+Sniffs the first and last bytes of an upload (magic, trailer/xref, encryption,
+page count, text layer) so unusable files are rejected before conversion
+"""
+
+import os
+import re
+import logging
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 64 * 1024
+
+_MAGIC = re.compile(rb"%PDF-(\d\.\d)")
+_LINEARIZED = re.compile(rb"/Linearized\s[^>]*?/N\s+(\d+)", re.S)
+_PAGES_COUNT = re.compile(rb"/Count\s+(\d+)")
+_PAGES_TYPE = re.compile(rb"/Type\s*/Pages\b")
+_ENCRYPT = re.compile(rb"/Encrypt\s+(\d+\s+\d+\s+R|<<)")
+_FONT = b"/Font"
+_OBJECT_STREAM = b"/ObjStm"
+_MARKER_OVERLAP = 16  # longest marker we look for across chunk boundaries
+
+class PDFValidationError(Exception):
+    """The upload is not a PDF we can convert"""
+
+@dataclass
+class PDFInfo:
+    """What the sniffer learned about a PDF without parsing it"""
+    version: str
+    page_count: Optional[int] = None
+    linearized: bool = False
+    has_text_layer: Optional[bool] = None  # None when the sniffed bytes can't tell
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def _pages_count(data: bytes) -> Optional[int]:
+    """Largest /Count of a /Type /Pages dictionary in the buffer (the page tree root)"""
+    best = None
+    for match in _PAGES_COUNT.finditer(data):
+        window = data[max(0, match.start() - 256):match.end() + 256]
+        if _PAGES_TYPE.search(window):
+            count = int(match.group(1))
+            best = count if best is None else max(best, count)
+    return best
+
+class PDFSniffer:
+    """
+    Incremental validator fed with upload chunks in order.
+    The head is checked as soon as it has arrived, so a non-PDF is rejected
+    after the first chunk; trailer checks run in `finish()` on the retained tail.
+    """
+
+    def __init__(self, max_pages: int):
+        self.max_pages = max_pages
+        self.size = 0
+        self._head = bytearray()
+        self._head_checked = False
+        self._tail = bytearray()
+        self._carry = b""
+        self._saw_font = False
+        self._saw_object_stream = False
+        self.info: Optional[PDFInfo] = None
+
+    def feed(self, chunk: bytes) -> None:
+        """Consume the next chunk; raises PDFValidationError as soon as the head is bad"""
+        self.size += len(chunk)
+
+        if not self._head_checked:
+            self._head += chunk[:HEAD_SIZE - len(self._head)]
+            if len(self._head) >= HEAD_SIZE:
+                self._check_head()
+
+        # Cheap marker scans over every byte; detailed parsing stays on head and tail
+        window = self._carry + chunk
+        self._saw_font = self._saw_font or _FONT in window
+        self._saw_object_stream = self._saw_object_stream or _OBJECT_STREAM in window
+        self._carry = window[-_MARKER_OVERLAP:]
+
+        self._tail += chunk
+        if len(self._tail) > TAIL_SIZE:
+            del self._tail[:len(self._tail) - TAIL_SIZE]
+
+    def finish(self, fully_scanned: bool = True) -> PDFInfo:
+        """Run trailer checks once the last chunk has been fed"""
+        if not self._head_checked:
+            self._check_head()
+
+        tail = bytes(self._tail)
+        if b"%%EOF" not in tail[-1024:]:
+            raise PDFValidationError("PDF is truncated or corrupt (missing %%EOF)")
+        if b"startxref" not in tail:
+            raise PDFValidationError("PDF is corrupt (missing cross-reference table)")
+        if _ENCRYPT.search(tail):
+            raise PDFValidationError("Encrypted or password-protected PDFs are not supported")
+
+        info = self.info
+        if info.page_count is None:
+            info.page_count = _pages_count(tail)
+
+        if self._saw_font:
+            info.has_text_layer = True
+        elif fully_scanned and not self._saw_object_stream:
+            # Every object was visible and none of them is a font: image-only scan
+            info.has_text_layer = False
+
+        self._check_limits(info)
+        return info
+
+    def _check_head(self) -> None:
+        head = bytes(self._head)
+        match = _MAGIC.search(head[:1024])
+        if not match:
+            raise PDFValidationError("File is not a PDF")
+
+        self.info = PDFInfo(version=match.group(1).decode())
+
+        linearized = _LINEARIZED.search(head[:4096])
+        if linearized:
+            self.info.linearized = True
+            self.info.page_count = int(linearized.group(1))
+        else:
+            self.info.page_count = _pages_count(head)
+
+        # Linearized files carry the first-page trailer (and /Encrypt) up front
+        if self.info.linearized and _ENCRYPT.search(head):
+            raise PDFValidationError("Encrypted or password-protected PDFs are not supported")
+
+        self._check_limits(self.info)
+        self._head_checked = True
+
+    def _check_limits(self, info: PDFInfo) -> None:
+        if info.page_count is not None and info.page_count > self.max_pages:
+            raise PDFValidationError(f"PDF has too many pages ({info.page_count}). Maximum is {self.max_pages}")
+        if info.page_count == 0:
+            raise PDFValidationError("PDF has no pages")
+
+def check_head(data: bytes, max_pages: int) -> PDFInfo:
+    """Validate just the first bytes of an upload (magic, linearization, page count)"""
+    sniffer = PDFSniffer(max_pages)
+    sniffer.feed(data[:HEAD_SIZE])
+    if not sniffer._head_checked:
+        sniffer._check_head()
+    return sniffer.info
+
+def sniff_file(file_path: str, max_pages: int) -> PDFInfo:
+    """Validate a PDF already on disk by reading only its head and tail (blocking)"""
+    size = os.path.getsize(file_path)
+    sniffer = PDFSniffer(max_pages)
+
+    with open(file_path, "rb") as f:
+        if size <= HEAD_SIZE + TAIL_SIZE:
+            sniffer.feed(f.read())
+            return sniffer.finish(fully_scanned=True)
+
+        sniffer.feed(f.read(HEAD_SIZE))
+        f.seek(size - TAIL_SIZE)
+        sniffer.feed(f.read(TAIL_SIZE))
+        return sniffer.finish(fully_scanned=False)
+
+def count_pages(file_path: str, max_pages: int) -> int:
+    """
+    Page count from the page tree when sniffing couldn't see it, e.g. in
+    compressed object streams (blocking; only reads the xref and page tree)
+    """
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            raise PDFValidationError("Encrypted or password-protected PDFs are not supported")
+        page_count = len(reader.pages)
+    except PDFValidationError:
+        raise
+    except Exception as e:
+        raise PDFValidationError(f"PDF is corrupt: {e}")
+
+    if page_count == 0:
+        raise PDFValidationError("PDF has no pages")
+    if page_count > max_pages:
+        raise PDFValidationError(f"PDF has too many pages ({page_count}). Maximum is {max_pages}")
+    return page_count
+
+__all__ = [
+    'PDFValidationError',
+    'PDFInfo',
+    'PDFSniffer',
+    'check_head',
+    'sniff_file',
+    'count_pages',
+    'HEAD_SIZE',
+    'TAIL_SIZE'
+]
@@ -0,0 +1,494 @@
+"""
+PDF to audio conversion pipeline
+Stages: text (extract + strip boilerplate + normalize, cached by content hash)
+-> per-book text artifact -> chapters -> synthesis (chapters in parallel)
+-> HLS packaging (in chapter order, as soon as each chapter is ready)
+-> whole-book MP3 (chapter files joined frame by frame, then probed)
+-> waveform peaks (gathered per chapter during synthesis, written as levels)
+-> optional lower-bitrate MP3 / Opus variants (otherwise made on first request)
+Stages work in the local output directory; with shared (S3) storage, segments
+are published as they're written and the other artifacts once finished.
+"""
+
+import os
+import gzip
+import time
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple, List, Callable, Awaitable
+
+from app.config import get_settings
+from app.database import kv_store, update_user_activity
+from app.services.progress import progress_tracker
+from app.services.pdf_extractor import extract_pages, file_sha256
+from app.services.text_normalizer import NormalizedText, normalize_pages, NORMALIZER_VERSION
+from app.services.boilerplate import strip_boilerplate, BOILERPLATE_VERSION
+from app.services.text_artifact import artifact_path, write_text_artifact
+from app.services.chapters import Chapter, CHAPTERS_VERSION, detect_chapter_starts, build_chapters, chapter_audio_name
+from app.services.hls import HLSSegmenter, PLAYLIST_NAME
+from app.services.tts_engine import tts_engine, SynthesisResult, wav_pcm
+from app.services.mp3_joiner import MP3Joiner
+from app.services.audio_probe import AudioInfo, probe_audio
+from app.services.waveform import PeakBuilder, BookPeaks, peaks_dir
+from app.services.alignment import SentenceAligner
+from app.services.audio_encoder import EncoderError, JobMemory, encoder_pool, peak_rss_mb
+from app.services.variants import VARIANTS, ensure_variant
+from app.services.artifact_store import artifact_store
+from app.services.storage import storage, output_key
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+def text_cache_path(content_hash: str) -> str:
+    """Cache file for the normalized text of a PDF"""
+    return os.path.join(settings.text_cache_path, f"{content_hash}-n{NORMALIZER_VERSION}b{BOILERPLATE_VERSION}.txt.gz")
+
+def save_normalized_text(path: str, normalized: NormalizedText) -> None:
+    """
+    Persist normalized text: a JSON header line followed by one sentence per line,
+    gzip-compressed (blocking; run in a worker thread)
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = {
+        "normalizer_version": NORMALIZER_VERSION,
+        "boilerplate_version": BOILERPLATE_VERSION,
+        "boilerplate_chars_removed": normalized.boilerplate_chars_removed,
+        "page_offsets": normalized.page_offsets
+    }
+
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header, separators=(",", ":")))
+        for sentence in normalized.sentences:
+            f.write("\n")
+            f.write(sentence)
+    os.replace(tmp_path, path)
+
+def load_normalized_text(path: str) -> Optional[NormalizedText]:
+    """Load cached normalized text, or None if absent or unreadable (blocking)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            body = f.read()
+        sentences = body.split("\n") if body else []
+        return NormalizedText(
+            sentences=sentences,
+            page_offsets=header["page_offsets"],
+            boilerplate_chars_removed=header.get("boilerplate_chars_removed", 0)
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Ignoring unreadable text cache {path}: {e}")
+        return None
+
+async def run_text_stage(book_data: Dict[str, Any]) -> Tuple[NormalizedText, bool]:
+    """
+    Extract and normalize the book's text, reusing the cached result for the
+    same PDF content and normalizer version. Returns (text, cache_hit).
+    """
+    content_hash = book_data.get("content_hash")
+    if not content_hash:
+        content_hash = await asyncio.to_thread(file_sha256, book_data["file_path"])
+        book_data["content_hash"] = content_hash
+
+    cache_path = text_cache_path(content_hash)
+    normalized = await asyncio.to_thread(load_normalized_text, cache_path)
+    if normalized is not None:
+        logger.info(f"♻️ Text cache hit for {book_data['id']} ({content_hash[:12]})")
+        return normalized, True
+
+    await progress_tracker.update(book_data["id"], stage="extracting")
+    pages = await asyncio.to_thread(extract_pages, book_data["file_path"])
+    pages, removed_chars = await asyncio.to_thread(strip_boilerplate, pages)
+
+    await progress_tracker.update(book_data["id"], stage="normalizing", progress=10)
+    normalized = await asyncio.to_thread(normalize_pages, pages, settings.max_sentence_chars)
+    normalized.boilerplate_chars_removed = removed_chars
+    await asyncio.to_thread(save_normalized_text, cache_path, normalized)
+
+    return normalized, False
+
+async def run_chapter_stage(book_data: Dict[str, Any], normalized: NormalizedText) -> List[Chapter]:
+    """Chapters for the book, reusing the stored list when the text hasn't changed"""
+    stored = book_data.get("chapters")
+    if (
+        stored
+        and book_data.get("chapters_version") == CHAPTERS_VERSION
+        and stored[-1]["sentence_end"] == len(normalized.sentences)
+    ):
+        return [Chapter.from_dict(chapter) for chapter in stored]
+
+    await progress_tracker.update(book_data["id"], stage="chapters")
+    starts, source = await asyncio.to_thread(detect_chapter_starts, book_data["file_path"])
+    chapters = build_chapters(starts, normalized)
+    book_data["chapter_source"] = source
+    book_data["chapters_version"] = CHAPTERS_VERSION
+    logger.info(f"📑 {len(chapters)} chapters for {book_data['id']} (from {source})")
+    return chapters
+
+async def synthesize_chapter(
+    book_id: str,
+    chapter: Chapter,
+    normalized: NormalizedText,
+    voice: Dict[str, Any],
+    on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+    peaks: Optional[PeakBuilder] = None
+) -> SynthesisResult:
+    """
+    Synthesize one chapter, streaming audio to its file as chunks arrive:
+    MP3 frames are joined directly, PCM goes through a pooled ffmpeg encoder.
+    Waveform peaks are taken from the same audio on the way through.
+    """
+    started = time.monotonic()
+    provider = tts_engine.provider()
+    audio_path = os.path.join(settings.output_path, chapter_audio_name(book_id, chapter.index))
+    result = SynthesisResult(audio=b"", audio_format="mp3", duration=0.0)
+    encoder = None
+    output = None
+
+    try:
+        if provider.audio_format == "mp3":
+            output = await asyncio.to_thread(MP3Joiner, audio_path)
+
+        async for piece in tts_engine.synthesize_stream(
+            normalized.sentences[chapter.sentence_start:chapter.sentence_end],
+            voice=voice,
+            first_sentence=chapter.sentence_start,
+            on_progress=on_progress
+        ):
+            if output is not None:
+                await asyncio.to_thread(output.append, piece.audio)
+                if peaks is not None:
+                    await asyncio.to_thread(peaks.add_mp3, piece.audio)
+            else:
+                pcm, sample_rate, channels = wav_pcm(piece.audio)
+                if encoder is None:
+                    encoder = await encoder_pool.open(audio_path, sample_rate, channels)
+                await encoder.write(pcm)
+                if peaks is not None:
+                    peaks.add_pcm(pcm, sample_rate, channels)
+
+            result.duration += piece.duration
+            result.chunks.append((piece.chunk.sentence_start, piece.chunk.sentence_end, piece.duration))
+            result.retries += max(0, piece.attempts - 1)
+            result.cache_hits += 1 if piece.attempts == 0 else 0
+
+        if output is not None:
+            await asyncio.to_thread(output.finish)
+            output = None
+        elif encoder is not None:
+            await encoder.finish()
+            encoder = None
+    finally:
+        # Only reached with these still open when synthesis or encoding failed
+        if output is not None:
+            await asyncio.to_thread(output.abort)
+        if encoder is not None:
+            await encoder.abort()
+
+    result.elapsed = time.monotonic() - started
+    logger.info(
+        f"🗣️ {book_id} chapter {chapter.index}: {result.requests} requests, "
+        f"{result.cache_hits} cached, {result.retries} retries, "
+        f"{result.duration:.0f}s audio in {result.elapsed:.1f}s"
+    )
+    return result
+
+async def publish_segments(segmenter: HLSSegmenter, published: int) -> int:
+    """
+    Publish segments written since `published`, then the playlist listing
+    them, so it never names a segment storage doesn't have; returns the new count
+    """
+    if storage.is_local:
+        return len(segmenter.segments)
+    segments = segmenter.segments[published:]
+    for name, _ in segments:
+        await storage.publish(os.path.join(segmenter.directory, name))
+    await storage.publish(os.path.join(segmenter.directory, PLAYLIST_NAME))
+    return published + len(segments)
+
+async def publish_book_audio(book_id: str, chapters: List[Chapter]) -> None:
+    """Publish the book and chapter MP3s"""
+    if storage.is_local:
+        return
+    paths = [os.path.join(settings.output_path, f"{book_id}.mp3")]
+    paths += [os.path.join(settings.output_path, chapter_audio_name(book_id, chapter.index)) for chapter in chapters]
+    for path in paths:
+        # Chapters without text have no audio file
+        if await asyncio.to_thread(os.path.exists, path):
+            await storage.publish(path)
+
+async def run_synthesis_stage(
+    book_id: str,
+    chapters: List[Chapter],
+    normalized: NormalizedText,
+    segmenter: Optional[HLSSegmenter] = None,
+    voice: Optional[Dict[str, Any]] = None,
+    peaks: Optional[BookPeaks] = None,
+    aligner: Optional[SentenceAligner] = None
+) -> Tuple[float, Dict[str, Any]]:
+    """
+    Synthesize chapters concurrently (bounded) and feed finished audio to the
+    segmenter in playback order; fills in chapter times, returns the total
+    duration and the job's synthesis stats (requests, cache hits, retries).
+    Chunk timings go to `aligner` for per-sentence times.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.chapter_concurrency))
+    package_lock = asyncio.Lock()
+    finished = set()
+    next_to_package = 0
+    published = 0
+    total_sentences = max(1, sum(chapter.sentence_count for chapter in chapters))
+    sentences_done = 0
+    stats = {"requests": 0, "cache_hits": 0, "retries": 0}
+
+    async def report(sentences: int) -> None:
+        nonlocal sentences_done
+        sentences_done += sentences
+        await progress_tracker.update(book_id, progress=20 + int(75 * sentences_done / total_sentences))
+
+    async def package_ready() -> None:
+        nonlocal next_to_package, published
+        async with package_lock:
+            # Later chapters wait until every earlier one has been packaged
+            while next_to_package in finished:
+                audio_path = os.path.join(settings.output_path, chapter_audio_name(book_id, next_to_package))
+                if segmenter is not None and os.path.exists(audio_path):
+                    await asyncio.to_thread(segmenter.append_file, audio_path)
+                    published = await publish_segments(segmenter, published)
+                next_to_package += 1
+
+    async def run(chapter: Chapter) -> None:
+        async with semaphore:
+            result = await synthesize_chapter(
+                book_id, chapter, normalized, voice or {}, report,
+                peaks.chapter(chapter.index) if peaks is not None else None
+            )
+        chapter.duration = result.duration
+        if aligner is not None:
+            aligner.add_chapter(chapter.index, result.chunks)
+        stats["requests"] += result.requests
+        stats["cache_hits"] += result.cache_hits
+        stats["retries"] += result.retries
+        finished.add(chapter.index)
+        await package_ready()
+
+    await asyncio.gather(*(run(chapter) for chapter in chapters))
+    if segmenter is not None:
+        await asyncio.to_thread(segmenter.finish)
+        await publish_segments(segmenter, published)
+
+    elapsed = 0.0
+    for chapter in chapters:
+        chapter.start_time = elapsed
+        elapsed += chapter.duration or 0.0
+
+    stats["cache_hit_rate"] = round(stats["cache_hits"] / stats["requests"], 4) if stats["requests"] else None
+    return elapsed, stats
+
+def assemble_book_audio(book_id: str, chapters: List[Chapter]) -> AudioInfo:
+    """
+    Join the chapter files into the book's MP3 without re-encoding, under a
+    single Xing header, and record where each chapter starts in it (exact, from
+    the frames copied). Returns the probed file (blocking; run in a worker thread).
+    """
+    started = time.monotonic()
+    book_path = os.path.join(settings.output_path, f"{book_id}.mp3")
+    joiner = MP3Joiner(book_path)
+    try:
+        for chapter in chapters:
+            chapter.start_time = round(joiner.duration, 3)
+            chapter.byte_offset = joiner.audio_bytes
+            audio_path = os.path.join(settings.output_path, chapter_audio_name(book_id, chapter.index))
+            if os.path.exists(audio_path):
+                joiner.append_file(audio_path)
+            chapter.duration = round(joiner.duration - chapter.start_time, 3)
+        size = joiner.finish()
+    except Exception:
+        joiner.abort()
+        raise
+
+    # Offsets so far are into the audio; the Xing frame sits in front of it
+    for chapter in chapters:
+        chapter.byte_offset += joiner.header_length
+
+    elapsed = time.monotonic() - started
+    logger.info(f"📼 Assembled {book_id}.mp3: {joiner.frames} frames, {size / 1024 / 1024:.1f} MB in {elapsed:.2f}s")
+    return probe_audio(book_path)
+
+async def mark_pending(book_id: str, book_data: Dict[str, Any]) -> None:
+    """Record that a book is queued for conversion again (restore, prefetch)"""
+    book_data["conversion_status"] = "pending"
+    book_data["progress"] = 0
+    book_data["updated_at"] = datetime.utcnow().isoformat()
+    await kv_store.set(f"book:{book_id}", book_data)
+    await progress_tracker.update(book_id, user_id=book_data["user_id"], status="pending", progress=0)
+
+async def process_pdf_to_audio(book_id: str, user_id: str):
+    """
+    Background task to process PDF to audio. The book's audio is pinned in
+    the artifact store while it's being written, and counted against the
+    storage budget once it's done.
+    """
+    with artifact_store.pinned(book_id):
+        try:
+            async with JobMemory():
+                await convert_pdf_to_audio(book_id, user_id)
+        finally:
+            artifact_store.end_restore(book_id)
+    artifact_store.touch(book_id)
+    await artifact_store.refresh([book_id])
+
+async def convert_pdf_to_audio(book_id: str, user_id: str):
+    """Run every stage of a conversion, recording the outcome on the book"""
+
+    try:
+        # Update status to processing
+        book_data = await kv_store.get(f"book:{book_id}")
+        if not book_data:
+            return
+
+        book_data["conversion_status"] = "processing"
+        book_data["updated_at"] = datetime.utcnow().isoformat()
+        await kv_store.set(f"book:{book_id}", book_data)
+        await progress_tracker.update(book_id, user_id=user_id, status="processing", progress=0)
+
+        # The PDF may have been uploaded through another host
+        if book_data.get("file_key"):
+            await storage.fetch(book_data["file_key"])
+
+        # Text stage: skipped entirely when this PDF was already normalized
+        normalized, text_cache_hit = await run_text_stage(book_data)
+        book_data["page_count"] = normalized.page_count
+        book_data["sentence_count"] = len(normalized.sentences)
+        book_data["text_cache_hit"] = text_cache_hit
+        book_data["boilerplate_chars_removed"] = normalized.boilerplate_chars_removed
+
+        # Random-access copy of the text for page/sentence lookups
+        await asyncio.to_thread(write_text_artifact, artifact_path(settings.output_path, book_id), normalized)
+        await storage.publish(artifact_path(settings.output_path, book_id))
+
+        # Chapters are the unit of synthesis, caching and streaming
+        chapters = await run_chapter_stage(book_data, normalized)
+
+        # The playlist exists (and grows) from here on, so playback can start early;
+        # segments of a previous render go first (locally the segmenter clears them)
+        if not storage.is_local:
+            await storage.delete_prefix(output_key(f"{book_id}.hls/"))
+        segmenter = await asyncio.to_thread(HLSSegmenter, settings.output_path, book_id, settings.hls_segment_duration)
+        book_data["playlist_url"] = f"/api/v1/audio/playlist/{book_id}"
+        await kv_store.set(f"book:{book_id}", book_data)
+
+        await progress_tracker.update(book_id, stage="synthesizing", progress=20)
+        peaks = BookPeaks(settings.output_path, book_id)
+        aligner = SentenceAligner()
+        _, synthesis_stats = await run_synthesis_stage(
+            book_id, chapters, normalized, segmenter, book_data.get("voice_settings"), peaks, aligner
+        )
+        book_data["segment_count"] = len(segmenter.segments)
+        book_data["synthesis_stats"] = {**synthesis_stats, "peak_rss_mb": peak_rss_mb()}
+
+        # One seekable file for download and plain (non-HLS) playback; its
+        # probed metadata is kept with the record so reads never open the audio
+        await progress_tracker.update(book_id, stage="assembling", progress=95)
+        audio_info = await asyncio.to_thread(assemble_book_audio, book_id, chapters)
+        book_data["chapters"] = [chapter.to_dict() for chapter in chapters]
+        book_data["audio_info"] = audio_info.to_dict()
+        await publish_book_audio(book_id, chapters)
+
+        # Sentence times in the text artifact, now that chapter spans are exact
+        await asyncio.to_thread(
+            aligner.write, artifact_path(settings.output_path, book_id), normalized.sentences, chapters
+        )
+        await storage.publish(artifact_path(settings.output_path, book_id))
+
+        # Scrubber waveform, precomputed so clients never download audio for it
+        await progress_tracker.update(book_id, stage="waveform", progress=98)
+        book_data["peaks"] = await asyncio.to_thread(peaks.write)
+        if book_data["peaks"]:
+            await storage.publish(peaks_dir(settings.output_path, book_id))
+
+        # Variants configured up front; a failure here only means they'll be made on request
+        if settings.audio_variant_names:
+            await progress_tracker.update(book_id, stage="variants", progress=99)
+        for name in settings.audio_variant_names:
+            if name not in VARIANTS:
+                logger.warning(f"⚠️ Unknown audio variant '{name}' in AUDIO_VARIANTS")
+                continue
+            try:
+                await ensure_variant(os.path.join(settings.output_path, f"{book_id}.mp3"), VARIANTS[name])
+            except EncoderError as e:
+                logger.warning(f"⚠️ Could not encode {name} for {book_id}: {e}")
+        logger.info(
+            f"♻️ {book_id}: {synthesis_stats['cache_hits']}/{synthesis_stats['requests']} "
+            f"TTS requests served from cache"
+        )
+
+        # Mark as completed
+        book_data["conversion_status"] = "completed"
+        book_data["progress"] = 100
+        book_data["converted_at"] = datetime.utcnow().isoformat()
+        book_data["updated_at"] = book_data["converted_at"]
+        book_data["audio_url"] = f"/api/v1/audio/stream/{book_id}"
+        book_data["duration"] = audio_info.duration
+        book_data.pop("regeneration_requested", None)
+        book_data.pop("audio_evicted_at", None)
+        await kv_store.set(f"book:{book_id}", book_data)
+        await progress_tracker.update(book_id, status="completed", progress=100, stage="done")
+
+        # TODO: Send notification to user about completion
+        # This would integrate with your notification system
+
+        # Log completion
+        await update_user_activity(
+            user_id,
+            "pdf_processed",
+            {
+                "book_id": book_id,
+                "title": book_data["title"],
+                "text_cache_hit": text_cache_hit,
+                "boilerplate_chars_removed": normalized.boilerplate_chars_removed,
+                "chapters": len(chapters),
+                "tts_provider": settings.tts_provider,
+                "tts_cache_hit_rate": synthesis_stats["cache_hit_rate"]
+            }
+        )
+
+    except Exception as e:
+        logger.error(f"❌ Conversion failed for {book_id}: {e}", exc_info=True)
+
+        # Mark as failed
+        book_data = await kv_store.get(f"book:{book_id}")
+        if book_data:
+            book_data["conversion_status"] = "failed"
+            book_data["error_message"] = str(e)
+            book_data["updated_at"] = datetime.utcnow().isoformat()
+            await kv_store.set(f"book:{book_id}", book_data)
+        await progress_tracker.update(book_id, status="failed", error_message=str(e))
+
+        # Log error
+        await update_user_activity(
+            user_id,
+            "pdf_processing_error",
+            {
+                "book_id": book_id,
+                "error": str(e)
+            }
+        )
+
+__all__ = [
+    'process_pdf_to_audio',
+    'mark_pending',
+    'run_text_stage',
+    'run_chapter_stage',
+    'run_synthesis_stage',
+    'assemble_book_audio',
+    'publish_segments',
+    'publish_book_audio',
+    'text_cache_path',
+    'save_normalized_text',
+    'load_normalized_text'
+]
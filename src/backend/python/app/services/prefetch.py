@@ -0,0 +1,242 @@
+"""
+Next-book prefetch
+Listeners with auto_play_next go straight from one library item to the next,
+which may not be converted yet (or was evicted), or whose first segments are
+cold. The player reports playback progress; once a listener is
+PREFETCH_THRESHOLD into a book, the next item in their library is queued:
+converted (or restored) if it has no audio, otherwise its first segments are
+brought onto this host and its usage bumped so eviction keeps it.
+Speculative work yields to what listeners ask for: one job per listener, a
+few at a time, conversions waiting while others run and skipped when the
+audio storage is near its budget.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.config import get_settings
+from app.database import kv_store, get_user_profile
+from app.services.artifact_store import artifact_store
+from app.services.hls import PLAYLIST_NAME, playlist_segments
+from app.services.pipeline import process_pdf_to_audio, mark_pending
+from app.services.storage import storage, output_key
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Seconds between checks while the host is busy with other conversions
+BUSY_POLL_INTERVAL = 5.0
+# Seconds a pending book is left alone; its upload has just queued it
+PENDING_GRACE = 60
+# Listeners remembered as handled for their current book
+MAX_HANDLED = 10000
+WARM_CHUNK = 1024 * 1024
+
+def _entry_id(entry: Any) -> Optional[str]:
+    """Book ID of a library entry (IDs, or book objects in lists the edge functions wrote)"""
+    if isinstance(entry, dict):
+        return entry.get("id")
+    return entry if isinstance(entry, str) else None
+
+def next_book_id(library: List[Any], book_id: str) -> Optional[str]:
+    """The library item after `book_id`; None at the end or if it isn't listed"""
+    ids = [_entry_id(entry) for entry in library]
+    if book_id not in ids:
+        return None
+    return next((entry for entry in ids[ids.index(book_id) + 1:] if entry and entry != book_id), None)
+
+def _read_through(path: str) -> int:
+    """Read a file so its pages are cached; returns bytes read (blocking)"""
+    read = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(WARM_CHUNK)
+            if not chunk:
+                return read
+            read += len(chunk)
+
+def _queued_recently(book_data: Dict[str, Any]) -> bool:
+    try:
+        updated_at = datetime.fromisoformat(book_data["updated_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return (datetime.utcnow() - updated_at).total_seconds() < PENDING_GRACE
+
+class PrefetchScheduler:
+    """Next books to prepare, one per listener, worked off a few at a time; see on_progress()"""
+
+    def __init__(
+        self,
+        threshold: float,
+        segments: int,
+        concurrency: int,
+        max_conversions: int,
+        max_utilization: float,
+        queue_size: int,
+        enabled: bool = True
+    ):
+        self.threshold = threshold
+        self.segments = segments
+        self.concurrency = max(1, concurrency)
+        self.max_conversions = max(1, max_conversions)
+        self.max_utilization = max_utilization
+        self.queue_size = queue_size
+        self.enabled = enabled
+        self.queued = 0
+        self.conversions = 0
+        self.warmed = 0
+        self.skipped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending: Dict[str, str] = {}
+        self._handled: "OrderedDict[str, str]" = OrderedDict()
+
+    def _start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.queue_size)
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def _remember(self, user_id: str, book_id: str) -> None:
+        self._handled[user_id] = book_id
+        self._handled.move_to_end(user_id)
+        while len(self._handled) > MAX_HANDLED:
+            self._handled.popitem(last=False)
+
+    async def on_progress(self, user_id: str, book_id: str, position: float, duration: Optional[float]) -> Optional[str]:
+        """
+        Note a listener's position in a book; past the threshold, their next
+        book is queued once per current book. Returns its ID if it was queued.
+        """
+        if not self.enabled or not duration or position < duration * self.threshold:
+            return None
+        if self._handled.get(user_id) == book_id or user_id in self._pending:
+            return None
+        self._remember(user_id, book_id)
+
+        profile = await get_user_profile(user_id)
+        preferences = (profile or {}).get("preferences") or {}
+        # On unless turned off, as in new profiles
+        if not preferences.get("auto_play_next", True):
+            return None
+        library = await kv_store.get(f"user:{user_id}:books") or []
+        next_id = next_book_id(library, book_id)
+        if next_id is None:
+            return None
+
+        self._start()
+        try:
+            self._queue.put_nowait((user_id, next_id))
+        except asyncio.QueueFull:
+            # Forgotten, so a later report tries again
+            self._handled.pop(user_id, None)
+            return None
+        self._pending[user_id] = next_id
+        self.queued += 1
+        logger.info(f"⏭️ Queued prefetch of {next_id} after {book_id}")
+        return next_id
+
+    async def _work(self) -> None:
+        while True:
+            user_id, book_id = await self._queue.get()
+            try:
+                await self._prepare(book_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Prefetch of {book_id} failed: {e}")
+            finally:
+                self._pending.pop(user_id, None)
+                self._queue.task_done()
+
+    @staticmethod
+    def _needs_conversion(book_data: Dict[str, Any]) -> bool:
+        """Evicted, or pending with nothing converting it (audio deleted, queue lost in a restart)"""
+        status = book_data.get("conversion_status")
+        if status == "completed":
+            return bool(book_data.get("audio_evicted_at"))
+        return status == "pending" and not _queued_recently(book_data)
+
+    async def _prepare(self, book_id: str) -> None:
+        book_data = await kv_store.get(f"book:{book_id}")
+        if not book_data:
+            return
+        if book_data.get("conversion_status") == "completed" and not book_data.get("audio_evicted_at"):
+            await self._warm(book_id)
+        elif self._needs_conversion(book_data):
+            await self._convert(book_id)
+
+    async def _convert(self, book_id: str) -> None:
+        """Convert or restore the book once other conversions leave room, within the storage budget"""
+        while artifact_store.pinned_count() >= self.max_conversions:
+            await asyncio.sleep(BUSY_POLL_INTERVAL)
+
+        # It may have been requested, converted or deleted meanwhile
+        book_data = await kv_store.get(f"book:{book_id}")
+        if not book_data or not self._needs_conversion(book_data):
+            return
+        utilization = artifact_store.stats()["utilization"]
+        if utilization is not None and utilization >= self.max_utilization:
+            # Converting would evict audio someone streamed for audio nobody has asked for yet
+            self.skipped += 1
+            logger.info(f"⏭️ Skipped prefetch of {book_id}: audio storage at {utilization:.0%}")
+            return
+        if not artifact_store.begin_restore(book_id):
+            return
+
+        logger.info(f"⏭️ Converting {book_id} ahead of playback")
+        self.conversions += 1
+        await mark_pending(book_id, book_data)
+        await process_pdf_to_audio(book_id, book_data["user_id"])
+
+    async def _warm(self, book_id: str) -> None:
+        """Bring the first segments onto this host (from shared storage, or into the page cache)"""
+        playlist = await storage.read_bytes(output_key(f"{book_id}.hls/{PLAYLIST_NAME}"))
+        if playlist is None:
+            return
+        for name in playlist_segments(playlist.decode())[:self.segments]:
+            path = await storage.fetch(output_key(f"{book_id}.hls/{name}"))
+            if path is not None and storage.is_local:
+                await asyncio.to_thread(_read_through, path)
+        if not storage.is_local:
+            artifact_store.changed(book_id)
+        # Counts as a stream, so the budget keeps it until it's played
+        artifact_store.touch(book_id)
+        self.warmed += 1
+        logger.info(f"⏭️ Warmed first segments of {book_id}")
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "waiting": self._queue.qsize() if self._queue is not None else 0,
+            "listeners": len(self._pending),
+            "queued": self.queued,
+            "conversions": self.conversions,
+            "warmed": self.warmed,
+            "skipped": self.skipped
+        }
+
+prefetch_scheduler = PrefetchScheduler(
+    settings.prefetch_threshold,
+    settings.prefetch_segments,
+    settings.prefetch_concurrency,
+    settings.prefetch_max_conversions,
+    settings.prefetch_max_utilization,
+    settings.prefetch_queue_size,
+    settings.prefetch_enabled
+)
+
+__all__ = [
+    'PrefetchScheduler',
+    'prefetch_scheduler',
+    'next_book_id'
+]
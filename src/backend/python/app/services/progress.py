@@ -0,0 +1,170 @@
+"""
+Lightweight conversion progress tracking
+Keeps fast-changing progress in memory and coalesces KV writes
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from app.config import get_settings
+from app.database import kv_store
+from app.services.events import event_broker, book_topic, user_topic
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# States that end a conversion; always persisted immediately
+TERMINAL_STATES = ("completed", "failed")
+
+def progress_key(book_id: str) -> str:
+    """KV key of the progress record for a book"""
+    return f"book:{book_id}:progress"
+
+class ProgressTracker:
+    """
+    In-memory-first progress records, persisted separately from `book:{id}`.
+    Progress ticks are written at most once per flush interval; status
+    transitions are written immediately.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._last_flush: Dict[str, float] = {}
+        self._pending_flush: Dict[str, asyncio.Task] = {}
+        self.kv_writes = 0
+
+    async def get(self, book_id: str) -> Optional[Dict[str, Any]]:
+        """Get the progress record, from memory first and KV second"""
+        record = self._records.get(book_id)
+        if record is not None:
+            return dict(record)
+        return await kv_store.get(progress_key(book_id))
+
+    async def get_many(self, book_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get progress records for many books with one batched KV read for the misses"""
+        result = {
+            book_id: dict(self._records[book_id])
+            for book_id in book_ids if book_id in self._records
+        }
+        missing = [book_id for book_id in book_ids if book_id not in result]
+        if missing:
+            stored = await kv_store.mget([progress_key(book_id) for book_id in missing])
+            for book_id in missing:
+                result[book_id] = stored.get(progress_key(book_id))
+        return result
+
+    async def update(
+        self,
+        book_id: str,
+        user_id: Optional[str] = None,
+        status: Optional[str] = None,
+        progress: Optional[int] = None,
+        stage: Optional[str] = None,
+        error_message: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Update progress for a book, persisting according to the coalescing rules"""
+        record = self._records.get(book_id)
+        if record is None:
+            record = await kv_store.get(progress_key(book_id)) or {
+                "book_id": book_id,
+                "status": "pending",
+                "progress": 0
+            }
+            self._records[book_id] = record
+
+        transition = status is not None and status != record.get("status")
+
+        if user_id is not None:
+            record["user_id"] = user_id
+        if status is not None:
+            record["status"] = status
+        if progress is not None:
+            record["progress"] = progress
+        if stage is not None:
+            record["stage"] = stage
+        if error_message is not None or transition:
+            record["error_message"] = error_message
+        record["updated_at"] = datetime.utcnow().isoformat()
+
+        if transition:
+            await self._flush(book_id)
+        elif time.monotonic() - self._last_flush.get(book_id, 0) >= self.flush_interval:
+            await self._flush(book_id)
+        elif book_id not in self._pending_flush:
+            self._pending_flush[book_id] = asyncio.create_task(self._delayed_flush(book_id))
+
+        snapshot = dict(record)
+        self._publish(snapshot, "status" if transition else "progress")
+
+        # Terminal records no longer change; KV is the source of truth from here on
+        if record["status"] in TERMINAL_STATES:
+            self._drop(book_id)
+
+        return snapshot
+
+    def active_for_user(self, user_id: str) -> List[Dict[str, Any]]:
+        """In-flight progress records for a user's books"""
+        return [
+            dict(record) for record in self._records.values()
+            if record.get("user_id") == user_id
+        ]
+
+    async def forget(self, book_id: str) -> None:
+        """Drop all progress state for a deleted book"""
+        self._drop(book_id)
+        self._last_flush.pop(book_id, None)
+        await kv_store.delete(progress_key(book_id))
+
+    async def _delayed_flush(self, book_id: str) -> None:
+        """Persist the latest record once the current interval has elapsed"""
+        try:
+            elapsed = time.monotonic() - self._last_flush.get(book_id, 0)
+            await asyncio.sleep(max(0.0, self.flush_interval - elapsed))
+            self._pending_flush.pop(book_id, None)
+            if book_id in self._records:
+                await self._flush(book_id)
+        except asyncio.CancelledError:
+            pass
+
+    async def _flush(self, book_id: str) -> None:
+        """Write the in-memory record to KV"""
+        record = self._records.get(book_id)
+        if record is None:
+            return
+
+        pending = self._pending_flush.pop(book_id, None)
+        if pending is not None and pending is not asyncio.current_task():
+            pending.cancel()
+
+        self._last_flush[book_id] = time.monotonic()
+        self.kv_writes += 1
+        await kv_store.set(progress_key(book_id), dict(record))
+        logger.debug(f"📈 Progress flushed for {book_id}: {record.get('status')} {record.get('progress')}%")
+
+    def _publish(self, snapshot: Dict[str, Any], event_type: str) -> None:
+        """Push the update to connected status subscribers"""
+        topics = [book_topic(snapshot["book_id"])]
+        if snapshot.get("user_id"):
+            topics.append(user_topic(snapshot["user_id"]))
+        event_broker.publish(topics, event_type, snapshot)
+
+    def _drop(self, book_id: str) -> None:
+        """Remove a record from memory"""
+        self._records.pop(book_id, None)
+        pending = self._pending_flush.pop(book_id, None)
+        if pending is not None and pending is not asyncio.current_task():
+            pending.cancel()
+
+# Global progress tracker instance
+progress_tracker = ProgressTracker(settings.progress_flush_interval)
+
+__all__ = [
+    'progress_tracker',
+    'progress_key',
+    'ProgressTracker',
+    'TERMINAL_STATES'
+]
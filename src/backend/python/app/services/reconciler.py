@@ -0,0 +1,325 @@
+"""
+Storage reconciliation
+Walks the upload and output directories in batches, looks up the books they
+belong to with one KV read per batch, and removes what no record accounts for:
+uploads and audio of deleted books, audio left behind by failed conversions,
+and stray temporary files. Deletes draw on a rate budget so a large cleanup
+doesn't compete with streaming for disk I/O. Completed books whose audio has
+gone missing are marked evicted, so their next request restores them.
+Nothing is deleted while the KV store isn't live, nor from a batch in which
+no book resolves: that looks like lookups failing open, not a library
+deleted at once.
+"""
+
+import os
+import re
+import time
+import shutil
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from app.config import get_settings
+from app.database import kv_store
+from app.services.artifact_store import artifact_store, disk_usage, remove_book_audio
+from app.services.text_artifact import ARTIFACT_EXTENSION, artifact_path
+from app.services.tts_engine import RateBudget
+from app.services.storage import storage, output_key
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+UPLOAD_NAME = re.compile(r"^(book_[0-9a-fA-F-]+)_")
+PARTIAL_SUFFIXES = (".tmp", ".enc")
+
+@dataclass
+class ScannedEntry:
+    name: str
+    path: str
+    is_dir: bool
+    size: int
+    mtime: float
+
+@dataclass
+class ReconcileReport:
+    started_at: str
+    dry_run: bool
+    duration: float = 0.0
+    scanned: int = 0
+    removed: int = 0
+    reclaimed_bytes: int = 0
+    marked_evicted: int = 0
+    skipped_batches: int = 0
+    errors: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def _next_batch(entries, size: int) -> List[ScannedEntry]:
+    """Up to `size` entries from a scandir iterator (blocking)"""
+    batch = []
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+            batch.append(ScannedEntry(entry.name, entry.path, entry.is_dir(follow_symlinks=False), stat.st_size, stat.st_mtime))
+        except FileNotFoundError:
+            continue
+        if len(batch) >= size:
+            break
+    return batch
+
+def _references(record: Dict[str, Any], path: str) -> bool:
+    """Whether a book record points at this upload: by storage key, or (older records) absolute path"""
+    if record.get("file_key"):
+        return record["file_key"] == storage.key_for(path)
+    file_path = record.get("file_path")
+    return bool(file_path) and os.path.abspath(file_path) == os.path.abspath(path)
+
+def _remove_path(path: str) -> int:
+    """Delete a file or directory tree; returns bytes freed (blocking)"""
+    freed = disk_usage(path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+    return freed
+
+async def delete_book_files(book_id: str, file_path: Optional[str], file_key: Optional[str] = None) -> int:
+    """
+    Remove everything stored for a deleted book: the uploaded PDF, its audio
+    and its text artifact, locally and in shared storage. Run after the record
+    is gone; anything missed locally is an orphan the reconciler picks up
+    later. Returns bytes freed on local disk.
+    """
+    freed = await asyncio.to_thread(remove_book_audio, settings.output_path, book_id)
+    for path in (file_path, artifact_path(settings.output_path, book_id)):
+        if path:
+            try:
+                freed += await asyncio.to_thread(_remove_path, path)
+            except FileNotFoundError:
+                pass
+    if not storage.is_local:
+        if file_key:
+            await storage.delete(file_key)
+        await storage.delete_prefix(output_key(f"{book_id}."))
+    artifact_store.forget(book_id)
+    logger.info(f"🗑️ Removed files of deleted book {book_id} ({freed / 1024 / 1024:.1f} MB)")
+    return freed
+
+class StorageReconciler:
+    """One pass at a time over uploads and outputs; see run()"""
+
+    def __init__(
+        self,
+        upload_path: str,
+        output_path: str,
+        batch_size: int,
+        deletes_per_minute: int,
+        min_age: float,
+        dry_run: bool
+    ):
+        self.upload_path = upload_path
+        self.output_path = output_path
+        self.batch_size = batch_size
+        self.min_age = min_age
+        self.dry_run = dry_run
+        self.budget = RateBudget(deletes_per_minute)
+        self.runs = 0
+        self.removed = 0
+        self.reclaimed_bytes = 0
+        self.last_report: Optional[ReconcileReport] = None
+        self._running = False
+
+    async def _batches(self, directory: str) -> AsyncIterator[List[ScannedEntry]]:
+        """One scan of a directory, read a batch at a time in worker threads"""
+        try:
+            entries = await asyncio.to_thread(os.scandir, directory)
+        except FileNotFoundError:
+            return
+        try:
+            while True:
+                batch = await asyncio.to_thread(_next_batch, entries, self.batch_size)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            entries.close()
+
+    async def _records(self, book_ids: Set[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Book records for a batch in one round trip; KV errors abort the pass"""
+        if not book_ids:
+            return {}
+        keys = {f"book:{book_id}": book_id for book_id in book_ids}
+        found = await kv_store.mget(list(keys), strict=True)
+        return {book_id: found.get(key) for key, book_id in keys.items()}
+
+    @staticmethod
+    def _implausible(records: Dict[str, Optional[Dict[str, Any]]], report: ReconcileReport) -> bool:
+        """Every book of a batch missing: don't trust the lookups with deletes"""
+        if records and all(record is None for record in records.values()):
+            report.skipped_batches += 1
+            logger.warning(f"⚠️ None of {len(records)} books in a batch found in the KV store; leaving their files")
+            return True
+        return False
+
+    async def _remove(self, entry: ScannedEntry, reason: str, report: ReconcileReport) -> bool:
+        if report.dry_run:
+            freed = entry.size if not entry.is_dir else await asyncio.to_thread(disk_usage, entry.path)
+        else:
+            await self.budget.acquire()
+            try:
+                freed = await asyncio.to_thread(_remove_path, entry.path)
+            except FileNotFoundError:
+                return False
+            except OSError as e:
+                logger.warning(f"⚠️ Could not remove {entry.path}: {e}")
+                report.errors += 1
+                return False
+        logger.debug(f"🗑️ {'Would remove' if report.dry_run else 'Removed'} {reason}: {entry.name}")
+        report.removed += 1
+        report.reclaimed_bytes += freed
+        return True
+
+    async def _sweep_uploads(self, report: ReconcileReport, cutoff: float) -> None:
+        """Uploaded PDFs whose book record is gone or points at another file"""
+        async for batch in self._batches(self.upload_path):
+            owners = {}
+            for entry in batch:
+                match = UPLOAD_NAME.match(entry.name)
+                if match and not entry.is_dir:
+                    owners[entry.path] = match.group(1)
+            records = await self._records(set(owners.values()))
+            if self._implausible(records, report):
+                report.scanned += len(batch)
+                continue
+
+            for entry in batch:
+                report.scanned += 1
+                book_id = owners.get(entry.path)
+                if book_id is None or entry.mtime > cutoff:
+                    continue
+                record = records.get(book_id)
+                if record is None or not _references(record, entry.path):
+                    await self._remove(entry, "orphaned upload", report)
+
+    async def _sweep_outputs(self, report: ReconcileReport, cutoff: float) -> None:
+        """Audio and text of deleted books, failed conversions' audio, temporary files"""
+        async for batch in self._batches(self.output_path):
+            book_ids = set()
+            for entry in batch:
+                book_id, dot, _ = entry.name.partition(".")
+                if dot and book_id:
+                    book_ids.add(book_id)
+            records = await self._records(book_ids)
+            if self._implausible(records, report):
+                report.scanned += len(batch)
+                continue
+
+            touched = set()
+            for entry in batch:
+                report.scanned += 1
+                book_id, dot, _ = entry.name.partition(".")
+                # Books being converted are writing right now
+                if not dot or not book_id or entry.mtime > cutoff or artifact_store.is_pinned(book_id):
+                    continue
+                record = records.get(book_id)
+                if record is None:
+                    reason = "orphaned output"
+                elif entry.name.endswith(PARTIAL_SUFFIXES):
+                    reason = "partial output"
+                elif record.get("conversion_status") == "failed" and not entry.name.endswith(ARTIFACT_EXTENSION):
+                    reason = "output of failed conversion"
+                else:
+                    continue
+                if await self._remove(entry, reason, report):
+                    touched.add(book_id)
+
+            if not report.dry_run:
+                for book_id in touched:
+                    if records.get(book_id) is None:
+                        artifact_store.forget(book_id)
+                    else:
+                        artifact_store.changed(book_id)
+            await self._mark_missing_audio(records, report)
+
+    async def _mark_missing_audio(self, records: Dict[str, Optional[Dict[str, Any]]], report: ReconcileReport) -> None:
+        """Completed records whose book MP3 is gone are treated as evicted, so a request restores them"""
+        for book_id, record in records.items():
+            if not record or record.get("conversion_status") != "completed" or record.get("audio_evicted_at"):
+                continue
+            if artifact_store.is_pinned(book_id):
+                continue
+            if await storage.stat(output_key(f"{book_id}.mp3")) is not None:
+                continue
+            report.marked_evicted += 1
+            if not report.dry_run:
+                record["audio_evicted_at"] = datetime.utcnow().isoformat()
+                await kv_store.set(f"book:{book_id}", record)
+
+    async def run(self) -> Optional[ReconcileReport]:
+        """One pass over uploads and outputs; None if a pass is already running"""
+        if self._running:
+            return None
+        self._running = True
+        # Deletes follow the KV store: with lookups that can't find anything, everything looks orphaned
+        report = ReconcileReport(started_at=datetime.utcnow().isoformat(), dry_run=self.dry_run or not kv_store.live)
+        started = time.monotonic()
+        cutoff = time.time() - self.min_age
+        try:
+            await self._sweep_uploads(report, cutoff)
+            await self._sweep_outputs(report, cutoff)
+        except Exception as e:
+            logger.error(f"❌ Storage reconciliation stopped: {e}")
+            report.errors += 1
+        finally:
+            self._running = False
+
+        report.duration = round(time.monotonic() - started, 3)
+        self.runs += 1
+        if not report.dry_run:
+            self.removed += report.removed
+            self.reclaimed_bytes += report.reclaimed_bytes
+        self.last_report = report
+        logger.info(
+            f"🧹 Storage reconciled: {report.scanned} entries scanned, {report.removed} "
+            f"{'would be ' if report.dry_run else ''}removed ({report.reclaimed_bytes / 1024 / 1024:.1f} MB), "
+            f"{report.marked_evicted} books marked evicted in {report.duration:.1f}s"
+        )
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "dry_run": self.dry_run or not kv_store.live,
+            "removed": self.removed,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "last_run": self.last_report.to_dict() if self.last_report else None
+        }
+
+storage_reconciler = StorageReconciler(
+    settings.upload_path,
+    settings.output_path,
+    settings.gc_batch_size,
+    settings.gc_deletes_per_minute,
+    settings.gc_min_age,
+    settings.gc_dry_run
+)
+
+async def run_reconciler() -> None:
+    """Reconcile storage every GC_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(settings.gc_interval)
+        try:
+            await storage_reconciler.run()
+        except Exception as e:
+            logger.error(f"❌ Storage reconciler error: {e}")
+
+__all__ = [
+    'StorageReconciler',
+    'ReconcileReport',
+    'storage_reconciler',
+    'run_reconciler',
+    'delete_book_files'
+]
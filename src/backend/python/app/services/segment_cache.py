@@ -0,0 +1,151 @@
+"""
+Content-addressed cache of synthesized audio chunks
+Keyed by the hash of (chunk text, voice, language, speed, provider, engine
+version), so regenerations and new editions only synthesize what changed.
+Files live on disk under tts_cache_path; an in-memory LRU index (rebuilt from
+the directory on first use) keeps the total under a byte budget.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+def cache_key(text: str, voice: Dict[str, Any], provider: str, engine_version: int) -> str:
+    """Stable key for one synthesis request"""
+    material = json.dumps(
+        {
+            "text": text,
+            "voice_type": voice.get("voice_type"),
+            "language": voice.get("language"),
+            "speed": float(voice.get("audio_speed") or 1.0),
+            "provider": provider,
+            "engine_version": engine_version
+        },
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class SegmentCache:
+    """Size-bounded LRU of audio chunks on disk (blocking; call from worker threads)"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._index: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()  # key -> (path, size)
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{extension}")
+
+    def _load(self) -> None:
+        """Rebuild the index from disk, least recently used first (mtime is bumped on hits)"""
+        entries = []
+        if os.path.isdir(self.directory):
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name.split(".", 1)[0], entry.path, stat.st_size))
+        entries.sort()
+        for _, key, path, size in entries:
+            self._index[key] = (path, size)
+            self.total_bytes += size
+        self._loaded = True
+        logger.info(f"🗂️ TTS cache index: {len(entries)} chunks, {self.total_bytes / 1024 / 1024:.1f} MB")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+
+        path, _ = entry
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if self._index.pop(key, None) is not None:
+                    self.total_bytes -= entry[1]
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes, extension: str) -> None:
+        path = self._path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            self._index[key] = (path, len(data))
+            self.total_bytes += len(data)
+            evicted = self._evict()
+
+        for evicted_path in evicted:
+            try:
+                os.remove(evicted_path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> list:
+        """Drop least recently used entries until under budget; returns paths to delete"""
+        paths = []
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            _, (path, size) = self._index.popitem(last=False)
+            self.total_bytes -= size
+            paths.append(path)
+        if paths:
+            logger.info(f"🧹 Evicted {len(paths)} TTS cache chunks")
+        return paths
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+segment_cache = SegmentCache(settings.tts_cache_path, settings.tts_cache_max_bytes)
+
+__all__ = [
+    'SegmentCache',
+    'cache_key',
+    'segment_cache'
+]
@@ -0,0 +1,781 @@
+"""
+Artifact storage
+Uploads and converted output are addressed by key ("uploads/<name>",
+"outputs/<name>") and every operation is async: the local backend runs file
+I/O in worker threads, the S3 backend (AWS, MinIO, R2, ...) speaks the REST
+API over httpx with SigV4 signing. Conversion still reads and writes the local
+upload/output directories; with S3 those are a working cache, finished
+artifacts are published to the bucket, and any worker host can serve them.
+"""
+
+import os
+import hmac
+import stat
+import time
+import base64
+import shutil
+import asyncio
+import hashlib
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from types import SimpleNamespace
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import anyio
+import httpx
+import aiofiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.config import get_settings
+from app.services.file_streaming import RangedFileResponse, RangeNotSatisfiable, parse_range_header
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 256 * 1024
+PART_SIZE = 8 * 1024 * 1024  # multipart upload parts; S3's minimum is 5 MB
+DELETE_CONCURRENCY = 16
+REVALIDATE_AFTER = 30.0  # seconds a fetched local copy is trusted without asking S3 again
+
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+class StorageError(Exception):
+    """The storage backend failed or refused a request"""
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    mtime: float
+    etag: Optional[str] = None
+
+def upload_key(name: str) -> str:
+    return f"uploads/{name}"
+
+def output_key(name: str) -> str:
+    return f"outputs/{name}"
+
+class StorageBackend:
+    """
+    Interface of the backends. Keys use "/" on every platform; each maps to a
+    local working path under UPLOAD_PATH or OUTPUT_PATH (see path_for).
+    A missing object is None from stat/fetch/read_bytes and FileNotFoundError
+    from get_range; backend failures raise StorageError.
+    """
+
+    name = "base"
+    is_local = False
+
+    def __init__(self, upload_path: str, output_path: str):
+        self.roots = {"uploads": os.path.abspath(upload_path), "outputs": os.path.abspath(output_path)}
+
+    def path_for(self, key: str) -> str:
+        """Local working path of a key; refuses keys that would escape the directories"""
+        prefix, _, name = key.partition("/")
+        root = self.roots.get(prefix)
+        parts = name.split("/")
+        if root is None or any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Invalid storage key '{key}'")
+        return os.path.join(root, *parts)
+
+    def key_for(self, path: str) -> str:
+        """Key of a file under the local upload or output directory"""
+        path = os.path.abspath(path)
+        for prefix, root in self.roots.items():
+            if path.startswith(root + os.sep):
+                return f"{prefix}/" + os.path.relpath(path, root).replace(os.sep, "/")
+        raise ValueError(f"{path} is outside the storage directories")
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        """Store an object from a stream of chunks; returns its size. Nothing is left behind on failure."""
+        raise NotImplementedError
+
+    async def put_file(self, key: str, path: str) -> int:
+        """Store a local file; returns its size"""
+        raise NotImplementedError
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Bytes `start` to `end` (inclusive; None: to the end) as they are read"""
+        raise NotImplementedError
+
+    async def read_bytes(self, key: str) -> Optional[bytes]:
+        """A whole (small) object, or None if it doesn't exist"""
+        try:
+            return b"".join([chunk async for chunk in self.get_range(key)])
+        except FileNotFoundError:
+            return None
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        """Remove an object; False if there was none"""
+        raise NotImplementedError
+
+    async def delete_prefix(self, prefix: str, keep: Optional[Callable[[str], bool]] = None) -> int:
+        """Remove every object whose key starts with `prefix` unless `keep(key)`; returns the count"""
+        raise NotImplementedError
+
+    async def presigned_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
+        """Time-limited URL clients can fetch the object from directly, where the backend offers one"""
+        return None
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path the object can be served from without going through the backend, if any"""
+        return None
+
+    async def fetch(self, key: str) -> Optional[str]:
+        """Local path of a current copy of the object, downloading it if needed; None if it doesn't exist"""
+        raise NotImplementedError
+
+    async def cached_copy(self, stored: StoredObject) -> Optional[str]:
+        """
+        Local path of a complete copy of an object whose content never changes
+        under its key (HLS segments), without asking the backend; None if this
+        host has none
+        """
+        return self.local_path(stored.key)
+
+    async def publish(self, path: str) -> None:
+        """Make a file (or everything under a directory) written to the working area available to all hosts"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": self.name}
+
+def _remove_prefix(directory: str, name_prefix: str, key_prefix: str, keep: Optional[Callable[[str], bool]]) -> int:
+    """Delete files (and directory trees) in `directory` whose names start with `name_prefix` (blocking)"""
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.startswith(name_prefix):
+            continue
+        if not entry.is_dir(follow_symlinks=False):
+            if keep is None or not keep(key_prefix + entry.name):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            continue
+        for root, dirs, files in os.walk(entry.path, topdown=False):
+            relative = os.path.relpath(root, directory).replace(os.sep, "/")
+            for name in files:
+                if keep is None or not keep(f"{key_prefix}{relative}/{name}"):
+                    try:
+                        os.remove(os.path.join(root, name))
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass  # kept files, or written to meanwhile
+    return removed
+
+def _signing_expiry(expires_in: int) -> int:
+    """Expiry at least `expires_in` away, rounded up to the minute so URLs repeat (and cache) within it"""
+    return (int(time.time()) + expires_in) // 60 * 60 + 60
+
+class LocalStorage(StorageBackend):
+    """
+    Objects are the files in the upload and output directories. Given a
+    signed URL base and secret, presigned URLs point at a web server
+    serving those directories with nginx secure_link, configured as
+    `secure_link $arg_md5,$arg_expires; secure_link_md5 "$secure_link_expires$uri <secret>";`
+    """
+
+    name = "local"
+    is_local = True
+
+    def __init__(self, upload_path: str, output_path: str, signed_url_base: str = "", signed_url_secret: str = ""):
+        super().__init__(upload_path, output_path)
+        self.signed_url_base = signed_url_base.rstrip("/") + "/" if signed_url_base else ""
+        self.signed_url_secret = signed_url_secret
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        path = self.path_for(key)
+        tmp_path = f"{path}.tmp"
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            await asyncio.to_thread(_remove_quietly, tmp_path)
+            raise
+        return size
+
+    async def put_file(self, key: str, path: str) -> int:
+        target = self.path_for(key)
+        if os.path.abspath(path) != target:
+            await asyncio.to_thread(_copy_file, path, target)
+        return (await asyncio.to_thread(os.stat, target)).st_size
+
+    async def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        async with aiofiles.open(self.path_for(key), "rb") as f:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await f.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            stat_result = await asyncio.to_thread(os.stat, self.path_for(key))
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        return StoredObject(key, stat_result.st_size, stat_result.st_mtime)
+
+    async def delete(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(os.remove, self.path_for(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def delete_prefix(self, prefix: str, keep: Optional[Callable[[str], bool]] = None) -> int:
+        # The prefix's last component matches names in its directory: "outputs/b1." -> b1.mp3, b1.hls/...
+        directory_key, _, name_prefix = prefix.rpartition("/")
+        if directory_key not in self.roots:
+            directory = self.path_for(directory_key)
+        else:
+            directory = self.roots[directory_key]
+        return await asyncio.to_thread(_remove_prefix, directory, name_prefix, f"{directory_key}/", keep)
+
+    async def presigned_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
+        if not self.signed_url_base or not self.signed_url_secret:
+            return None
+        self.path_for(key)  # validates the key
+        expires = _signing_expiry(expires_in)
+        # nginx hashes the decoded URI
+        uri = urlsplit(self.signed_url_base).path + key
+        digest = hashlib.md5(f"{expires}{uri} {self.signed_url_secret}".encode()).digest()
+        token = base64.urlsafe_b64encode(digest).decode().rstrip("=")
+        return f"{self.signed_url_base}{_uri_encode(key, safe='/-_.~')}?md5={token}&expires={expires}"
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self.path_for(key)
+
+    async def fetch(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        return path if await asyncio.to_thread(os.path.isfile, path) else None
+
+    async def publish(self, path: str) -> None:
+        self.key_for(path)  # already in place; only checks it's inside the storage directories
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _copy_file(source: str, target: str) -> None:
+    """Copy into place atomically (blocking)"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp"
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+
+# SigV4 (https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.html)
+
+@dataclass(frozen=True)
+class S3Credentials:
+    access_key: str
+    secret_key: str
+    region: str
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+def _canonical_query(query: str, extra: Optional[Dict[str, str]] = None) -> str:
+    params = parse_qsl(query, keep_blank_values=True) + list((extra or {}).items())
+    encoded = sorted((_uri_encode(name), _uri_encode(value)) for name, value in params)
+    return "&".join(f"{name}={value}" for name, value in encoded)
+
+def _signature(credentials: S3Credentials, amz_date: str, canonical_request: str) -> Tuple[str, str]:
+    """(credential scope, hex signature) of a canonical request"""
+    date = amz_date[:8]
+    scope = f"{date}/{credentials.region}/s3/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256",
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    key = f"AWS4{credentials.secret_key}".encode()
+    for part in (date, credentials.region, "s3", "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return scope, hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+def sign_request(
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    payload_hash: str,
+    credentials: S3Credentials,
+    now: Optional[datetime] = None
+) -> Dict[str, str]:
+    """Headers to send with a request (URL path already percent-encoded), Authorization included"""
+    parts = urlsplit(url)
+    amz_date = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+    signed = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+    signed.update({"host": parts.netloc, "x-amz-content-sha256": payload_hash, "x-amz-date": amz_date})
+    names = sorted(signed)
+    canonical_request = "\n".join([
+        method,
+        parts.path or "/",
+        _canonical_query(parts.query),
+        "".join(f"{name}:{signed[name]}\n" for name in names),
+        ";".join(names),
+        payload_hash
+    ])
+    scope, signature = _signature(credentials, amz_date, canonical_request)
+    signed["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={credentials.access_key}/{scope}, "
+        f"SignedHeaders={';'.join(names)}, Signature={signature}"
+    )
+    del signed["host"]  # httpx sends the same value itself
+    return signed
+
+def presign_url(
+    method: str,
+    url: str,
+    expires_in: int,
+    credentials: S3Credentials,
+    now: Optional[datetime] = None
+) -> str:
+    """Query-string-authenticated URL, valid for `expires_in` seconds (at most 7 days)"""
+    parts = urlsplit(url)
+    amz_date = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{amz_date[:8]}/{credentials.region}/s3/aws4_request"
+    query = _canonical_query(parts.query, {
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{credentials.access_key}/{scope}",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(min(max(1, expires_in), 7 * 24 * 3600)),
+        "X-Amz-SignedHeaders": "host"
+    })
+    canonical_request = "\n".join([method, parts.path or "/", query, f"host:{parts.netloc}\n", "host", UNSIGNED_PAYLOAD])
+    _, signature = _signature(credentials, amz_date, canonical_request)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{query}&X-Amz-Signature={signature}"
+
+class S3Storage(StorageBackend):
+    """
+    Objects in an S3-compatible bucket under `prefix`. With an endpoint
+    (MinIO, R2, ...) requests are path-style, otherwise virtual-hosted AWS.
+    Local copies made by fetch() are revalidated against the bucket
+    (size and modification time) at most every REVALIDATE_AFTER seconds.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        upload_path: str,
+        output_path: str,
+        bucket: str,
+        credentials: S3Credentials,
+        endpoint: str = "",
+        prefix: str = ""
+    ):
+        super().__init__(upload_path, output_path)
+        if not bucket:
+            raise ValueError("S3_BUCKET is required for the s3 storage backend")
+        self.bucket = bucket
+        self.credentials = credentials
+        if endpoint:
+            self.base_url = f"{endpoint.rstrip('/')}/{bucket}"
+        else:
+            self.base_url = f"https://{bucket}.s3.{credentials.region}.amazonaws.com"
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.requests = 0
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._validated: Dict[str, float] = {}
+        self._fetching: Dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+        return self._client
+
+    def _url(self, key: str = "", query: str = "") -> str:
+        path = _uri_encode(self.prefix + key, safe="/-_.~") if key else ""
+        return f"{self.base_url}/{path}" + (f"?{query}" if query else "")
+
+    def _sign(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, body: bytes = b"") -> Dict[str, str]:
+        return sign_request(method, url, headers or {}, hashlib.sha256(body).hexdigest(), self.credentials)
+
+    async def _request(
+        self,
+        method: str,
+        key: str = "",
+        query: str = "",
+        headers: Optional[Dict[str, str]] = None,
+        body: bytes = b""
+    ) -> httpx.Response:
+        url = self._url(key, query)
+        self.requests += 1
+        try:
+            response = await self.client.request(method, url, headers=self._sign(method, url, headers, body), content=body)
+        except httpx.HTTPError as e:
+            raise StorageError(f"S3 {method} {key or '/'} failed: {e}")
+        _check(response, method, key)
+        return response
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        buffer = bytearray()
+        upload_id = None
+        parts: List[Tuple[int, str]] = []
+        size = 0
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                while len(buffer) >= PART_SIZE:
+                    if upload_id is None:
+                        upload_id = await self._create_multipart(key)
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer[:PART_SIZE])))
+                    del buffer[:PART_SIZE]
+
+            if upload_id is None:
+                await self._request("PUT", key, body=bytes(buffer))
+            else:
+                if buffer or not parts:
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                await self._complete_multipart(key, upload_id, parts)
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    await self._request("DELETE", key, f"uploadId={_uri_encode(upload_id)}")
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not abort multipart upload of {key}: {e}")
+            raise
+        self.bytes_uploaded += size
+        self._validated.pop(key, None)
+        return size
+
+    async def _create_multipart(self, key: str) -> str:
+        response = await self._request("POST", key, "uploads=")
+        upload_id = _xml_text(ET.fromstring(response.content), "UploadId")
+        if not upload_id:
+            raise StorageError(f"S3 returned no upload ID for {key}")
+        return upload_id
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> Tuple[int, str]:
+        response = await self._request("PUT", key, f"partNumber={number}&uploadId={_uri_encode(upload_id)}", body=data)
+        return number, response.headers.get("etag", "")
+
+    async def _complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+        ) + "</CompleteMultipartUpload>"
+        response = await self._request("POST", key, f"uploadId={_uri_encode(upload_id)}", body=body.encode())
+        # Completion can fail after a 200 status; the error is in the body
+        if b"<Error>" in response.content:
+            raise StorageError(f"S3 could not complete the upload of {key}: {_xml_text(ET.fromstring(response.content), 'Message')}")
+
+    async def put_file(self, key: str, path: str) -> int:
+        async def read() -> AsyncIterator[bytes]:
+            async with aiofiles.open(path, "rb") as f:
+                while True:
+                    chunk = await f.read(PART_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return await self.put_stream(key, read())
+
+    async def get_range(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        headers = {}
+        if start or end is not None:
+            headers["range"] = f"bytes={start}-{'' if end is None else end}"
+        url = self._url(key)
+        self.requests += 1
+        try:
+            async with self.client.stream("GET", url, headers=self._sign("GET", url, headers)) as response:
+                if response.status_code >= 300:
+                    await response.aread()
+                _check(response, "GET", key)
+                async for chunk in response.aiter_bytes(READ_SIZE):
+                    self.bytes_downloaded += len(chunk)
+                    yield chunk
+        except httpx.HTTPError as e:
+            raise StorageError(f"S3 GET {key} failed: {e}")
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            response = await self._request("HEAD", key)
+        except FileNotFoundError:
+            return None
+        last_modified = response.headers.get("last-modified")
+        return StoredObject(
+            key,
+            int(response.headers.get("content-length", 0)),
+            parsedate_to_datetime(last_modified).timestamp() if last_modified else 0.0,
+            response.headers.get("etag")
+        )
+
+    async def delete(self, key: str) -> bool:
+        # S3 reports success whether or not the object existed
+        await self._request("DELETE", key)
+        self._validated.pop(key, None)
+        return True
+
+    async def list_keys(self, prefix: str) -> AsyncIterator[str]:
+        """Keys under `prefix`, a page of up to 1000 at a time"""
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": self.prefix + prefix}
+            if token:
+                query["continuation-token"] = token
+            response = await self._request("GET", query=_canonical_query("", query))
+            root = ET.fromstring(response.content)
+            for contents in root.iterfind("{*}Contents"):
+                key = _xml_text(contents, "Key")
+                if key and key.startswith(self.prefix):
+                    yield key[len(self.prefix):]
+            token = _xml_text(root, "NextContinuationToken")
+            if _xml_text(root, "IsTruncated") != "true" or not token:
+                return
+
+    async def delete_prefix(self, prefix: str, keep: Optional[Callable[[str], bool]] = None) -> int:
+        keys = [key async for key in self.list_keys(prefix) if keep is None or not keep(key)]
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def remove(key: str) -> None:
+            async with semaphore:
+                await self.delete(key)
+
+        await asyncio.gather(*(remove(key) for key in keys))
+        return len(keys)
+
+    async def presigned_url(self, key: str, expires_in: int = 3600) -> Optional[str]:
+        # Signed from the start of the minute, so URLs repeat (and cache) within it
+        now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        return presign_url("GET", self._url(key), expires_in + 60, self.credentials, now)
+
+    async def cached_copy(self, stored: StoredObject) -> Optional[str]:
+        # Written here by a conversion or fetched earlier; a partial file never has the final name
+        path = self.path_for(stored.key)
+        try:
+            size = (await asyncio.to_thread(os.stat, path)).st_size
+        except FileNotFoundError:
+            return None
+        return path if size == stored.size else None
+
+    async def fetch(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        validated = self._validated.get(key)
+        if validated is not None and time.monotonic() - validated < REVALIDATE_AFTER and os.path.exists(path):
+            return path
+
+        # One download per key, however many requests want it
+        task = self._fetching.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download(key, path))
+            self._fetching[key] = task
+            task.add_done_callback(lambda _: self._fetching.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, key: str, path: str) -> Optional[str]:
+        stored = await self.stat(key)
+        if stored is None:
+            return None
+        try:
+            local = await asyncio.to_thread(os.stat, path)
+            # A copy written here and then published is newer than the object; a stale one is older
+            if local.st_size == stored.size and local.st_mtime >= stored.mtime:
+                self._validated[key] = time.monotonic()
+                return path
+        except FileNotFoundError:
+            pass
+
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in self.get_range(key):
+                    await f.write(chunk)
+            await asyncio.to_thread(os.utime, tmp_path, (stored.mtime, stored.mtime))
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            await asyncio.to_thread(_remove_quietly, tmp_path)
+            raise
+        self._validated[key] = time.monotonic()
+        logger.info(f"⬇️ Fetched {key} from storage ({stored.size / 1024 / 1024:.1f} MB)")
+        return path
+
+    async def publish(self, path: str) -> None:
+        if await asyncio.to_thread(os.path.isdir, path):
+            files = await asyncio.to_thread(_walk_files, path)
+        else:
+            files = [path]
+        for file_path in files:
+            key = self.key_for(file_path)
+            await self.put_file(key, file_path)
+            # Marks the copy as current (newer than the object), so fetch() won't download it back
+            await asyncio.to_thread(os.utime, file_path)
+            self._validated[key] = time.monotonic()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.name,
+            "bucket": self.bucket,
+            "requests": self.requests,
+            "bytes_uploaded": self.bytes_uploaded,
+            "bytes_downloaded": self.bytes_downloaded
+        }
+
+def _check(response: httpx.Response, method: str, key: str) -> None:
+    if response.status_code == 404:
+        raise FileNotFoundError(key)
+    if response.status_code >= 300:
+        code = ""
+        if response.content and method != "HEAD":
+            try:
+                code = _xml_text(ET.fromstring(response.content), "Code") or ""
+            except ET.ParseError:
+                pass
+        raise StorageError(f"S3 {method} {key or '/'} returned {response.status_code} {code}".rstrip())
+
+def _xml_text(element: ET.Element, tag: str) -> Optional[str]:
+    found = element.find(f"{{*}}{tag}")
+    if found is None:
+        found = element.find(tag)
+    return found.text if found is not None else None
+
+def _walk_files(directory: str) -> List[str]:
+    """Every file under a directory, deepest last (blocking)"""
+    return [
+        os.path.join(root, name)
+        for root, _, files in os.walk(directory)
+        for name in sorted(files)
+        if not name.endswith(".tmp")
+    ]
+
+class RangedObjectResponse(RangedFileResponse):
+    """RangedFileResponse for an object read through the storage backend (single ranges)"""
+
+    def __init__(self, backend: StorageBackend, stored: StoredObject, **kwargs):
+        super().__init__(stored.key, **kwargs)
+        self.backend = backend
+        self.stored = stored
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        size = self.stored.size
+        etag = self.stored.etag or '"' + hashlib.md5(f"{self.stored.mtime}-{size}".encode()).hexdigest() + '"'
+        self.headers.setdefault("last-modified", formatdate(self.stored.mtime, usegmt=True))
+        self.headers.setdefault("etag", etag)
+        request_headers = Headers(scope=scope)
+        header_only = scope["method"].upper() == "HEAD"
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or self._if_range_matches(if_range, etag, SimpleNamespace(st_mtime=self.stored.mtime))):
+            try:
+                ranges = parse_range_header(range_header, size)
+            except RangeNotSatisfiable:
+                response = Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+                return await response(scope, receive, send)
+
+        # Several ranges are answered with the whole object, which RFC 9110 allows
+        start, end = ranges[0] if ranges and len(ranges) == 1 else (0, size - 1)
+        if ranges and len(ranges) == 1:
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(max(0, end - start + 1))
+
+        async def send_body() -> None:
+            await self._start(send, 206 if ranges and len(ranges) == 1 else 200)
+            if not header_only and end >= start:
+                async for chunk in self.backend.get_range(self.stored.key, start, end):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        async with anyio.create_task_group() as task_group:
+            async def wrap(func) -> None:
+                await func()
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(wrap, send_body)
+            await wrap(lambda: self._listen_for_disconnect(receive))
+
+def object_response(
+    stored: StoredObject,
+    media_type: str = "application/octet-stream",
+    filename: Optional[str] = None,
+    headers: Optional[dict] = None
+) -> RangedFileResponse:
+    """Range-capable response for a stored object: zero-copy from local disk, else streamed from the backend"""
+    path = storage.local_path(stored.key)
+    if path is not None:
+        return RangedFileResponse(path, media_type=media_type, filename=filename, headers=headers)
+    return RangedObjectResponse(storage, stored, media_type=media_type, filename=filename, headers=headers)
+
+def create_storage() -> StorageBackend:
+    """The backend selected by STORAGE_BACKEND"""
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            settings.upload_path,
+            settings.output_path,
+            settings.s3_bucket,
+            S3Credentials(settings.s3_access_key_id, settings.s3_secret_access_key, settings.s3_region),
+            settings.s3_endpoint,
+            settings.s3_prefix
+        )
+    if settings.storage_backend != "local":
+        logger.warning(f"⚠️ Unknown STORAGE_BACKEND '{settings.storage_backend}', using local")
+    return LocalStorage(settings.upload_path, settings.output_path, settings.signed_url_base, settings.signed_url_secret)
+
+storage = create_storage()
+
+__all__ = [
+    'StorageBackend',
+    'StorageError',
+    'StoredObject',
+    'LocalStorage',
+    'S3Storage',
+    'S3Credentials',
+    'RangedObjectResponse',
+    'storage',
+    'create_storage',
+    'object_response',
+    'upload_key',
+    'output_key',
+    'sign_request',
+    'presign_url'
+]
@@ -0,0 +1,335 @@
+"""
+Per-book text artifact ({book_id}.mgtx)
+Normalized sentences stored as zlib-compressed blocks behind fixed-width
+indexes, so a page or sentence can be read by mmap-ing the file and slicing,
+without loading the whole book
+
+Layout (little-endian):
+    header        magic, version, counts and section offsets
+    page index    (page_count + 1) x (first sentence u32, text byte offset u64)
+    sentence idx  sentence_count x (block u32, offset in block u32, length u32)
+    time index    sentence_count x (start f64, end f64), NaN until audio is aligned;
+                  starts never decrease, so time -> sentence is a binary search
+    block index   block_count x (data offset u64, compressed u32, raw u32)
+    data          concatenated zlib blocks of UTF-8 sentence text
+"""
+
+import os
+import mmap
+import zlib
+import bisect
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.text_normalizer import NormalizedText
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_MAGIC = b"MGTX"
+ARTIFACT_VERSION = 1
+ARTIFACT_EXTENSION = ".mgtx"
+
+_HEADER = struct.Struct("<4sHHIIIIQQQQQ")
+_PAGE_DTYPE = np.dtype([("sentence", "<u4"), ("offset", "<u8")])
+_SENTENCE_DTYPE = np.dtype([("block", "<u4"), ("offset", "<u4"), ("length", "<u4")])
+_TIME_DTYPE = np.dtype([("start", "<f8"), ("end", "<f8")])
+_BLOCK_DTYPE = np.dtype([("offset", "<u8"), ("compressed", "<u4"), ("raw", "<u4")])
+
+class _StartTimes:
+    """Sentence start times straight off the mmapped time index, as a sequence bisect can search"""
+    __slots__ = ("values",)
+
+    def __init__(self, values: memoryview):
+        self.values = values  # interleaved (start, end) doubles
+
+    def __len__(self) -> int:
+        return len(self.values) // 2
+
+    def __getitem__(self, index: int) -> float:
+        return self.values[index * 2]
+
+class TextArtifactError(Exception):
+    """The artifact is missing, truncated or from an unknown version"""
+
+def artifact_path(output_path: str, book_id: str) -> str:
+    """Location of a book's text artifact"""
+    return os.path.join(output_path, f"{book_id}{ARTIFACT_EXTENSION}")
+
+def write_text_artifact(
+    path: str,
+    normalized: NormalizedText,
+    times: Optional[Sequence[Tuple[float, float]]] = None,
+    block_size: int = 64 * 1024
+) -> None:
+    """Write the artifact atomically (blocking; run in a worker thread)"""
+    sentence_count = len(normalized.sentences)
+    page_count = normalized.page_count
+
+    sentence_index = np.zeros(sentence_count, dtype=_SENTENCE_DTYPE)
+    sentence_bytes = np.zeros(sentence_count + 1, dtype=np.uint64)
+    blocks: List[bytes] = []
+    block_rows = []
+    pending = bytearray()
+    data_offset = 0
+    text_offset = 0
+
+    def flush_block():
+        nonlocal pending, data_offset
+        compressed = zlib.compress(bytes(pending), 6)
+        block_rows.append((data_offset, len(compressed), len(pending)))
+        blocks.append(compressed)
+        data_offset += len(compressed)
+        pending = bytearray()
+
+    for index, sentence in enumerate(normalized.sentences):
+        encoded = sentence.encode("utf-8")
+        if pending and len(pending) + len(encoded) > block_size:
+            flush_block()
+        sentence_index[index] = (len(blocks), len(pending), len(encoded))
+        sentence_bytes[index] = text_offset
+        pending += encoded
+        text_offset += len(encoded)
+    sentence_bytes[sentence_count] = text_offset
+    if pending:
+        flush_block()
+
+    page_index = np.zeros(page_count + 1, dtype=_PAGE_DTYPE)
+    page_index["sentence"][:page_count] = normalized.page_offsets
+    page_index["sentence"][page_count] = sentence_count
+    page_index["offset"] = sentence_bytes[page_index["sentence"]]
+
+    time_index = np.full(sentence_count, np.nan, dtype=_TIME_DTYPE)
+    if times is not None:
+        time_index["start"], time_index["end"] = np.asarray(times, dtype=np.float64).reshape(-1, 2).T
+
+    block_index = np.asarray(block_rows, dtype=np.uint64).reshape(-1, 3)
+    block_table = np.zeros(len(block_rows), dtype=_BLOCK_DTYPE)
+    if block_rows:
+        block_table["offset"], block_table["compressed"], block_table["raw"] = block_index.T
+
+    page_section = _HEADER.size
+    sentence_section = page_section + page_index.nbytes
+    time_section = sentence_section + sentence_index.nbytes
+    block_section = time_section + time_index.nbytes
+    data_section = block_section + block_table.nbytes
+
+    header = _HEADER.pack(
+        ARTIFACT_MAGIC, ARTIFACT_VERSION, 0,
+        page_count, sentence_count, len(blocks), block_size,
+        page_section, sentence_section, time_section, block_section, data_section
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(page_index.tobytes())
+        f.write(sentence_index.tobytes())
+        f.write(time_index.tobytes())
+        f.write(block_table.tobytes())
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+
+class TextArtifact:
+    """
+    Read-only view of a text artifact. Indexes are numpy arrays over the mmap
+    (no copies); blocks are decompressed on demand and kept in a small LRU.
+    """
+
+    def __init__(self, path: str, cached_blocks: int = 8):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise TextArtifactError(f"Empty text artifact: {path}")
+
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise TextArtifactError(f"Truncated text artifact: {path}")
+
+        (magic, version, _flags, self.page_count, self.sentence_count, block_count, self.block_size,
+         page_section, sentence_section, time_section, block_section, self._data_section) = _HEADER.unpack_from(self._mmap)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+            self.close()
+            raise TextArtifactError(f"Unsupported text artifact: {path}")
+
+        try:
+            self.pages = np.frombuffer(self._mmap, _PAGE_DTYPE, self.page_count + 1, page_section)
+            self.sentences = np.frombuffer(self._mmap, _SENTENCE_DTYPE, self.sentence_count, sentence_section)
+            self.times = np.frombuffer(self._mmap, _TIME_DTYPE, self.sentence_count, time_section)
+            self.blocks = np.frombuffer(self._mmap, _BLOCK_DTYPE, block_count, block_section)
+            self._time_values = memoryview(self._mmap)[time_section:time_section + self.times.nbytes].cast("d")
+        except ValueError:
+            self.close()
+            raise TextArtifactError(f"Truncated text artifact: {path}")
+
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._cached_blocks = cached_blocks
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "TextArtifact":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # Drop our numpy views first; an mmap with exported buffers cannot close
+        for name in ("pages", "sentences", "times", "blocks"):
+            self.__dict__.pop(name, None)
+        time_values = self.__dict__.pop("_time_values", None)
+        if time_values is not None:
+            time_values.release()
+        if getattr(self, "_mmap", None) is not None and not self._mmap.closed:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # a caller still holds a view; unmapped when it is collected
+        self._file.close()
+
+    def _block(self, number: int) -> bytes:
+        with self._lock:
+            block = self._cache.get(number)
+            if block is not None:
+                self._cache.move_to_end(number)
+                return block
+
+        offset, compressed, raw = self.blocks[number]
+        start = self._data_section + int(offset)
+        block = zlib.decompress(memoryview(self._mmap)[start:start + int(compressed)], bufsize=int(raw))
+
+        with self._lock:
+            self._cache[number] = block
+            if len(self._cache) > self._cached_blocks:
+                self._cache.popitem(last=False)
+        return block
+
+    def sentence(self, index: int) -> str:
+        """Text of one sentence"""
+        if not 0 <= index < self.sentence_count:
+            raise IndexError(index)
+        block, offset, length = self.sentences[index]
+        return self._block(int(block))[offset:offset + length].decode("utf-8")
+
+    def sentence_range(self, start: int, end: int) -> List[str]:
+        """Sentences [start, end), decompressing each touched block once"""
+        start = max(0, start)
+        end = min(self.sentence_count, end)
+        result = []
+        for block, offset, length in self.sentences[start:end]:
+            result.append(self._block(int(block))[offset:offset + length].decode("utf-8"))
+        return result
+
+    def page_bounds(self, page: int) -> Tuple[int, int]:
+        """Sentence range [start, end) that starts on `page` (0-based)"""
+        if not 0 <= page < self.page_count:
+            raise IndexError(page)
+        return int(self.pages["sentence"][page]), int(self.pages["sentence"][page + 1])
+
+    def page_sentences(self, page: int) -> List[str]:
+        """Sentences starting on `page` (0-based)"""
+        return self.sentence_range(*self.page_bounds(page))
+
+    def page_of_sentence(self, index: int) -> int:
+        """0-based page a sentence starts on"""
+        return int(np.searchsorted(self.pages["sentence"][:self.page_count], index, side="right")) - 1
+
+    def sentence_times(self, index: int) -> Optional[Tuple[float, float]]:
+        """(start, end) audio time of a sentence in seconds, None until aligned"""
+        start, end = self.times[index]
+        if np.isnan(start):
+            return None
+        return float(start), float(end)
+
+    @property
+    def aligned(self) -> bool:
+        """Whether the time index has been filled in"""
+        return self.sentence_count > 0 and not np.isnan(self._time_values[0])
+
+    def sentence_at(self, seconds: float) -> int:
+        """
+        Sentence being read at `seconds` into the book's audio: the last one
+        starting at or before it. A binary search over the mmap, no copies.
+        """
+        index = bisect.bisect_right(_StartTimes(self._time_values), seconds) - 1
+        return min(max(index, 0), self.sentence_count - 1)
+
+    @property
+    def text_bytes(self) -> int:
+        """Size of the uncompressed text"""
+        return int(self.pages["offset"][self.page_count])
+
+def update_sentence_times(path: str, times: Sequence[Tuple[float, float]]) -> None:
+    """Overwrite the time index in place once audio has been aligned (blocking)"""
+    with open(path, "r+b") as f:
+        header = _HEADER.unpack(f.read(_HEADER.size))
+        sentence_count, time_section = header[4], header[9]
+        values = np.asarray(times, dtype=np.float64).reshape(-1, 2)
+        if len(values) != sentence_count:
+            raise TextArtifactError(f"Expected {sentence_count} sentence times, got {len(values)}")
+        table = np.zeros(sentence_count, dtype=_TIME_DTYPE)
+        table["start"], table["end"] = values.T
+        f.seek(time_section)
+        f.write(table.tobytes())
+
+_open_artifacts: "OrderedDict[str, Tuple[Tuple[int, int, float], TextArtifact]]" = OrderedDict()
+
+def cached_text_artifact(path: str, limit: int = 32) -> Optional[TextArtifact]:
+    """
+    An artifact kept open between calls, reopened when the file changes, so
+    lookups skip the open/mmap. For synchronous use on the event loop only:
+    an artifact pushed out of the cache is closed straight away. Only stats
+    the file on a hit.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        entry = _open_artifacts.pop(path, None)
+        if entry is not None:
+            entry[1].close()
+        return None
+
+    key = (stat.st_ino, stat.st_size, stat.st_mtime)
+    entry = _open_artifacts.get(path)
+    if entry is not None and entry[0] == key:
+        _open_artifacts.move_to_end(path)
+        return entry[1]
+    if entry is not None:
+        entry[1].close()
+        del _open_artifacts[path]
+
+    artifact = open_text_artifact(path)
+    if artifact is not None:
+        _open_artifacts[path] = (key, artifact)
+        while len(_open_artifacts) > limit:
+            _open_artifacts.popitem(last=False)[1][1].close()
+    return artifact
+
+def open_text_artifact(path: str) -> Optional[TextArtifact]:
+    """Open an artifact, or None if it is missing or unreadable (blocking)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return TextArtifact(path)
+    except (OSError, TextArtifactError) as e:
+        logger.warning(f"⚠️ Ignoring unreadable text artifact {path}: {e}")
+        return None
+
+__all__ = [
+    'ARTIFACT_VERSION',
+    'TextArtifact',
+    'TextArtifactError',
+    'artifact_path',
+    'write_text_artifact',
+    'update_sentence_times',
+    'open_text_artifact',
+    'cached_text_artifact'
+]
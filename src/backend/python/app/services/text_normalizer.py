@@ -0,0 +1,180 @@
+"""
+Text normalization and sentence segmentation for TTS
+Turns raw extracted page text into speakable sentences
+"""
+
+import bisect
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+# Bump whenever the output of this module changes, so cached results are rebuilt
+NORMALIZER_VERSION = 1
+
+# Abbreviations that end with a period but don't end a sentence
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "ft", "vs", "etc",
+    "e.g", "i.e", "cf", "al", "fig", "figs", "eq", "no", "nos", "vol", "vols",
+    "ch", "chap", "sec", "p", "pp", "ed", "eds", "inc", "ltd", "co", "corp",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+    "gen", "gov", "sen", "rep", "rev", "hon", "capt", "col", "lt", "sgt", "approx"
+}
+
+_SOFT_HYPHEN = "­"
+_HYPHENATED_BREAK = re.compile(r"(\w)-[ \t]*\n[ \t]*([a-z])")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n+")
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*(?=\s+|$)")
+_CLAUSE_BREAK = re.compile(r"[,;:—–]\s+")
+
+@dataclass
+class NormalizedText:
+    """Speakable sentences plus the index of the first sentence on each page"""
+    sentences: List[str] = field(default_factory=list)
+    page_offsets: List[int] = field(default_factory=list)
+    boilerplate_chars_removed: int = 0
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_offsets)
+
+    def page_of_sentence(self, index: int) -> int:
+        """Page number (0-based) containing a sentence"""
+        return max(0, bisect.bisect_right(self.page_offsets, index) - 1)
+
+def normalize_page(text: str) -> List[str]:
+    """Clean one page of extracted text and return its paragraphs"""
+    # NFKC folds ligatures (ﬁ, ﬂ, ﬃ...), full-width forms and odd spaces
+    text = unicodedata.normalize("NFKC", text).replace(_SOFT_HYPHEN, "")
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    # Re-join words hyphenated across line breaks
+    text = _HYPHENATED_BREAK.sub(r"\1\2", text)
+
+    paragraphs = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = _WHITESPACE.sub(" ", paragraph).strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+def split_sentences(paragraph: str) -> List[str]:
+    """Abbreviation-aware sentence splitting of a single paragraph"""
+    sentences = []
+    start = 0
+
+    for match in _SENTENCE_END.finditer(paragraph):
+        end = match.end()
+        candidate = paragraph[start:end]
+
+        # The word the punctuation is attached to, e.g. "Dr" in "Dr."
+        words = candidate[:match.start() - start].split()
+        last_word = words[-1].lower().strip("(\"'“‘") if words else ""
+        if match.group().startswith(".") and (
+            last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha())
+        ):
+            continue
+
+        # A lowercase continuation means the period was not a sentence end
+        rest = paragraph[end:].lstrip()
+        if rest and rest[0].islower():
+            continue
+
+        sentence = candidate.strip()
+        if sentence:
+            sentences.append(sentence)
+        start = end
+
+    tail = paragraph[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+def split_long_sentence(sentence: str, max_chars: int) -> List[str]:
+    """Split a sentence longer than `max_chars` at clause breaks, then at spaces"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+
+    pieces = []
+    current = ""
+    for part in _split_keep(sentence, _CLAUSE_BREAK):
+        if len(current) + len(part) <= max_chars:
+            current += part
+            continue
+        if current:
+            pieces.append(current.strip())
+        current = part
+        # A single clause that is still too long is cut at word boundaries
+        while len(current) > max_chars:
+            cut = current.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(current[:cut].strip())
+            current = current[cut:]
+    if current.strip():
+        pieces.append(current.strip())
+    return pieces
+
+def normalize_pages(pages: List[str], max_sentence_chars: int) -> NormalizedText:
+    """Normalize extracted pages into sentences with page offsets"""
+    result = NormalizedText()
+    carry = ""
+
+    for page in pages:
+        result.page_offsets.append(len(result.sentences))
+        paragraphs = normalize_page(page)
+
+        # A sentence running over the page break continues on the next page
+        if carry and paragraphs and not paragraphs[0][:1].isupper():
+            paragraphs[0] = f"{carry} {paragraphs[0]}"
+            result.page_offsets[-1] -= 1
+            result.sentences.pop()
+        carry = ""
+
+        for paragraph in paragraphs:
+            for sentence in split_sentences(paragraph):
+                result.sentences.extend(split_long_sentence(sentence, max_sentence_chars))
+
+        if result.sentences and paragraphs and not _SENTENCE_END.search(result.sentences[-1][-3:]):
+            carry = result.sentences[-1]
+
+    return result
+
+def chunk_sentences(sentences: List[str], max_chars: int) -> List[Tuple[int, int]]:
+    """Group consecutive sentences into [start, end) ranges of at most `max_chars`"""
+    chunks = []
+    start = 0
+    size = 0
+
+    for index, sentence in enumerate(sentences):
+        length = len(sentence) + 1
+        if index > start and size + length > max_chars:
+            chunks.append((start, index))
+            start = index
+            size = 0
+        size += length
+
+    if start < len(sentences):
+        chunks.append((start, len(sentences)))
+    return chunks
+
+def _split_keep(text: str, pattern: "re.Pattern") -> List[str]:
+    """Split text after each match of `pattern`, keeping the delimiters"""
+    parts = []
+    start = 0
+    for match in pattern.finditer(text):
+        parts.append(text[start:match.end()])
+        start = match.end()
+    parts.append(text[start:])
+    return [part for part in parts if part]
+
+__all__ = [
+    'NORMALIZER_VERSION',
+    'NormalizedText',
+    'normalize_page',
+    'normalize_pages',
+    'split_sentences',
+    'split_long_sentence',
+    'chunk_sentences'
+]
@@ -0,0 +1,501 @@
+"""
+Text-to-speech synthesis engine
+Batches sentences into provider-sized requests, runs them concurrently under a
+per-provider semaphore and rate budget, retries failed chunks on their own and
+reassembles the audio in order. Chunks already synthesized with the same
+text and voice come from the segment cache instead of the provider.
+
+Providers:
+    gtts        Google Translate TTS (gTTS), MP3
+    elevenlabs  ElevenLabs HTTP API, MP3
+    synthetic   Deterministic local tone generator, WAV; for offline runs and benchmarks
+"""
+
+import io
+import re
+import math
+import time
+import wave
+import random
+import functools
+import asyncio
+import hashlib
+import logging
+import itertools
+import resource
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Callable, Awaitable, Tuple, AsyncIterator, Deque
+
+import numpy as np
+
+from app.config import get_settings
+from app.services.mp3_frames import audio_frames
+from app.services.segment_cache import SegmentCache, cache_key, segment_cache
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Bump when batching or provider requests change in a way that alters audio
+TTS_ENGINE_VERSION = 1
+
+class TTSProviderError(Exception):
+    """A synthesis request failed; `retryable` says whether trying again can help"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+@dataclass
+class TextChunk:
+    """Consecutive sentences sent to the provider as one request"""
+    index: int
+    sentence_start: int
+    sentence_end: int  # exclusive
+    text: str
+
+@dataclass
+class ChunkAudio:
+    chunk: TextChunk
+    audio: bytes
+    duration: float
+    attempts: int  # 0 when served from the cache
+
+@dataclass
+class SynthesisResult:
+    """Reassembled audio plus per-chunk timing"""
+    audio: bytes
+    audio_format: str  # "mp3" or "wav"
+    duration: float
+    chunks: List[Tuple[int, int, float]] = field(default_factory=list)  # (sentence start, end, duration)
+    retries: int = 0
+    cache_hits: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def requests(self) -> int:
+        return len(self.chunks)
+
+class RateBudget:
+    """Token bucket allowing `per_minute` requests, with bursts up to `burst`"""
+
+    def __init__(self, per_minute: float, burst: Optional[int] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(1, int(per_minute // 6)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class TTSProvider:
+    """Base class: one remote or local voice service"""
+
+    name = "base"
+    audio_format = "mp3"
+    max_chars = 1000
+    concurrency = 4
+    requests_per_minute = 120
+
+    async def synthesize(self, text: str, voice: Dict[str, object]) -> bytes:
+        raise NotImplementedError
+
+    def duration(self, audio: bytes) -> float:
+        """Playback length of one response"""
+        return sum(frame.duration for frame in audio_frames(audio))
+
+class GTTSProvider(TTSProvider):
+    name = "gtts"
+    max_chars = 500  # gTTS splits further internally, sequentially, so keep requests small
+    concurrency = 4
+    requests_per_minute = 60
+
+    async def synthesize(self, text: str, voice: Dict[str, object]) -> bytes:
+        return await asyncio.to_thread(self._synthesize, text, str(voice.get("language") or "en"))
+
+    @staticmethod
+    def _synthesize(text: str, language: str) -> bytes:
+        from gtts import gTTS
+        from gtts.tts import gTTSError
+
+        buffer = io.BytesIO()
+        try:
+            gTTS(text=text, lang=language[:2]).write_to_fp(buffer)
+        except gTTSError as e:
+            status = getattr(getattr(e, "rsp", None), "status_code", None)
+            raise TTSProviderError(str(e), retryable=status is None or status == 429 or status >= 500)
+        return buffer.getvalue()
+
+# ElevenLabs voice IDs are 20 alphanumerics; preferences like "neural" or "Premium" aren't IDs
+_ELEVENLABS_VOICE_ID = re.compile(r"^[A-Za-z0-9]{20}$")
+
+def elevenlabs_voice_id(voice_type: Optional[object]) -> str:
+    """The voice for a voice_type preference: as mapped in ELEVENLABS_VOICES, a literal voice ID, or the default"""
+    voice_type = str(voice_type or "").strip()
+    mapped = settings.elevenlabs_voice_ids.get(voice_type.lower())
+    if mapped:
+        return mapped
+    if _ELEVENLABS_VOICE_ID.match(voice_type):
+        return voice_type
+    return settings.elevenlabs_voice_id
+
+class ElevenLabsProvider(TTSProvider):
+    name = "elevenlabs"
+    max_chars = 2500
+    concurrency = 2  # concurrent request limit of the smaller subscription tiers
+    requests_per_minute = 120
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client = None
+
+    def _http(self):
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url="https://api.elevenlabs.io",
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=self.concurrency * 2)
+            )
+        return self._client
+
+    async def synthesize(self, text: str, voice: Dict[str, object]) -> bytes:
+        import httpx
+
+        voice_id = elevenlabs_voice_id(voice.get("voice_type"))
+        try:
+            response = await self._http().post(
+                f"/v1/text-to-speech/{voice_id}",
+                headers={"xi-api-key": self.api_key, "Accept": "audio/mpeg"},
+                params={"output_format": "mp3_44100_128"},
+                json={"text": text, "model_id": settings.elevenlabs_model_id}
+            )
+        except httpx.HTTPError as e:
+            raise TTSProviderError(f"ElevenLabs request failed: {e}")
+
+        if response.status_code != 200:
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise TTSProviderError(f"ElevenLabs returned {response.status_code}: {response.text[:200]}", retryable)
+        return response.content
+
+@functools.lru_cache(maxsize=1024)
+def _tone(sample_rate: int, pitch: int, speed: float) -> bytes:
+    """One synthetic word: a short enveloped tone followed by a gap"""
+    t = np.arange(int(sample_rate * 0.3 / speed)) / sample_rate
+    envelope = np.minimum(1.0, np.minimum(t, t[::-1]) * 50)
+    tone = (np.sin(2 * math.pi * pitch * t) * envelope * 8000).astype(np.int16)
+    gap = np.zeros(int(sample_rate * 0.05 / speed), dtype=np.int16)
+    return np.concatenate([tone, gap]).tobytes()
+
+class SyntheticProvider(TTSProvider):
+    """
+    Deterministic stand-in voice: a tone per word whose pitch comes from the
+    word's hash, at roughly speaking pace. `latency` and `failure_rate`
+    imitate a remote service for benchmarks.
+    """
+
+    name = "synthetic"
+    audio_format = "wav"
+    max_chars = 1000
+    concurrency = 8
+    requests_per_minute = 6000
+    sample_rate = 22050
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    async def synthesize(self, text: str, voice: Dict[str, object]) -> bytes:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise TTSProviderError("Synthetic failure")
+        speed = float(voice.get("audio_speed") or 1.0)
+        return await asyncio.to_thread(self.render, text, speed)
+
+    def render(self, text: str, speed: float = 1.0) -> bytes:
+        """PCM for `text`; the same text always produces the same bytes"""
+        pcm = b"".join(
+            _tone(self.sample_rate, 120 + int.from_bytes(hashlib.blake2s(word.encode(), digest_size=2).digest(), "big") % 120, speed)
+            for word in text.split()
+        )
+        return self.wav(pcm)
+
+    def wav(self, pcm: bytes) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sample_rate)
+            out.writeframes(pcm)
+        return buffer.getvalue()
+
+    def duration(self, audio: bytes) -> float:
+        with wave.open(io.BytesIO(audio)) as source:
+            return source.getnframes() / source.getframerate()
+
+def _is_cut_point(sentence: str) -> bool:
+    """Content-defined boundary: about one sentence in four, decided by its text alone"""
+    return hashlib.blake2s(sentence.encode("utf-8"), digest_size=1).digest()[0] & 0x03 == 0
+
+def batch_sentences(sentences: List[str], max_chars: int, first_sentence: int = 0) -> List[TextChunk]:
+    """
+    Group consecutive sentences into requests of at most `max_chars` (one
+    sentence minimum). Past half the limit a chunk ends at content-defined cut
+    points, so an edit early in a book only changes nearby chunks and the rest
+    still hit the segment cache.
+    """
+    chunks = []
+    start = 0
+    length = 0
+
+    def close(end: int) -> None:
+        chunks.append(TextChunk(len(chunks), first_sentence + start, first_sentence + end, " ".join(sentences[start:end])))
+
+    for index, sentence in enumerate(sentences):
+        if index > start and length + 1 + len(sentence) > max_chars:
+            close(index)
+            start = index
+            length = 0
+        length += len(sentence) + (1 if index > start else 0)
+        if length >= max_chars // 2 and _is_cut_point(sentence):
+            close(index + 1)
+            start = index + 1
+            length = 0
+    if start < len(sentences):
+        close(len(sentences))
+    return chunks
+
+def join_audio(parts: List[bytes], audio_format: str) -> bytes:
+    """Concatenate same-format responses in order"""
+    if audio_format == "wav":
+        pcm = bytearray()
+        params = None
+        for part in parts:
+            with wave.open(io.BytesIO(part)) as source:
+                params = params or source.getparams()
+                pcm += source.readframes(source.getnframes())
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            if params is None:
+                out.setnchannels(1)
+                out.setsampwidth(2)
+                out.setframerate(SyntheticProvider.sample_rate)
+            else:
+                out.setparams(params)
+            out.writeframes(bytes(pcm))
+        return buffer.getvalue()
+
+    # MP3 frames are self-contained; drop each part's ID3 tag and Xing header, keep the frames
+    joined = bytearray()
+    for part in parts:
+        for frame in audio_frames(part):
+            joined += part[frame.offset:frame.offset + frame.length]
+    return bytes(joined)
+
+class TTSEngine:
+    """Shared by every conversion, so provider limits hold across books"""
+
+    def __init__(self, max_retries: int = 3, retry_base_delay: float = 1.0, cache: Optional[SegmentCache] = None):
+        self.max_retries = max_retries
+        self.cache = cache
+        self.retry_base_delay = retry_base_delay
+        self._providers: Dict[str, TTSProvider] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._budgets: Dict[str, RateBudget] = {}
+
+    def register(self, provider: TTSProvider, concurrency: Optional[int] = None) -> None:
+        self._providers[provider.name] = provider
+        self._semaphores[provider.name] = asyncio.Semaphore(concurrency or provider.concurrency)
+        self._budgets[provider.name] = RateBudget(provider.requests_per_minute)
+
+    def provider(self, name: Optional[str] = None) -> TTSProvider:
+        name = name or settings.tts_provider
+        if name not in self._providers:
+            self.register(create_provider(name))
+        return self._providers[name]
+
+    async def _synthesize_chunk(self, provider: TTSProvider, chunk: TextChunk, voice: Dict[str, object]) -> ChunkAudio:
+        """One request, retried with backoff on its own so other chunks keep going"""
+        key = None
+        if self.cache is not None:
+            key = cache_key(chunk.text, voice, provider.name, TTS_ENGINE_VERSION)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return ChunkAudio(chunk, cached, provider.duration(cached), attempts=0)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self._semaphores[provider.name]:
+                    await self._budgets[provider.name].acquire()
+                    audio = await provider.synthesize(chunk.text, voice)
+                if key is not None:
+                    await asyncio.to_thread(self.cache.put, key, audio, provider.audio_format)
+                return ChunkAudio(chunk, audio, provider.duration(audio), attempt)
+            except TTSProviderError as e:
+                if not e.retryable or attempt > self.max_retries:
+                    raise
+                delay = self.retry_base_delay * (2 ** (attempt - 1)) * (0.5 + random.random())
+                logger.warning(f"⚠️ {provider.name} chunk {chunk.index} failed ({e}); retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def synthesize_stream(
+        self,
+        sentences: List[str],
+        voice: Optional[Dict[str, object]] = None,
+        provider_name: Optional[str] = None,
+        first_sentence: int = 0,
+        on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+        lookahead: Optional[int] = None
+    ) -> AsyncIterator[ChunkAudio]:
+        """
+        Yield chunk audio in order as it becomes available. At most `lookahead`
+        chunks are in flight or waiting to be consumed, so memory stays bounded
+        however long the text is.
+        """
+        voice = voice or {}
+        provider = self.provider(provider_name)
+        chunks = batch_sentences(sentences, provider.max_chars, first_sentence)
+        lookahead = lookahead or max(2, provider.concurrency * 2)
+
+        async def run(chunk: TextChunk) -> ChunkAudio:
+            result = await self._synthesize_chunk(provider, chunk, voice)
+            if on_progress is not None:
+                await on_progress(chunk.sentence_end - chunk.sentence_start)
+            return result
+
+        pending: Deque[asyncio.Task] = deque()
+        upcoming = iter(chunks)
+        try:
+            for chunk in itertools.islice(upcoming, lookahead):
+                pending.append(asyncio.create_task(run(chunk)))
+            while pending:
+                result = await pending.popleft()
+                for chunk in itertools.islice(upcoming, 1):
+                    pending.append(asyncio.create_task(run(chunk)))
+                yield result
+        finally:
+            # A chunk that failed for good (or a consumer that stopped) ends the request
+            for task in pending:
+                task.cancel()
+
+    async def synthesize(
+        self,
+        sentences: List[str],
+        voice: Optional[Dict[str, object]] = None,
+        provider_name: Optional[str] = None,
+        first_sentence: int = 0,
+        on_progress: Optional[Callable[[int], Awaitable[None]]] = None
+    ) -> SynthesisResult:
+        """Synthesize sentences into one in-memory result (short texts; use synthesize_stream for books)"""
+        started = time.monotonic()
+        provider = self.provider(provider_name)
+        results = [
+            result async for result in self.synthesize_stream(
+                sentences, voice, provider_name, first_sentence, on_progress, lookahead=len(sentences) or 1
+            )
+        ]
+
+        return SynthesisResult(
+            audio=await asyncio.to_thread(join_audio, [result.audio for result in results], provider.audio_format),
+            audio_format=provider.audio_format,
+            duration=sum(result.duration for result in results),
+            chunks=[(r.chunk.sentence_start, r.chunk.sentence_end, r.duration) for r in results],
+            retries=sum(max(0, result.attempts - 1) for result in results),
+            cache_hits=sum(1 for result in results if result.attempts == 0),
+            elapsed=time.monotonic() - started
+        )
+
+def wav_pcm(data: bytes) -> Tuple[bytes, int, int]:
+    """(PCM frames, sample rate, channels) of a 16-bit WAV response"""
+    with wave.open(io.BytesIO(data)) as source:
+        if source.getsampwidth() != 2:
+            raise TTSProviderError("Only 16-bit PCM is supported", retryable=False)
+        return source.readframes(source.getnframes()), source.getframerate(), source.getnchannels()
+
+def create_provider(name: str) -> TTSProvider:
+    """Provider instance for a configured name"""
+    if name == "gtts":
+        return GTTSProvider()
+    if name == "elevenlabs":
+        if not settings.elevenlabs_api_key:
+            raise TTSProviderError("ELEVENLABS_API_KEY is not configured", retryable=False)
+        return ElevenLabsProvider(settings.elevenlabs_api_key)
+    if name == "synthetic":
+        return SyntheticProvider()
+    raise TTSProviderError(f"Unknown TTS provider: {name}", retryable=False)
+
+async def benchmark(
+    sentence_counts: Tuple[int, ...] = (1000, 4000),
+    concurrency_levels: Tuple[int, ...] = (1, 4, 8, 16),
+    latency: float = 0.05,
+    failure_rate: float = 0.02
+) -> List[Dict[str, float]]:
+    """
+    Offline throughput of the engine against the synthetic provider. Audio is
+    streamed and discarded, as the encoder would consume it, so peak RSS
+    should not grow with the sentence count.
+    """
+    rows = []
+    for sentence_count in sentence_counts:
+        sentences = [f"This is synthetic benchmark sentence number {i}, read at a steady pace." for i in range(sentence_count)]
+        for concurrency in concurrency_levels:
+            engine = TTSEngine(retry_base_delay=0.01)
+            engine.register(SyntheticProvider(latency=latency, failure_rate=failure_rate, seed=concurrency), concurrency)
+            started = time.monotonic()
+            requests = retries = 0
+            audio_seconds = 0.0
+            async for result in engine.synthesize_stream(sentences, provider_name="synthetic"):
+                requests += 1
+                retries += max(0, result.attempts - 1)
+                audio_seconds += result.duration
+            elapsed = time.monotonic() - started
+            rows.append({
+                "sentences": sentence_count,
+                "concurrency": concurrency,
+                "requests": requests,
+                "retries": retries,
+                "seconds": round(elapsed, 3),
+                "audio_seconds": round(audio_seconds, 1),
+                "realtime_factor": round(audio_seconds / elapsed, 1),
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            })
+    return rows
+
+tts_engine = TTSEngine(max_retries=settings.tts_max_retries, cache=segment_cache)
+
+__all__ = [
+    'TTS_ENGINE_VERSION',
+    'TTSEngine',
+    'TTSProvider',
+    'TTSProviderError',
+    'GTTSProvider',
+    'ElevenLabsProvider',
+    'elevenlabs_voice_id',
+    'SyntheticProvider',
+    'SynthesisResult',
+    'RateBudget',
+    'batch_sentences',
+    'join_audio',
+    'wav_pcm',
+    'create_provider',
+    'benchmark',
+    'tts_engine'
+]
+
+if __name__ == "__main__":
+    for row in asyncio.run(benchmark()):
+        print(row)
@@ -0,0 +1,300 @@
+"""
+Audio variants and content negotiation
+The converted MP3 (128 kbps) is the source; lower-bitrate MP3 and Opus
+variants are transcoded from it in the background on first request (or
+eagerly, per AUDIO_VARIANTS), one ffmpeg run per file even when many
+listeners ask at once, and kept next to it until the source changes. Speech loses little at
+24-48 kbps Opus, so constrained clients download several times less.
+Playback speeds are rendered the same way through ffmpeg's pitch-preserving
+atempo filter, for whole files and for single HLS segments.
+"""
+
+import os
+import re
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional
+
+from app.config import get_settings
+from app.services.audio_encoder import EncoderError, transcode
+from app.services.hls import hls_dir, read_segment_start, retime_segment
+from app.services.artifact_store import artifact_store
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Variant:
+    name: str
+    format: str  # "mp3" or "opus"
+    quality: str  # "low", "medium" or "high"
+    bitrate: Optional[str]  # None: the source file itself
+    extension: str
+    media_type: str
+
+    @property
+    def is_source(self) -> bool:
+        return self.bitrate is None
+
+    def codec_args(self, speed: float = 1.0) -> List[str]:
+        # Speech is mono; Opus' VOIP tuning favours intelligibility at low rates
+        bitrate = self.bitrate or settings.audio_bitrate
+        args = ["-filter:a", f"atempo={speed:g}"] if speed != 1.0 else []
+        if self.format == "opus":
+            return args + ["-ac", "1", "-c:a", "libopus", "-b:a", bitrate, "-vbr", "on", "-application", "voip", "-f", "ogg"]
+        return args + ["-ac", "1", "-c:a", "libmp3lame", "-b:a", bitrate, "-f", "mp3"]
+
+def _variant(audio_format: str, quality: str, bitrate: Optional[str]) -> Variant:
+    if audio_format == "opus":
+        return Variant(f"opus-{quality}", "opus", quality, bitrate, "opus", "audio/ogg; codecs=opus")
+    return Variant(f"mp3-{quality}", "mp3", quality, bitrate, "mp3", "audio/mpeg")
+
+VARIANTS: Dict[str, Variant] = {
+    variant.name: variant
+    for variant in (
+        _variant("opus", "low", "24k"),
+        _variant("opus", "medium", "32k"),
+        _variant("opus", "high", "48k"),
+        _variant("mp3", "low", "48k"),
+        _variant("mp3", "medium", "64k"),
+        _variant("mp3", "high", None),
+    )
+}
+SOURCE = VARIANTS["mp3-high"]
+QUALITIES = ("low", "medium", "high")
+
+# Playback speeds offered; others snap to the nearest, which keeps the cache bounded
+SPEEDS = (0.75, 1.0, 1.25, 1.5, 1.75, 2.0)
+
+# Client hints a response may depend on, so caches key on them too
+VARY = "Accept, Save-Data, ECT, Downlink"
+ACCEPT_CH = "Save-Data, ECT, Downlink"
+
+_VARIANT_FILE = re.compile(r"\.(?:" + "|".join(re.escape(name) for name in VARIANTS) + r")(?:\.s\d+)?\.(?:mp3|opus)(?:\.tmp)?$")
+
+def _accept_quality(accept: str) -> Dict[str, float]:
+    """Best q the Accept header gives each of our formats (wildcards count)"""
+    best = {"mp3": 0.0, "opus": 0.0}
+    for media_range in accept.split(","):
+        parts = [part.strip().lower() for part in media_range.split(";")]
+        media_type, params = parts[0], parts[1:]
+        q = 1.0
+        codecs = None
+        for param in params:
+            key, _, value = param.partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+            elif key == "codecs":
+                codecs = value.strip('"')
+
+        if media_type in ("audio/mpeg", "audio/mp3"):
+            formats = ["mp3"]
+        elif media_type == "audio/opus" or (media_type in ("audio/ogg", "application/ogg") and codecs in (None, "opus")):
+            formats = ["opus"]
+        elif media_type in ("audio/*", "*/*"):
+            # A wildcard isn't a promise of Opus support; only MP3 is universal
+            formats = ["mp3"]
+        else:
+            formats = []
+        for audio_format in formats:
+            best[audio_format] = max(best[audio_format], q)
+    return best
+
+def _hinted_quality(headers: Mapping[str, str]) -> Optional[str]:
+    """Quality implied by Save-Data / ECT / Downlink client hints, if any"""
+    if headers.get("save-data", "").strip().lower() == "on":
+        return "low"
+    ect = headers.get("ect", "").strip().lower()
+    if ect in ("slow-2g", "2g"):
+        return "low"
+    if ect == "3g":
+        return "medium"
+    try:
+        downlink = float(headers.get("downlink", ""))
+    except ValueError:
+        return None
+    if downlink < 1:
+        return "low"
+    if downlink < 5:
+        return "medium"
+    return None
+
+def negotiate(headers: Mapping[str, str], audio_format: Optional[str] = None, quality: Optional[str] = None) -> Variant:
+    """
+    Pick a variant: explicit query values win, then Accept for the format and
+    client hints for the quality. Without any signal this is the source MP3.
+    Raises ValueError for an unknown format or quality.
+    """
+    if audio_format is not None and audio_format not in ("mp3", "opus"):
+        raise ValueError(f"Unknown format '{audio_format}'; use mp3 or opus")
+    if quality is not None and quality not in QUALITIES:
+        raise ValueError(f"Unknown quality '{quality}'; use {', '.join(QUALITIES)}")
+
+    if audio_format is None:
+        accepted = _accept_quality(headers.get("accept", ""))
+        audio_format = "opus" if accepted["opus"] > 0 and accepted["opus"] >= accepted["mp3"] else "mp3"
+    if quality is None:
+        quality = _hinted_quality(headers) or ("medium" if audio_format == "opus" else "high")
+    return VARIANTS[f"{audio_format}-{quality}"]
+
+def snap_speed(speed: Optional[float]) -> float:
+    """The offered playback speed nearest to `speed` (1.0 when unset)"""
+    if not speed or speed <= 0:
+        return 1.0
+    return min(SPEEDS, key=lambda offered: abs(offered - speed))
+
+def _speed_tag(speed: float) -> str:
+    return f"s{round(speed * 100)}"
+
+def variant_path(source_path: str, variant: Variant, speed: float = 1.0) -> str:
+    """
+    `b1.mp3` -> `b1.opus-low.opus`, or `b1.opus-low.s150.opus` at 1.5x;
+    works for chapter files the same way
+    """
+    if variant.is_source and speed == 1.0:
+        return source_path
+    stem, _ = os.path.splitext(source_path)
+    tag = f".{_speed_tag(speed)}" if speed != 1.0 else ""
+    return f"{stem}.{variant.name}{tag}.{variant.extension}"
+
+def is_current(source_path: str, path: str) -> bool:
+    """A variant is reused until the source is re-rendered (blocking)"""
+    try:
+        return os.stat(path).st_mtime >= os.stat(source_path).st_mtime
+    except FileNotFoundError:
+        return False
+
+_inflight: Dict[str, asyncio.Task] = {}
+# Background renders that failed, reported to the next request for them
+_failures: Dict[str, EncoderError] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+async def _single_flight(path: str, render: Callable[[], Awaitable[None]]) -> str:
+    """
+    Run `render` to produce `path` unless a render of it is already running,
+    in which case wait for that one; a caller going away doesn't cancel it
+    for the others. Renders share the VARIANT_CONCURRENCY limit.
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, settings.variant_concurrency))
+
+    async def run() -> str:
+        async with _semaphore:
+            await render()
+        return path
+
+    task = _inflight.get(path)
+    if task is None:
+        task = asyncio.create_task(run())
+        _inflight[path] = task
+        task.add_done_callback(lambda _: _inflight.pop(path, None))
+    return await asyncio.shield(task)
+
+async def ensure_variant(source_path: str, variant: Variant, speed: float = 1.0) -> str:
+    """Path of the variant at `speed`, transcoding it first if it's missing or stale"""
+    path = variant_path(source_path, variant, speed)
+    if path == source_path or await asyncio.to_thread(is_current, source_path, path):
+        return path
+
+    async def render() -> None:
+        if not await asyncio.to_thread(is_current, source_path, path):
+            size = await transcode(source_path, path, variant.codec_args(speed))
+            logger.info(f"🎚️ Encoded {os.path.basename(path)} ({size / 1024 / 1024:.1f} MB)")
+            artifact_store.changed(os.path.basename(source_path).split(".", 1)[0])
+
+    return await _single_flight(path, render)
+
+def _note_failure(path: str, task: asyncio.Task) -> None:
+    if task.cancelled():
+        return
+    error = task.exception()
+    if isinstance(error, EncoderError):
+        _failures[path] = error
+    elif error is not None:
+        logger.error(f"❌ Rendering {os.path.basename(path)} failed: {error}")
+
+async def variant_if_ready(source_path: str, variant: Variant, speed: float = 1.0) -> Optional[str]:
+    """
+    Path of the variant at `speed` if it's rendered and current; otherwise
+    its render is started in the background and this returns None, so no
+    request waits for a whole-book transcode. Raises EncoderError if the
+    last background render failed (the next call starts another).
+    """
+    path = variant_path(source_path, variant, speed)
+    if path == source_path or await asyncio.to_thread(is_current, source_path, path):
+        return path
+    error = _failures.pop(path, None)
+    if error is not None:
+        raise error
+    if path not in _inflight:
+        task = asyncio.create_task(ensure_variant(source_path, variant, speed))
+        task.add_done_callback(lambda done: _note_failure(path, done))
+    return None
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def ensure_speed_segment(output_path: str, book_id: str, segment: str, speed: float) -> str:
+    """
+    An HLS segment time-stretched to `speed`, rendered from the 1x segment on
+    first request. Segment names are unique per render, so a rendered one is
+    never stale; its timestamp tag is rescaled to the sped-up timeline.
+    """
+    source_path = os.path.join(hls_dir(output_path, book_id), segment)
+    path = os.path.join(hls_dir(output_path, book_id), _speed_tag(speed), segment)
+    if await asyncio.to_thread(os.path.exists, path):
+        return path
+
+    async def render() -> None:
+        if await asyncio.to_thread(os.path.exists, path):
+            return
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        encoded_path = f"{path}.enc"
+        args = SOURCE.codec_args(speed) + ["-write_xing", "0", "-id3v2_version", "0"]
+        try:
+            await transcode(source_path, encoded_path, args)
+            start = await asyncio.to_thread(read_segment_start, source_path)
+            await asyncio.to_thread(retime_segment, encoded_path, path, start / speed)
+        finally:
+            await asyncio.to_thread(_remove_quietly, encoded_path)
+        artifact_store.changed(book_id)
+
+    return await _single_flight(path, render)
+
+def remove_variants(output_path: str, book_id: str) -> int:
+    """Delete every variant of a book's audio, whole-book and per chapter (blocking)"""
+    removed = 0
+    prefix = f"{book_id}."
+    with os.scandir(output_path) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix) and _VARIANT_FILE.search(entry.name):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+    return removed
+
+__all__ = [
+    'Variant',
+    'VARIANTS',
+    'SOURCE',
+    'VARY',
+    'ACCEPT_CH',
+    'SPEEDS',
+    'negotiate',
+    'snap_speed',
+    'variant_path',
+    'ensure_variant',
+    'variant_if_ready',
+    'ensure_speed_segment',
+    'remove_variants'
+]
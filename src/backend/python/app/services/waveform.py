@@ -0,0 +1,179 @@
+"""
+Waveform peaks for the player scrubber
+Min/max pairs are computed per chapter while audio is produced: from the PCM
+on its way to the encoder, or, for providers that return MP3, from each
+granule's global gain (a loudness estimate that needs no decoding). At the end
+the chapters are joined and reduced into levels of doubling samples-per-pixel,
+each written as an 8-bit audiowaveform .dat file (the format peaks.js and
+waveform-data.js read directly).
+"""
+
+import os
+import uuid
+import shutil
+import struct
+import logging
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+from app.services.mp3_frames import audio_frames, granule_gains
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_PER_PIXEL = 512  # finest level for PCM input
+MIN_LEVEL_LENGTH = 256  # stop halving once a level is this short
+DAT_VERSION = 1
+DAT_FLAG_8BIT = 0x1
+
+def peaks_dir(output_path: str, book_id: str) -> str:
+    """Directory holding a book's peak levels"""
+    return os.path.join(output_path, f"{book_id}.peaks")
+
+def remove_peaks(output_path: str, book_id: str) -> None:
+    """Delete a book's peak levels (blocking)"""
+    shutil.rmtree(peaks_dir(output_path, book_id), ignore_errors=True)
+
+class PeakBuilder:
+    """Min/max per pixel for one chapter, in [-1, 1]"""
+
+    def __init__(self):
+        self.sample_rate: Optional[int] = None
+        self.samples_per_pixel: Optional[int] = None
+        self.source: Optional[str] = None  # "pcm" or "mp3-gain"
+        self._mins: List[np.ndarray] = []
+        self._maxs: List[np.ndarray] = []
+        self._remainder = np.zeros(0, dtype=np.int16)
+
+    def add_pcm(self, pcm: bytes, sample_rate: int, channels: int = 1) -> None:
+        """Fold in interleaved s16le PCM; a partial pixel waits for the next call"""
+        self.sample_rate, self.samples_per_pixel, self.source = sample_rate, SAMPLES_PER_PIXEL, "pcm"
+        # Interleaved channels share a pixel, so its extremes cover all of them
+        block = SAMPLES_PER_PIXEL * channels
+        samples = np.concatenate((self._remainder, np.frombuffer(pcm, dtype="<i2")))
+        whole = len(samples) - len(samples) % block
+        self._remainder = samples[whole:].copy()
+        if whole:
+            pixels = samples[:whole].reshape(-1, block)
+            self._mins.append(pixels.min(axis=1).astype(np.float32) / 32768)
+            self._maxs.append(pixels.max(axis=1).astype(np.float32) / 32768)
+
+    def add_mp3(self, data: bytes) -> None:
+        """Fold in MP3 audio, one pixel per frame, from the granules' global gain (blocking)"""
+        levels = []
+        for frame in audio_frames(data):
+            if frame.layer != 3:
+                continue
+            if self.sample_rate is None:
+                self.sample_rate, self.samples_per_pixel, self.source = frame.sample_rate, frame.samples, "mp3-gain"
+            # Each global_gain step is 1.5 dB; granules without coded bits are silent
+            loudest = max(
+                (gain if length else 0 for length, gain in granule_gains(data, frame)),
+                default=0
+            )
+            levels.append(loudest)
+        if levels:
+            gains = np.array(levels, dtype=np.float32)
+            amplitude = np.where(gains > 0, np.power(2.0, (gains - 210) / 4), 0).astype(np.float32)
+            self._maxs.append(amplitude)
+            self._mins.append(-amplitude)
+
+    def finish(self) -> None:
+        """Count the trailing partial pixel"""
+        if len(self._remainder):
+            self._mins.append(np.array([self._remainder.min() / 32768], dtype=np.float32))
+            self._maxs.append(np.array([self._remainder.max() / 32768], dtype=np.float32))
+            self._remainder = np.zeros(0, dtype=np.int16)
+
+    def arrays(self):
+        """(mins, maxs) so far"""
+        empty = np.zeros(0, dtype=np.float32)
+        mins = np.concatenate(self._mins) if self._mins else empty
+        maxs = np.concatenate(self._maxs) if self._maxs else empty
+        return mins, maxs
+
+def _dat(mins: np.ndarray, maxs: np.ndarray, sample_rate: int, samples_per_pixel: int) -> bytes:
+    """audiowaveform binary format, version 1, 8-bit"""
+    header = struct.pack("<iIiiI", DAT_VERSION, DAT_FLAG_8BIT, sample_rate, samples_per_pixel, len(mins))
+    pairs = np.empty(len(mins) * 2, dtype=np.int8)
+    pairs[0::2] = np.clip(np.floor(mins * 128), -128, 127)
+    pairs[1::2] = np.clip(np.floor(maxs * 128), -128, 127)
+    return header + pairs.tobytes()
+
+def _halve(mins: np.ndarray, maxs: np.ndarray):
+    if len(mins) % 2:
+        mins, maxs = np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+    return mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+
+class BookPeaks:
+    """One PeakBuilder per chapter; write() joins them in order into the level files"""
+
+    def __init__(self, output_path: str, book_id: str):
+        self.directory = peaks_dir(output_path, book_id)
+        self.chapters: Dict[int, PeakBuilder] = {}
+
+    def chapter(self, index: int) -> PeakBuilder:
+        return self.chapters.setdefault(index, PeakBuilder())
+
+    def write(self) -> Optional[Dict[str, Any]]:
+        """
+        Write every level, replacing any previous render; returns the summary
+        stored with the book, or None if no audio was seen (blocking)
+        """
+        builders = [self.chapters[index] for index in sorted(self.chapters)]
+        reference = next((builder for builder in builders if builder.sample_rate), None)
+        if reference is None:
+            return None
+
+        for builder in builders:
+            builder.finish()
+        parts = [builder.arrays() for builder in builders]
+        mins = np.concatenate([part[0] for part in parts])
+        maxs = np.concatenate([part[1] for part in parts])
+        if reference.source == "mp3-gain":
+            # Gain is only relative loudness, so scale the loudest pixel to full height
+            loudest = float(maxs.max()) if len(maxs) else 0.0
+            if loudest > 0:
+                mins, maxs = mins / loudest, maxs / loudest
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        levels = []
+        samples_per_pixel = reference.samples_per_pixel
+        while True:
+            path = os.path.join(self.directory, f"{len(levels)}.dat")
+            with open(path, "wb") as f:
+                f.write(_dat(mins, maxs, reference.sample_rate, samples_per_pixel))
+            levels.append({"samples_per_pixel": samples_per_pixel, "length": int(len(mins))})
+            if len(mins) <= MIN_LEVEL_LENGTH:
+                break
+            mins, maxs = _halve(mins, maxs)
+            samples_per_pixel *= 2
+
+        logger.info(f"〰️ Wrote {len(levels)} peak levels ({levels[0]['length']} pixels at the finest)")
+        return {
+            "version": uuid.uuid4().hex[:8],
+            "source": reference.source,
+            "sample_rate": reference.sample_rate,
+            "levels": levels
+        }
+
+def level_path(output_path: str, book_id: str, peaks: Dict[str, Any], resolution: int) -> str:
+    """
+    File of the coarsest level that still has at least `resolution` pixels
+    (the finest level if none does)
+    """
+    levels = peaks["levels"]
+    chosen = 0
+    for index, level in enumerate(levels):
+        if level["length"] >= resolution:
+            chosen = index
+    return os.path.join(peaks_dir(output_path, book_id), f"{chosen}.dat")
+
+__all__ = [
+    'PeakBuilder',
+    'BookPeaks',
+    'peaks_dir',
+    'remove_peaks',
+    'level_path'
+]
@@ -133,6 +133,44 @@ export const PDFService = {
     }, accessToken);
   },
 
+  /**
+   * Get processing status for many books in one request
+   */
+  async getBatchStatus(
+    bookIds: string[],
+    accessToken: string
+  ): Promise<{success: boolean; data?: any; error?: string}> {
+    return apiCall(`/api/v1/pdf/status:batch`, {
+      method: 'POST',
+      body: JSON.stringify({ book_ids: bookIds })
+    }, accessToken);
+  },
+
+  /**
+   * Subscribe to pushed status/progress events instead of polling getStatus.
+   * Pass a bookId for one conversion, or a userId (with scope 'library') for all of them.
+   * EventSource can't send an Authorization header, so the token goes in the query string.
+   * Returns a function that closes the stream.
+   */
+  subscribeToStatus(
+    id: string,
+    accessToken: string,
+    onEvent: (event: { type: string; data: any }) => void,
+    scope: 'book' | 'library' = 'book'
+  ): () => void {
+    const path = scope === 'library' ? `user/${id}` : id;
+    const query = `access_token=${encodeURIComponent(accessToken)}`;
+    const source = new EventSource(`${config.baseURL}/api/v1/pdf/events/${path}?${query}`);
+
+    ['snapshot', 'status', 'progress'].forEach((type) => {
+      source.addEventListener(type, (message) => {
+        onEvent({ type, data: JSON.parse((message as MessageEvent).data) });
+      });
+    });
+
+    return () => source.close();
+  },
+
   /**
    * Delete PDF
    */